@@ -1,25 +1,42 @@
 from flask import Flask, render_template, request, jsonify, send_from_directory, Response, redirect, session
 from flask_cors import CORS
-import smtplib
+import io
 import os
-import re
 import json
-import csv
-import io
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 import logging
 import requests
-import secrets
 import hashlib
 from database import db
+from storage import database_configured
+from outbox import EmailOutbox
+from lead_queue import LeadQueue
+from lead_pipeline import LeadPipeline
+from lead_spool import LeadSpool, SpooledLeadId
+from mailer import SMTPConnectionPool
+from circuit_breaker import CLOSED, get_breaker, breaker_stats
+from geoip import load_table
+from ttl_cache import TTLCache
+from lead_export import EXPORT_FIELDS, stream_csv, stream_excel
+from session_store import SessionStore
+from tokens import TokenSigner
+from assets import load_manifest
+from page_cache import PageCache
+from website_config import WebsiteConfig
+from validators import validate_email, validate_phone
+from lead_ingest import detect_format, read_rows, ingest_rows
+from lead_rollups import ROLLUP_FIELDS
+from migrations import LATEST_VERSION as SCHEMA_VERSION, migrate
+from responsive_images import MANIFEST_PATH as IMAGE_VARIANTS_MANIFEST, load_variants
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+# /static is served by serve_static (precompressed and hashed builds), not Flask's built-in route
+app = Flask(__name__, static_folder=None)
 CORS(app)  # Enable CORS for all routes
 
 # Configuration
@@ -33,36 +50,86 @@ class Config:
     EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD') or 'your-app-password'
     TO_EMAIL = os.environ.get('TO_EMAIL') or 'marketingspecials9@gmail.com,info@dubaismartinvestments.com'
     
+    # Background workers that drain the email outbox (0 disables sending from this process)
+    EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS') or 2)
+    
+    # SMTP connection pool: open connections per process and messages sent before reconnecting
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE') or 2)
+    SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get('SMTP_MAX_MESSAGES_PER_CONNECTION') or 100)
+    # Seconds any single SMTP operation (connect, STARTTLS, send) may take
+    SMTP_TIMEOUT = int(os.environ.get('SMTP_TIMEOUT') or 10)
+    
+    # Offline IP-to-country table built with `python geoip.py build` (ipapi.co is used if it is missing)
+    GEOIP_DB_PATH = os.environ.get('GEOIP_DB_PATH') or 'geoip.bin'
+    # Seconds an ipapi.co lookup may take (ipapi.co, SMTP and the database each have a
+    # circuit breaker, see circuit_breaker.py)
+    GEOIP_API_TIMEOUT = float(os.environ.get('GEOIP_API_TIMEOUT') or 2)
+    
+    # Precompressed, content-hashed pages and static files (python assets.py build)
+    ASSET_BUILD_DIR = os.environ.get('ASSET_BUILD_DIR') or 'dist'
+    # Seconds between checks for edited HTML pages held in each worker's page cache
+    PAGE_CACHE_CHECK_INTERVAL = float(os.environ.get('PAGE_CACHE_CHECK_INTERVAL') or 2)
+    # Seconds between checks for website config saved by other workers
+    WEBSITE_CONFIG_CHECK_INTERVAL = float(os.environ.get('WEBSITE_CONFIG_CHECK_INTERVAL') or 2)
+    
+    # Geolocation cache: per-worker LRU in front of the shared geo_cache collection (seconds)
+    GEO_CACHE_SIZE = int(os.environ.get('GEO_CACHE_SIZE') or 10000)
+    GEO_CACHE_TTL = int(os.environ.get('GEO_CACHE_TTL') or 7 * 24 * 3600)
+    GEO_CACHE_NEGATIVE_TTL = int(os.environ.get('GEO_CACHE_NEGATIVE_TTL') or 600)
+    
+    # Recently processed Google Ads lead_ids, so webhook retries are answered from memory
+    WEBHOOK_SEEN_SIZE = int(os.environ.get('WEBHOOK_SEEN_SIZE') or 10000)
+    WEBHOOK_SEEN_TTL = int(os.environ.get('WEBHOOK_SEEN_TTL') or 3600)
+    
+    # 'inline' saves leads and queues emails during the request; 'queue' stores the request
+    # in MongoDB, answers straight away and leaves the rest to the lead queue workers
+    LEAD_PROCESSING = (os.environ.get('LEAD_PROCESSING') or 'inline').lower()
+    # Background threads per process that process queued leads (0 = don't process in this process)
+    LEAD_QUEUE_WORKERS = int(os.environ.get('LEAD_QUEUE_WORKERS') or 2)
+    # Inline contact form stages run concurrently on this many threads per process, each with a deadline (seconds)
+    LEAD_PIPELINE_WORKERS = int(os.environ.get('LEAD_PIPELINE_WORKERS') or 8)
+    # Kept short: a slower country lookup doesn't hold up the save, it fills the country in afterwards
+    LEAD_GEOLOCATION_TIMEOUT = float(os.environ.get('LEAD_GEOLOCATION_TIMEOUT') or 0.5)
+    LEAD_EMAILS_TIMEOUT = float(os.environ.get('LEAD_EMAILS_TIMEOUT') or 3)
+    LEAD_SAVE_TIMEOUT = float(os.environ.get('LEAD_SAVE_TIMEOUT') or 5)
+    # A lead write that fails or takes longer than LEAD_WRITE_BUDGET seconds goes to a local,
+    # fsync'd spool (at most LEAD_SPOOL_MAX_MB) that is replayed into the database when it recovers
+    LEAD_WRITE_BUDGET = float(os.environ.get('LEAD_WRITE_BUDGET') or 1.5)
+    LEAD_SPOOL_DIR = os.environ.get('LEAD_SPOOL_DIR') or 'spool'
+    LEAD_SPOOL_MAX_MB = int(os.environ.get('LEAD_SPOOL_MAX_MB') or 64)
+    LEAD_SPOOL_REPLAY_INTERVAL = float(os.environ.get('LEAD_SPOOL_REPLAY_INTERVAL') or 10)
+    
     # Admin credentials (in production, store these securely in database with hashed passwords)
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME') or 'dubaiadmin'
     ADMIN_PASSWORD_HASH = hashlib.sha256((os.environ.get('ADMIN_PASSWORD') or 'dubai1234').encode()).hexdigest()
+    
+    # Sessions live in MongoDB; each worker caches them for SESSION_CACHE_TTL seconds
+    SESSION_HOURS = int(os.environ.get('SESSION_HOURS') or 24)
+    SESSION_CACHE_TTL = int(os.environ.get('SESSION_CACHE_TTL') or 30)
+    # 'session' (random tokens stored in MongoDB) or 'signed' (HMAC-signed with SECRET_KEY)
+    TOKEN_MODE = (os.environ.get('TOKEN_MODE') or 'session').lower()
 
 app.config.from_object(Config)
 
-# Store active sessions (in production, use Redis or database)
-active_sessions = {}
+def create_token_signer():
+    """Token signer for TOKEN_MODE=signed, or None to use stored sessions"""
+    if Config.TOKEN_MODE != 'signed':
+        return None
+    if not os.environ.get('SECRET_KEY'):
+        # The built-in default key is public, so tokens signed with it could be forged
+        logger.error("TOKEN_MODE=signed requires SECRET_KEY to be set; using stored sessions")
+        return None
+    return TokenSigner(Config.SECRET_KEY)
+
+# Sessions shared by all workers (MongoDB with a per-worker cache, or signed tokens)
+session_store = SessionStore(db, session_hours=Config.SESSION_HOURS, cache_ttl=Config.SESSION_CACHE_TTL,
+                             signer=create_token_signer())
 
 def verify_admin_token(token):
     """Verify admin authentication token and auto-refresh if expiring soon"""
-    if not token:
-        return False
-    
-    # Check if token exists and is not expired
-    if token in active_sessions:
-        session_data = active_sessions[token]
-        if datetime.now() < session_data['expires']:
-            # Auto-refresh token if it expires in less than 1 hour
-            time_until_expiry = session_data['expires'] - datetime.now()
-            if time_until_expiry.total_seconds() < 3600:  # Less than 1 hour
-                # Extend expiration by 24 hours
-                active_sessions[token]['expires'] = datetime.now() + timedelta(hours=24)
-                logger.info(f"Token auto-refreshed for user: {session_data.get('username', 'unknown')}")
-            return True
-        else:
-            # Remove expired token
-            del active_sessions[token]
-    
-    return False
+    # Sessions expiring in less than 1 hour are extended by a full lifetime
+    session_data = session_store.refresh(token)
+    return session_data is not None and session_data['role'] == 'admin'
 
 def require_admin_auth(f):
     """Decorator to require admin authentication"""
@@ -83,6 +150,20 @@ def require_admin_auth(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+# Breakdowns returned by /api/leads/stats
+LEAD_ROLLUP_DIMENSIONS = ROLLUP_FIELDS + ['day']
+
+# Memory-mapped country table shared by all workers through the page cache
+geoip_table = load_table(Config.GEOIP_DB_PATH)
+
+# Per-worker cache of ipapi.co results; db.geo_cache shares them between workers
+geo_cache = TTLCache(maxsize=Config.GEO_CACHE_SIZE, ttl=Config.GEO_CACHE_TTL)
+geo_stats = {'shared_hits': 0, 'shared_misses': 0, 'external_calls': 0}
+ipapi_breaker = get_breaker('ipapi')
+
+# Google Ads lead_ids this worker has already stored (retries of them are acknowledged straight away)
+webhook_seen = TTLCache(maxsize=Config.WEBHOOK_SEEN_SIZE, ttl=Config.WEBHOOK_SEEN_TTL)
+
 def get_country_from_ip(ip_address):
     """Get country information from IP address"""
     try:
@@ -90,89 +171,191 @@ def get_country_from_ip(ip_address):
         if ip_address in ['127.0.0.1', 'localhost'] or ip_address.startswith('192.168.') or ip_address.startswith('10.'):
             return 'AE', 'United Arab Emirates'  # Default to UAE
         
+        # Use the offline table when it is installed
+        if geoip_table is not None:
+            return geoip_table.lookup(ip_address) or ('Unknown', 'Unknown')
+        
+        # Per-worker cache
+        cached = geo_cache.get(ip_address)
+        if cached:
+            return cached
+        
+        # Shared cache
+        shared = db.get_cached_country(ip_address)
+        if shared:
+            geo_stats['shared_hits'] += 1
+            country_code, country_name, expires_at = shared
+            remaining = (expires_at - datetime.now()).total_seconds()
+            geo_cache.set(ip_address, (country_code, country_name), ttl=min(remaining, Config.GEO_CACHE_TTL))
+            return country_code, country_name
+        geo_stats['shared_misses'] += 1
+        
+        result = lookup_country_online(ip_address)
+        
+        # 'Unknown' may just be a rate limit or timeout, so retry it sooner
+        ttl = Config.GEO_CACHE_NEGATIVE_TTL if result[0] == 'Unknown' else Config.GEO_CACHE_TTL
+        geo_cache.set(ip_address, result, ttl=ttl)
+        db.cache_country(ip_address, result[0], result[1], ttl)
+        return result
+        
+    except Exception as e:
+        logger.error(f"Error getting country from IP {ip_address}: {str(e)}")
+        return 'Unknown', 'Unknown'
+
+def lookup_country_online(ip_address):
+    """Look up an IP address with the ipapi.co service ('Unknown' straight away while its circuit is open)"""
+    if not ipapi_breaker.allow():
+        return 'Unknown', 'Unknown'
+    
+    geo_stats['external_calls'] += 1
+    try:
         # Use ipapi.co service (free tier)
-        response = requests.get(f'https://ipapi.co/{ip_address}/json/', timeout=5)
+        response = requests.get(f'https://ipapi.co/{ip_address}/json/', timeout=Config.GEOIP_API_TIMEOUT)
         if response.status_code == 200:
             data = response.json()
             country_code = data.get('country_code', 'Unknown')
             country_name = data.get('country_name', 'Unknown')
+            ipapi_breaker.record_success()
             return country_code, country_name
+        elif response.status_code == 429 or response.status_code >= 500:
+            # Rate limited or down: further calls would fail the same way
+            ipapi_breaker.record_failure(f"HTTP {response.status_code}")
         else:
-            return 'Unknown', 'Unknown'
+            ipapi_breaker.record_success()
+        return 'Unknown', 'Unknown'
     except Exception as e:
+        ipapi_breaker.record_failure(e)
         logger.error(f"Error getting country from IP {ip_address}: {str(e)}")
         return 'Unknown', 'Unknown'
 
-def validate_email(email):
-    """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+smtp_pool = SMTPConnectionPool(
+    app.config['SMTP_SERVER'],
+    app.config['SMTP_PORT'],
+    app.config['EMAIL_USERNAME'],
+    app.config['EMAIL_PASSWORD'],
+    max_connections=Config.SMTP_POOL_SIZE,
+    max_messages_per_connection=Config.SMTP_MAX_MESSAGES_PER_CONNECTION,
+    timeout=Config.SMTP_TIMEOUT,
+    breaker=get_breaker('smtp')
+)
+
+def build_notification_email(form_data, ip_address='Unknown', user_agent='Unknown'):
+    """Build the sales team notification for a new contact form submission"""
+    # Create message
+    msg = MIMEMultipart()
+    msg['From'] = app.config['EMAIL_USERNAME']
+    # Support multiple recipients (comma-separated)
+    to_emails = [email.strip() for email in app.config['TO_EMAIL'].split(',')]
+    msg['To'] = ', '.join(to_emails)
+    msg['Subject'] = f"New Contact Form Submission - Le Blanc Dubai"
+    
+    # Create email body
+    body = f"""
+    New Contact Form Submission - Le Blanc Dubai Real Estate
+
+    Date & Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+    CONTACT INFORMATION:
+    =====================
+    Name: {form_data.get('firstName', 'N/A')} {form_data.get('lastName', 'N/A')}
+    Email: {form_data.get('email', 'N/A')}
+    WhatsApp: {form_data.get('whatsapp', 'N/A')}
+    Country: {form_data.get('country', 'N/A')}
+
+    INQUIRY DETAILS:
+    ================
+    Preferred Contact: {form_data.get('contactMethod', 'N/A')}
+    Buying Timeframe: {form_data.get('timeframe', 'N/A')}
+    Property Interest: {form_data.get('propertyType', 'Not specified')}
+
+    ADDITIONAL INFO:
+    ================
+    Source: Le Blanc Dubai Website
+    IP Address: {ip_address}
+    User Agent: {user_agent}
+
+    Please follow up with this lead within 24 hours.
+
+    Best regards,
+    Le Blanc Dubai Website System
+    """
+    
+    msg.attach(MIMEText(body, 'plain'))
+    
+    return app.config['EMAIL_USERNAME'], to_emails, msg.as_string()
+
+def build_confirmation_email(form_data):
+    """Build the confirmation email sent to the user"""
+    # Create confirmation message
+    msg = MIMEMultipart()
+    msg['From'] = app.config['EMAIL_USERNAME']
+    msg['To'] = form_data.get('email')
+    msg['Subject'] = "Thank you for your interest in Le Blanc Dubai"
+    
+    # Create confirmation email body
+    body = f"""
+    Dear {form_data.get('firstName', 'Valued Customer')},
+
+    Thank you for your interest in Le Blanc by Imtiaz in Dubailand!
+
+    We have received your inquiry and one of our real estate specialists will contact you within 24 hours to discuss:
+
+    • Le Blanc apartment options and pricing
+    • Payment plans (60/40 and 70/30 available)
+    • Handover timeline (Q1 2027)
+    • Investment benefits and Golden Visa eligibility
+    • Site visit arrangements
+
+    YOUR INQUIRY DETAILS:
+    =====================
+    Name: {form_data.get('firstName')} {form_data.get('lastName')}
+    Email: {form_data.get('email')}
+    WhatsApp: {form_data.get('whatsapp')}
+    Country: {form_data.get('country')}
+    Preferred Contact: {form_data.get('contactMethod')}
+    Buying Timeframe: {form_data.get('timeframe')}
+    Property Interest: {form_data.get('propertyType', 'To be discussed')}
+
+    WHY CHOOSE LE BLANC DUBAI?
+    ===========================
+    ✓ Fully furnished luxury apartments
+    ✓ Prime Dubailand location (20 mins from Sheikh Zayed Road)
+    ✓ Resort-style amenities
+    ✓ Flexible payment plans
+    ✓ Freehold ownership with 0% tax
+    ✓ Golden Visa eligibility
+
+    For immediate assistance, please call us at +971 4 XXX XXXX or WhatsApp +971 50 XXX XXXX
+
+    Best regards,
+    Le Blanc Dubai Sales Team
+    Imtiaz Developments
 
-def validate_phone(phone):
-    """Validate phone number format"""
-    # Remove spaces, dashes, and parentheses
-    cleaned_phone = re.sub(r'[\s\-\(\)]+', '', phone)
-    # Check if it contains only digits and + (for country code)
-    pattern = r'^\+?[0-9]{8,15}$'
-    return re.match(pattern, cleaned_phone) is not None
+    ---
+    This is an automated confirmation. Please do not reply to this email.
+    """
+    
+    msg.attach(MIMEText(body, 'plain'))
+    
+    return app.config['EMAIL_USERNAME'], [form_data.get('email')], msg.as_string()
 
-def send_email(form_data):
+def send_emails(messages):
+    """Send built emails over one pooled SMTP connection, returning (sent, error) per message"""
+    results = smtp_pool.send_messages(messages)
+    
+    for (_, to_addrs, _), (sent, error) in zip(messages, results):
+        if sent:
+            logger.info(f"Email sent successfully to {', '.join(to_addrs)}")
+        else:
+            logger.error(f"Failed to send email to {', '.join(to_addrs)}: {error}")
+    
+    return results
+
+def send_email(form_data, ip_address='Unknown', user_agent='Unknown'):
     """Send email notification for new contact form submission"""
     try:
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = app.config['EMAIL_USERNAME']
-        # Support multiple recipients (comma-separated)
-        to_emails = [email.strip() for email in app.config['TO_EMAIL'].split(',')]
-        msg['To'] = ', '.join(to_emails)
-        msg['Subject'] = f"New Contact Form Submission - Le Blanc Dubai"
-        
-        # Create email body
-        body = f"""
-        New Contact Form Submission - Le Blanc Dubai Real Estate
-        
-        Date & Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        
-        CONTACT INFORMATION:
-        =====================
-        Name: {form_data.get('firstName', 'N/A')} {form_data.get('lastName', 'N/A')}
-        Email: {form_data.get('email', 'N/A')}
-        WhatsApp: {form_data.get('whatsapp', 'N/A')}
-        Country: {form_data.get('country', 'N/A')}
-        
-        INQUIRY DETAILS:
-        ================
-        Preferred Contact: {form_data.get('contactMethod', 'N/A')}
-        Buying Timeframe: {form_data.get('timeframe', 'N/A')}
-        Property Interest: {form_data.get('propertyType', 'Not specified')}
-        
-        ADDITIONAL INFO:
-        ================
-        Source: Le Blanc Dubai Website
-        IP Address: {request.environ.get('REMOTE_ADDR', 'Unknown')}
-        User Agent: {request.environ.get('HTTP_USER_AGENT', 'Unknown')}
-        
-        Please follow up with this lead within 24 hours.
-        
-        Best regards,
-        Le Blanc Dubai Website System
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Send email
-        server = smtplib.SMTP(app.config['SMTP_SERVER'], app.config['SMTP_PORT'])
-        server.starttls()
-        server.login(app.config['EMAIL_USERNAME'], app.config['EMAIL_PASSWORD'])
-        text = msg.as_string()
-        # Support multiple recipients
-        to_emails = [email.strip() for email in app.config['TO_EMAIL'].split(',')]
-        server.sendmail(app.config['EMAIL_USERNAME'], to_emails, text)
-        server.quit()
-        
-        logger.info(f"Email sent successfully for {form_data.get('email')} to {', '.join(to_emails)}")
-        return True
-        
+        sent, _ = send_emails([build_notification_email(form_data, ip_address, user_agent)])[0]
+        return sent
     except Exception as e:
         logger.error(f"Failed to send email: {str(e)}")
         return False
@@ -180,78 +363,51 @@ def send_email(form_data):
 def send_confirmation_email(form_data):
     """Send confirmation email to the user"""
     try:
-        # Create confirmation message
-        msg = MIMEMultipart()
-        msg['From'] = app.config['EMAIL_USERNAME']
-        msg['To'] = form_data.get('email')
-        msg['Subject'] = "Thank you for your interest in Le Blanc Dubai"
-        
-        # Create confirmation email body
-        body = f"""
-        Dear {form_data.get('firstName', 'Valued Customer')},
-        
-        Thank you for your interest in Le Blanc by Imtiaz in Dubailand!
-        
-        We have received your inquiry and one of our real estate specialists will contact you within 24 hours to discuss:
-        
-        • Le Blanc apartment options and pricing
-        • Payment plans (60/40 and 70/30 available)
-        • Handover timeline (Q1 2027)
-        • Investment benefits and Golden Visa eligibility
-        • Site visit arrangements
-        
-        YOUR INQUIRY DETAILS:
-        =====================
-        Name: {form_data.get('firstName')} {form_data.get('lastName')}
-        Email: {form_data.get('email')}
-        WhatsApp: {form_data.get('whatsapp')}
-        Country: {form_data.get('country')}
-        Preferred Contact: {form_data.get('contactMethod')}
-        Buying Timeframe: {form_data.get('timeframe')}
-        Property Interest: {form_data.get('propertyType', 'To be discussed')}
-        
-        WHY CHOOSE LE BLANC DUBAI?
-        ===========================
-        ✓ Fully furnished luxury apartments
-        ✓ Prime Dubailand location (20 mins from Sheikh Zayed Road)
-        ✓ Resort-style amenities
-        ✓ Flexible payment plans
-        ✓ Freehold ownership with 0% tax
-        ✓ Golden Visa eligibility
-        
-        For immediate assistance, please call us at +971 4 XXX XXXX or WhatsApp +971 50 XXX XXXX
-        
-        Best regards,
-        Le Blanc Dubai Sales Team
-        Imtiaz Developments
-        
-        ---
-        This is an automated confirmation. Please do not reply to this email.
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Send confirmation email
-        server = smtplib.SMTP(app.config['SMTP_SERVER'], app.config['SMTP_PORT'])
-        server.starttls()
-        server.login(app.config['EMAIL_USERNAME'], app.config['EMAIL_PASSWORD'])
-        text = msg.as_string()
-        server.sendmail(app.config['EMAIL_USERNAME'], form_data.get('email'), text)
-        server.quit()
-        
-        logger.info(f"Confirmation email sent to {form_data.get('email')}")
-        return True
-        
+        sent, _ = send_emails([build_confirmation_email(form_data)])[0]
+        return sent
     except Exception as e:
         logger.error(f"Failed to send confirmation email: {str(e)}")
         return False
 
-def save_lead_data(form_data):
-    """Save lead data to MongoDB database"""
+def request_client():
+    """(ip_address, user_agent) of the current request"""
+    return request.environ.get('REMOTE_ADDR', '127.0.0.1'), request.environ.get('HTTP_USER_AGENT')
+
+def write_lead(lead_data):
+    """Store a lead in the database; leads with a lead_id (Google Ads) are only stored once"""
+    if lead_data.get('lead_id'):
+        return db.save_lead_once(lead_data)
+    return db.save_lead(lead_data)
+
+def queue_spooled_lead_emails(lead):
+    """Queue the emails of a spooled lead once it has been stored as a new lead"""
+    # Not while it is spooled: the outbox is in the same database that just failed
+    queue_lead_emails(lead, (lead.get('ip_address'), lead.get('user_agent')))
+
+def lead_spool_directory():
+    """The spool directory, or None (no spool) when no database is configured to replay it into"""
+    if not database_configured():
+        logger.warning("No DATABASE_URL or MONGODB_URI configured: leads are not spooled")
+        return None
+    return os.path.join(app.root_path, Config.LEAD_SPOOL_DIR)
+
+lead_spool = LeadSpool(db, write_lead, directory=lead_spool_directory(),
+                       budget=Config.LEAD_WRITE_BUDGET, max_bytes=Config.LEAD_SPOOL_MAX_MB * 1024 * 1024,
+                       replay_interval=Config.LEAD_SPOOL_REPLAY_INTERVAL, on_saved=queue_spooled_lead_emails)
+
+def save_lead_data(form_data, client=None, country=None):
+    """
+    Save lead data to the database, or to the local spool when the database is slow or down.
+    client is (ip_address, user_agent), by default the current request's;
+    country is (country_code, country_name) when it has already been looked up.
+    Returns the lead id (a SpooledLeadId while it waits in the spool), None for a duplicate lead_id,
+    False on error.
+    """
     try:
+        ip_address, user_agent = client or request_client()
+        
         # Get country information from IP
-        ip_address = request.environ.get('REMOTE_ADDR', '127.0.0.1')
-        country_code, country_name = get_country_from_ip(ip_address)
+        country_code, country_name = country or get_country_from_ip(ip_address)
         
         lead_data = {
             'firstName': form_data.get('firstName'),
@@ -266,67 +422,252 @@ def save_lead_data(form_data):
             'campaign_id': form_data.get('campaign_id', ''),
             'lead_id': form_data.get('lead_id', ''),
             'ip_address': ip_address,
-            'user_agent': request.environ.get('HTTP_USER_AGENT'),
+            'user_agent': user_agent,
             'detected_country_code': country_code,
             'detected_country': country_name,
             'status': 'new'
         }
         
-        # Save to MongoDB
-        lead_id = db.save_lead(lead_data)
+        # Written within LEAD_WRITE_BUDGET seconds, otherwise spooled for the replayer
+        lead_id = lead_spool.save(lead_data)
+        if lead_id is None:
+            return None
+        if lead_id is False:
+            logger.error(f"Lead for {form_data.get('email')} could not be saved or spooled")
+            return False
         
-        logger.info(f"Lead data saved to MongoDB for {form_data.get('email')}")
+        logger.info(f"Lead data saved for {form_data.get('email')}")
         return lead_id
         
     except Exception as e:
         logger.error(f"Failed to save lead data: {str(e)}")
         return False
 
+# Fields used by the email templates (only these are stored in the outbox)
+EMAIL_FIELDS = ['firstName', 'lastName', 'email', 'whatsapp', 'country', 'contactMethod', 'timeframe', 'propertyType']
+
+email_outbox = EmailOutbox(db, builders={
+    'notification': build_notification_email,
+    'confirmation': build_confirmation_email
+}, send_batch=send_emails, workers=Config.EMAIL_OUTBOX_WORKERS, breaker=smtp_pool.breaker)
+
+def queue_lead_emails(form_data, client=None):
+    """Queue the admin notification and user confirmation emails for a lead"""
+    try:
+        email_data = {field: form_data[field] for field in EMAIL_FIELDS if form_data.get(field) is not None}
+        ip_address, user_agent = client or request_client()
+        
+        email_outbox.enqueue(
+            'notification',
+            form_data=email_data,
+            ip_address=ip_address or 'Unknown',
+            user_agent=user_agent or 'Unknown'
+        )
+        email_outbox.enqueue('confirmation', form_data=email_data)
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to queue emails for {form_data.get('email')}: {str(e)}")
+        return False
+
+def google_ads_lead(data):
+    """Map a Google Ads Lead Form delivery to our lead fields"""
+    columns = data.get('user_column_data', {})
+    return {
+        'firstName': columns.get('FIRST_NAME', ''),
+        'lastName': columns.get('LAST_NAME', ''),
+        'email': columns.get('EMAIL', ''),
+        'whatsapp': columns.get('PHONE_NUMBER', ''),
+        'country': columns.get('COUNTRY', 'Not specified'),
+        'contactMethod': 'WhatsApp',
+        'timeframe': 'As soon as possible',
+        'propertyType': columns.get('PROPERTY_TYPE', ''),
+        'source': 'Google Ads Lead Form',
+        'campaign_id': data.get('google_key', ''),
+        'lead_id': str(data.get('lead_id') or '')
+    }
+
+def process_contact_job(payload):
+    """Save a queued contact form lead and queue its emails"""
+    client = (payload.get('ip_address'), payload.get('user_agent'))
+    saved = save_lead_data(payload['data'], client)
+    if saved is False:
+        raise RuntimeError('Lead could not be saved')
+    # A spooled lead has its emails queued by the spool once it is stored
+    if not isinstance(saved, SpooledLeadId):
+        queue_lead_emails(payload['data'], client)
+
+def process_google_ads_job(payload):
+    """Save a queued Google Ads lead and queue its emails (unless it was already stored)"""
+    client = (payload.get('ip_address'), payload.get('user_agent'))
+    lead_data = google_ads_lead(payload['data'])
+    saved = save_lead_data(lead_data, client)
+    if saved is False:
+        raise RuntimeError('Lead could not be saved')
+    # A spooled lead may be a duplicate: the spool queues its emails once it is stored as a new lead
+    if saved is not None and not isinstance(saved, SpooledLeadId):
+        queue_lead_emails(lead_data, client)
+
+lead_pipeline = LeadPipeline(workers=Config.LEAD_PIPELINE_WORKERS, timeouts={
+    'geolocation': Config.LEAD_GEOLOCATION_TIMEOUT,
+    'emails': Config.LEAD_EMAILS_TIMEOUT,
+    'save': Config.LEAD_SAVE_TIMEOUT
+})
+
+def fill_in_lead_country(lead_id, lookup):
+    """
+    Store the country of a lead that was saved before its geolocation finished.
+    Runs as a done-callback on the lookup's pipeline thread, after the response was sent.
+    """
+    try:
+        country_code, country_name = lookup.result()
+        if country_code == 'Unknown':
+            # Already saved as Unknown
+            return
+        country = {'detected_country_code': country_code, 'detected_country': country_name}
+        if isinstance(lead_id, SpooledLeadId):
+            # Not in the database yet: the replay sets it after inserting the lead
+            filled_in = lead_spool.update(lead_id, country)
+        else:
+            filled_in = db.update_lead(lead_id, country)
+        if filled_in:
+            logger.info(f"Late geolocation stored for lead {lead_id}: {country_name}")
+        else:
+            logger.warning(f"Late geolocation for lead {lead_id} could not be stored")
+    except Exception as e:
+        logger.error(f"Late geolocation for lead {lead_id} failed: {str(e)}")
+
+def finish_late_contact_lead(save, form_data, client, lookup=None):
+    """
+    Queue the emails of a contact form lead whose save missed its deadline, and fill in its
+    country if that lookup missed its deadline too (lookup is then its future)
+    """
+    try:
+        lead_id = save.result()
+    except Exception as e:
+        logger.error(f"Late save of lead for {form_data.get('email')} failed: {str(e)}")
+        return
+    if not lead_id:
+        logger.warning(f"Late save of lead for {form_data.get('email')} did not store it")
+        return
+    logger.info(f"Late save of lead for {form_data.get('email')} finished: {lead_id}")
+    if not isinstance(lead_id, SpooledLeadId):
+        queue_lead_emails(form_data, client)
+    if lookup is not None:
+        lookup.add_done_callback(lambda lookup: fill_in_lead_country(lead_id, lookup))
+
+lead_queue = LeadQueue(db, handlers={
+    'contact': process_contact_job,
+    'google_ads': process_google_ads_job
+}, workers=Config.LEAD_QUEUE_WORKERS)
+
+# Background threads don't survive a fork, so each process starts its own (gunicorn's post_fork
+# hook does this as soon as a worker boots; the first request does it everywhere else)
+_background_pid = None
+
+def start_background_workers():
+    """Start this process's lead spool, session store, email outbox and lead queue threads (once per process)"""
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    _background_pid = os.getpid()
+    try:
+        lead_spool.start()
+        email_outbox.start()
+        lead_queue.start()
+        # Last: with signed tokens this reads the revocation list from MongoDB
+        session_store.start()
+    except Exception as e:
+        logger.error(f"Failed to start background workers: {str(e)}")
+
+@app.before_request
+def ensure_background_workers():
+    start_background_workers()
+
+def queue_lead_job(kind, data, key=None):
+    """Store a validated request for the lead queue workers. Returns False if it was already queued."""
+    ip_address, user_agent = request_client()
+    return lead_queue.enqueue(kind, {'data': data, 'ip_address': ip_address, 'user_agent': user_agent}, key=key)
+
+# Built assets are optional: without a build every file is served straight from disk
+asset_manifest = load_manifest(os.path.join(app.root_path, Config.ASSET_BUILD_DIR), app.root_path)
+# Resized JPEG/WebP copies of the photos (python responsive_images.py build)
+image_variants = load_variants(os.path.join(app.root_path, IMAGE_VARIANTS_MANIFEST))
+# Editor settings shown on the site (MongoDB, cached per worker)
+website_config = WebsiteConfig(db, check_interval=Config.WEBSITE_CONFIG_CHECK_INTERVAL,
+                               legacy_path=os.path.join(app.root_path, 'website_config.json'))
+
+# HTML pages are held in memory by each worker
+page_cache = PageCache(app.root_path, asset_manifest, check_interval=Config.PAGE_CACHE_CHECK_INTERVAL)
+
+def serve_file(directory, filename, mimetype=None):
+    """Serve the precompressed build of a file when there is a current one, otherwise the file itself"""
+    if directory == '.' and filename.endswith('.html'):
+        response = page_cache.response(filename, request)
+        if response is not None:
+            return response
+    if asset_manifest:
+        key = filename if directory == '.' else f"{directory}/{filename}"
+        response = asset_manifest.response(key, request.accept_encodings)
+        if response is not None:
+            return response
+    return send_from_directory(directory, filename, mimetype=mimetype)
+
 @app.route('/')
 def index():
     """Serve the main website"""
-    return send_from_directory('.', 'index.html')
+    return serve_file('.', 'index.html')
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve static files (images, css, js)"""
-    return send_from_directory('static', filename)
+    key = f"static/{filename}"
+    source = asset_manifest.source_key(key) if asset_manifest else key
+    if image_variants and image_variants.has_webp(source):
+        # Photos are sent as WebP to browsers that accept it (hashed URLs get the hashed copy)
+        webp = image_variants.webp_for(source, request.accept_mimetypes)
+        if webp and asset_manifest and source != key:
+            webp = asset_manifest.hashed_key(webp)
+        response = serve_file('static', (webp or key)[len('static/'):])
+        response.vary.add('Accept')
+        return response
+    return serve_file('static', filename)
 
 @app.route('/favicon.ico')
 def favicon():
     """Serve favicon explicitly"""
-    return send_from_directory('.', 'favicon.ico', mimetype='image/vnd.microsoft.icon')
+    return serve_file('.', 'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
 # Clean URL routes for legal pages (without .html extension)
 @app.route('/terms')
 def terms_clean():
     """Serve terms page without .html extension"""
-    return send_from_directory('.', 'terms.html')
+    return serve_file('.', 'terms.html')
 
 @app.route('/privacy')
 def privacy_clean():
     """Serve privacy page without .html extension"""
-    return send_from_directory('.', 'privacy.html')
+    return serve_file('.', 'privacy.html')
 
 @app.route('/disclaimer')
 def disclaimer_clean():
     """Serve disclaimer page without .html extension"""
-    return send_from_directory('.', 'disclaimer.html')
+    return serve_file('.', 'disclaimer.html')
 
 @app.route('/cookies')
 def cookies_clean():
     """Serve cookies page without .html extension"""
-    return send_from_directory('.', 'cookies.html')
+    return serve_file('.', 'cookies.html')
 
 @app.route('/thank-you')
 def thank_you_page():
     """Thank you page for form submissions and conversion tracking"""
-    return send_from_directory('.', 'thank-you.html')
+    return serve_file('.', 'thank-you.html')
 
 @app.route('/<path:filename>')
 def static_files(filename):
     """Serve static files"""
-    return send_from_directory('.', filename)
+    return serve_file('.', filename)
 
 @app.route('/api/contact', methods=['POST'])
 def handle_contact_form():
@@ -365,21 +706,51 @@ def handle_contact_form():
                 'message': 'Invalid WhatsApp number format'
             }), 400
         
-        # Save lead data
-        save_lead_data(data)
-        
-        # Send notification email
-        email_sent = send_email(data)
+        if Config.LEAD_PROCESSING == 'queue':
+            # Saved and emailed by a lead queue worker
+            queue_lead_job('contact', data)
+            return jsonify({
+                'success': True,
+                'message': 'Thank you for your inquiry! We will contact you within 24 hours.',
+                'emails_queued': True
+            })
         
-        # Send confirmation email to user
-        confirmation_sent = send_confirmation_email(data)
+        # The country gets a short deadline of its own (the offline table answers at once); a slower
+        # lookup saves the lead as Unknown and fills the country in when it finishes.
+        # The notification and confirmation emails are only queued once the lead is stored
+        client = request_client()
+        run = lead_pipeline.start()
+        geolocation = run.submit('geolocation', get_country_from_ip, client[0])
+        country = run.result(geolocation)
+        late_lookup = geolocation.future if country is None else None
+        save = run.submit('save', save_lead_data, data, client, country or ('Unknown', 'Unknown'))
+        lead_id = run.result(save)
+        
+        if lead_id is False:
+            # Neither the database nor the local spool took the lead: ask the visitor to try again
+            return jsonify({
+                'success': False,
+                'message': 'We could not save your inquiry. Please try again in a few minutes.',
+                'timing': run.finish()
+            }), 503
+        
+        emails_queued = False
+        if lead_id:
+            # A spooled lead's emails are queued by the spool once it is stored (the outbox is in the same database)
+            if not isinstance(lead_id, SpooledLeadId):
+                emails_queued = run.result(run.submit('emails', queue_lead_emails, data, client), default=False)
+            if late_lookup is not None:
+                late_lookup.add_done_callback(lambda lookup: fill_in_lead_country(lead_id, lookup))
+        elif 'save' in run.degraded:
+            # The save missed its deadline but carries on: finish the lead once it is stored
+            save.future.add_done_callback(lambda saved: finish_late_contact_lead(saved, data, client, late_lookup))
         
         # Return success response
         return jsonify({
             'success': True,
             'message': 'Thank you for your inquiry! We will contact you within 24 hours.',
-            'email_sent': email_sent,
-            'confirmation_sent': confirmation_sent
+            'emails_queued': emails_queued,
+            'timing': run.finish()
         })
         
     except Exception as e:
@@ -389,6 +760,15 @@ def handle_contact_form():
             'message': 'An error occurred while processing your request. Please try again.'
         }), 500
 
+def duplicate_lead_response(lead_id):
+    """Success response for a Google Ads delivery that was already received"""
+    return jsonify({
+        'success': True,
+        'message': 'Lead already received',
+        'lead_id': lead_id,
+        'duplicate': True
+    })
+
 @app.route('/api/google-ads/webhook', methods=['POST'])
 def google_ads_webhook():
     """Handle Google Ads Lead Form webhook submissions"""
@@ -407,34 +787,49 @@ def google_ads_webhook():
         if not data:
             return jsonify({'success': False, 'message': 'No data received'}), 400
         
+        # Google Ads retries deliveries; acknowledge ones this worker already handled
+        google_lead_id = str(data.get('lead_id') or '')
+        if google_lead_id and webhook_seen.get(google_lead_id):
+            return duplicate_lead_response(google_lead_id)
+        
         # Map Google Ads fields to your format
-        lead_data = {
-            'firstName': data.get('user_column_data', {}).get('FIRST_NAME', ''),
-            'lastName': data.get('user_column_data', {}).get('LAST_NAME', ''),
-            'email': data.get('user_column_data', {}).get('EMAIL', ''),
-            'whatsapp': data.get('user_column_data', {}).get('PHONE_NUMBER', ''),
-            'country': data.get('user_column_data', {}).get('COUNTRY', 'Not specified'),
-            'contactMethod': 'WhatsApp',
-            'timeframe': 'As soon as possible',
-            'propertyType': data.get('user_column_data', {}).get('PROPERTY_TYPE', ''),
-            'source': 'Google Ads Lead Form',
-            'campaign_id': data.get('google_key', ''),
-            'lead_id': data.get('lead_id', '')
-        }
+        lead_data = google_ads_lead(data)
         
         # Validate essential fields
         if not lead_data['email'] or not lead_data['firstName']:
             logger.warning(f"Incomplete Google Ads lead data: {data}")
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        # Save lead data
-        save_lead_data(lead_data)
+        if Config.LEAD_PROCESSING == 'queue':
+            # Store the delivery and answer now; a lead queue worker saves it and queues the emails
+            queued = queue_lead_job('google_ads', data, key=f"google_ads:{google_lead_id}" if google_lead_id else None)
+            if google_lead_id:
+                webhook_seen.set(google_lead_id, True)
+            if not queued:
+                return duplicate_lead_response(google_lead_id)
+            return jsonify({
+                'success': True,
+                'message': 'Lead received successfully',
+                'lead_id': google_lead_id
+            })
         
-        # Send notification email
-        email_sent = send_email(lead_data)
+        # Save lead data (None: another worker or an earlier delivery already stored it)
+        saved = save_lead_data(lead_data)
+        if saved is False:
+            # Not stored anywhere: an error status makes Google Ads deliver the lead again
+            return jsonify({'success': False, 'message': 'Lead could not be saved'}), 503
+        duplicate = saved is None
         
-        # Send confirmation email to user
-        confirmation_sent = send_confirmation_email(lead_data)
+        if not duplicate and not isinstance(saved, SpooledLeadId):
+            # Queue notification and confirmation emails (sent by the outbox workers). A spooled
+            # lead may be a duplicate: the spool queues its emails once it is stored as a new lead
+            queue_lead_emails(lead_data)
+        if google_lead_id:
+            webhook_seen.set(google_lead_id, True)
+        
+        if duplicate:
+            logger.info(f"Duplicate Google Ads lead ignored: {google_lead_id}")
+            return duplicate_lead_response(google_lead_id)
         
         logger.info(f"Google Ads lead processed successfully: {lead_data['email']}")
         
@@ -454,16 +849,56 @@ def google_ads_webhook():
 @app.route('/api/health')
 def health_check():
     """Health check endpoint"""
-    mongo_connected = db.client is not None and db.db is not None
+    try:
+        database = db.get()
+    except RuntimeError:
+        database = None
     mongo_uri_set = bool(os.environ.get('MONGODB_URI'))
+    breakers = breaker_stats()
+    # Don't wait on a database whose circuit is open
+    database_up = database is not None and db.breaker.state == CLOSED
     
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'version': '1.0.0',
-        'mongodb_connected': mongo_connected,
+        'storage_backend': database.backend if database else None,
+        'mongodb_connected': database is not None and database.backend == 'mongodb',
         'mongodb_uri_configured': mongo_uri_set,
-        'database_name': db.db.name if mongo_connected else 'not_connected'
+        'database_name': database.name if database else 'not_connected',
+        'schema_version': database.schema_version if database else None,
+        'schema_version_expected': SCHEMA_VERSION,
+        'email_outbox': database.get_email_outbox_stats() if database_up else {},
+        'lead_queue': database.get_lead_queue_stats() if database_up else {},
+        'lead_spool_pending_bytes': lead_spool.pending_bytes(),
+        'circuit_breakers': {name: status['state'] for name, status in breakers.items()}
+    })
+
+@app.route('/api/admin/metrics')
+@require_admin_auth
+def get_metrics():
+    """Cache, queue and connection pool counters (admin endpoint)"""
+    database_up = db.breaker.state == CLOSED
+    return jsonify({
+        'timestamp': datetime.now().isoformat(),
+        'geolocation': {
+            'offline_table': geoip_table is not None,
+            'local_cache': geo_cache.stats(),
+            **geo_stats
+        },
+        'webhook_seen': webhook_seen.stats(),
+        'smtp_pool': smtp_pool.stats,
+        'page_cache': page_cache.stats,
+        'sessions': session_store.stats(),
+        'email_outbox': db.get_email_outbox_stats() if database_up else {},
+        'lead_pipeline': lead_pipeline.stats,
+        'lead_spool': {**lead_spool.stats, 'pending_bytes': lead_spool.pending_bytes()},
+        'lead_queue': {
+            'mode': Config.LEAD_PROCESSING,
+            'jobs': db.get_lead_queue_stats() if database_up else {},
+            'workers': lead_queue.stats
+        },
+        'circuit_breakers': breaker_stats()
     })
 
 @app.route('/api/admin/login', methods=['POST'])
@@ -479,15 +914,8 @@ def admin_login():
         
         # Verify credentials
         if username == app.config['ADMIN_USERNAME'] and password_hash == app.config['ADMIN_PASSWORD_HASH']:
-            # Generate secure token
-            token = secrets.token_urlsafe(32)
-            
-            # Store session (expires in 24 hours)
-            active_sessions[token] = {
-                'username': username,
-                'created': datetime.now(),
-                'expires': datetime.now() + timedelta(hours=24)
-            }
+            # Generate secure token and store the session
+            token, _ = session_store.create(username, 'admin')
             
             logger.info(f"Admin login successful for user: {username}")
             
@@ -516,8 +944,7 @@ def admin_logout():
     try:
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
         
-        if token in active_sessions:
-            del active_sessions[token]
+        if token and session_store.revoke(token):
             logger.info("Admin logout successful")
         
         return jsonify({
@@ -553,33 +980,25 @@ def refresh_token():
     try:
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
         
-        if not token or token not in active_sessions:
+        session_data = session_store.get(token)
+        
+        if not session_data or session_data['role'] != 'admin':
             return jsonify({
                 'success': False,
-                'message': 'Invalid token'
+                'message': 'Invalid or expired token. Please login again.'
             }), 401
         
-        session_data = active_sessions[token]
+        # Extend expiration by a full session lifetime (signed tokens are replaced instead)
+        refreshed = session_store.refresh(token, force=True)
         
-        # Check if token is not expired
-        if datetime.now() < session_data['expires']:
-            # Extend expiration by 24 hours
-            active_sessions[token]['expires'] = datetime.now() + timedelta(hours=24)
-            
-            logger.info(f"Token refreshed for user: {session_data.get('username', 'unknown')}")
-            
-            return jsonify({
-                'success': True,
-                'message': 'Token refreshed successfully',
-                'expiresIn': 86400  # 24 hours in seconds
-            })
-        else:
-            # Token already expired
-            del active_sessions[token]
-            return jsonify({
-                'success': False,
-                'message': 'Token has expired. Please login again.'
-            }), 401
+        logger.info(f"Token refreshed for user: {session_data.get('username', 'unknown')}")
+        
+        return jsonify({
+            'success': True,
+            'message': 'Token refreshed successfully',
+            'token': refreshed.get('token', token),
+            'expiresIn': Config.SESSION_HOURS * 3600
+        })
             
     except Exception as e:
         logger.error(f"Token refresh error: {str(e)}")
@@ -588,13 +1007,59 @@ def refresh_token():
             'message': 'Error refreshing token'
         }), 500
 
+# Leads per /api/leads page when no limit is given, and the largest page it returns
+LEADS_PAGE_SIZE = 50
+LEADS_PAGE_MAX = 500
+
+def parse_lead_filters(args):
+    """Read lead filters (status, assigned_to, source, country, interest, search, date_from, date_to) from request args"""
+    filters = {field: args.get(field) for field in ['status', 'assigned_to', 'source', 'country', 'interest', 'search']
+               if args.get(field)}
+    
+    for field in ['date_from', 'date_to']:
+        value = args.get(field)
+        if not value:
+            continue
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            # created_at is stored as naive local time
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        # A plain date in date_to includes that whole day
+        if field == 'date_to' and len(value) == 10:
+            parsed += timedelta(days=1)
+        filters[field] = parsed
+    
+    return filters
+
 @app.route('/api/leads')
 @require_admin_auth
 def get_leads():
-    """Get all leads (admin endpoint)"""
+    """
+    Get one page of leads (admin endpoint): {leads, count, next_cursor}.
+    ?limit= (default LEADS_PAGE_SIZE, at most LEADS_PAGE_MAX) and ?cursor= (the previous page's
+    next_cursor) page through them. Optional filters: status, assigned_to, source, country,
+    interest, search, date_from, date_to. ?fields=firstName,email limits the returned fields.
+    """
     try:
-        leads = db.get_all_leads()
-        return jsonify(leads)
+        try:
+            limit = min(max(int(request.args.get('limit', LEADS_PAGE_SIZE)), 1), LEADS_PAGE_MAX)
+            filters = parse_lead_filters(request.args)
+            fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+            if any(f.startswith('$') for f in fields):
+                raise ValueError('Invalid field name')
+            leads, next_cursor = db.get_leads_page(filters, limit, request.args.get('cursor'), fields)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid request: {str(e)}'
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'leads': leads,
+            'count': len(leads),
+            'next_cursor': next_cursor
+        })
     except Exception as e:
         logger.error(f"Error retrieving leads: {str(e)}")
         return jsonify({
@@ -602,6 +1067,37 @@ def get_leads():
             'message': 'Error retrieving leads'
         }), 500
 
+@app.route('/api/leads/stats')
+@require_admin_auth
+def get_lead_stats():
+    """
+    Lead counts from the rollup counters (admin endpoint)
+    Returns total plus {value: count} per status, source, country, campaign_id, assigned_to and day.
+    ?date_from= and ?date_to= (YYYY-MM-DD, inclusive) limit the day buckets.
+    Day buckets are server-local dates, like created_at; today, week_from and month_from
+    are the server's, so the dashboard counts the same days whatever its timezone.
+    """
+    try:
+        rollups = db.get_lead_rollups(request.args.get('date_from'), request.args.get('date_to'))
+        if rollups is None:
+            raise RuntimeError('Could not read lead rollups')
+        
+        today = datetime.now().date()
+        return jsonify({
+            'success': True,
+            'total': rollups.pop('total', {}).get('all', 0),
+            **{dimension: rollups.get(dimension, {}) for dimension in LEAD_ROLLUP_DIMENSIONS},
+            'today': today.isoformat(),
+            'week_from': (today - timedelta(days=7)).isoformat(),
+            'month_from': today.replace(day=1).isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Error retrieving lead stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Error retrieving lead stats'
+        }), 500
+
 @app.route('/api/leads/delete', methods=['POST'])
 @require_admin_auth
 def delete_lead():
@@ -670,51 +1166,55 @@ def delete_leads_bulk():
             'message': 'Error deleting leads'
         }), 500
 
-@app.route('/api/leads/download/csv', methods=['POST'])
+def export_filters():
+    """Read export filters from the query string or a JSON body"""
+    args = request.args.to_dict()
+    if request.method == 'POST':
+        args.update((request.get_json(silent=True) or {}).get('filters', {}))
+    return parse_lead_filters(args)
+
+@app.route('/api/leads/import', methods=['POST'])
+@require_admin_auth
+def import_leads():
+    """
+    Bulk import leads (admin endpoint)
+    The body is NDJSON, CSV or a JSON array (from Content-Type or ?format=), read as a stream.
+    Returns counts plus {row, status, error} for every row that was not inserted.
+    """
+    try:
+        fmt = detect_format(request.args.get('format') or request.mimetype)
+        if not fmt:
+            return jsonify({
+                'success': False,
+                'message': 'Send NDJSON, CSV or JSON (Content-Type or ?format=)'
+            }), 415
+        
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        result = ingest_rows(db, read_rows(stream, fmt), source=request.args.get('source') or 'Bulk Import')
+        
+        logger.info(f"Lead import: {result.counts}")
+        return jsonify({'success': True, **result.to_dict()})
+        
+    except Exception as e:
+        logger.error(f"Error importing leads: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Error importing leads'
+        }), 500
+
+@app.route('/api/leads/download/csv', methods=['GET', 'POST'])
 @require_admin_auth
 def download_leads_csv():
-    """Download leads as CSV"""
+    """
+    Download leads as CSV, streamed straight from MongoDB
+    Filters (status, assigned_to, source, country, interest, search, date_from, date_to) come
+    from the query string or a JSON body, so the browser never has to send the leads back.
+    """
     try:
-        data = request.get_json()
-        leads = data.get('leads', [])
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            'Date', 'Time', 'First Name', 'Last Name', 'Email', 'WhatsApp',
-            'Country', 'Contact Method', 'Buying Timeframe', 'Property Type', 'IP Address', 'User Agent'
-        ])
-        
-        # Write data
-        for lead in leads:
-            timestamp = datetime.fromisoformat(lead['timestamp'].replace('Z', '+00:00'))
-            date_str = timestamp.strftime('%Y-%m-%d')
-            time_str = timestamp.strftime('%H:%M:%S')
-            
-            writer.writerow([
-                date_str,
-                time_str,
-                lead.get('firstName', ''),
-                lead.get('lastName', ''),
-                lead.get('email', ''),
-                lead.get('whatsapp', lead.get('phone', '')),
-                lead.get('country', 'Unknown'),
-                lead.get('contactMethod', ''),
-                lead.get('timeframe', ''),
-                lead.get('propertyType', lead.get('interest', '')),
-                lead.get('ip_address', ''),
-                lead.get('user_agent', '')
-            ])
-        
-        # Create response
-        csv_data = output.getvalue()
-        output.close()
+        leads = db.iter_leads(export_filters(), EXPORT_FIELDS)
         
         response = Response(
-            csv_data,
+            stream_csv(leads),
             mimetype='text/csv',
             headers={
                 'Content-Disposition': f'attachment; filename=leblanc_leads_{datetime.now().strftime("%Y%m%d")}.csv'
@@ -723,6 +1223,11 @@ def download_leads_csv():
         
         return response
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid filters: {str(e)}'
+        }), 400
     except Exception as e:
         logger.error(f"Error generating CSV: {str(e)}")
         return jsonify({
@@ -730,52 +1235,15 @@ def download_leads_csv():
             'message': 'Error generating CSV file'
         }), 500
 
-@app.route('/api/leads/download/excel', methods=['POST'])
+@app.route('/api/leads/download/excel', methods=['GET', 'POST'])
 @require_admin_auth
 def download_leads_excel():
-    """Download leads as Excel (using CSV format for simplicity)"""
+    """Download leads as an Excel workbook, streamed straight from MongoDB (same filters as CSV)"""
     try:
-        data = request.get_json()
-        leads = data.get('leads', [])
-        
-        # For basic Excel functionality, we'll use CSV with .xlsx extension
-        # In a production environment, you'd want to use openpyxl or xlsxwriter
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            'Date', 'Time', 'First Name', 'Last Name', 'Email', 'WhatsApp',
-            'Country', 'Contact Method', 'Buying Timeframe', 'Property Type', 'IP Address', 'User Agent'
-        ])
-        
-        # Write data
-        for lead in leads:
-            timestamp = datetime.fromisoformat(lead['timestamp'].replace('Z', '+00:00'))
-            date_str = timestamp.strftime('%Y-%m-%d')
-            time_str = timestamp.strftime('%H:%M:%S')
-            
-            writer.writerow([
-                date_str,
-                time_str,
-                lead.get('firstName', ''),
-                lead.get('lastName', ''),
-                lead.get('email', ''),
-                lead.get('whatsapp', lead.get('phone', '')),
-                lead.get('country', 'Unknown'),
-                lead.get('contactMethod', ''),
-                lead.get('timeframe', ''),
-                lead.get('propertyType', lead.get('interest', '')),
-                lead.get('ip_address', ''),
-                lead.get('user_agent', '')
-            ])
-        
-        # Create response
-        csv_data = output.getvalue()
-        output.close()
+        leads = db.iter_leads(export_filters(), EXPORT_FIELDS)
         
         response = Response(
-            csv_data,
+            stream_excel(leads),
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             headers={
                 'Content-Disposition': f'attachment; filename=leblanc_leads_{datetime.now().strftime("%Y%m%d")}.xlsx'
@@ -784,6 +1252,11 @@ def download_leads_excel():
         
         return response
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid filters: {str(e)}'
+        }), 400
     except Exception as e:
         logger.error(f"Error generating Excel file: {str(e)}")
         return jsonify({
@@ -794,7 +1267,7 @@ def download_leads_excel():
 @app.route('/admin')
 def admin_dashboard():
     """Serve admin dashboard"""
-    return send_from_directory('.', 'admin.html')
+    return serve_file('.', 'admin.html')
 
 # DEPRECATED: settings.html uses localStorage - needs rewrite to use MongoDB API
 # @app.route('/settings')
@@ -805,7 +1278,7 @@ def admin_dashboard():
 @app.route('/editor')
 def editor_page():
     """Serve website editor page"""
-    return send_from_directory('.', 'editor.html')
+    return serve_file('.', 'editor.html')
 
 # Manager Management Endpoints
 @app.route('/api/managers/create', methods=['POST'])
@@ -1024,20 +1497,8 @@ def manager_login():
         password_hash = hashlib.sha256(password.encode()).hexdigest()
         
         if manager['password_hash'] == password_hash and manager.get('active', True):
-            # Generate token
-            token = secrets.token_urlsafe(32)
-            expires_at = datetime.now() + timedelta(hours=24)
-            
-            # Save session to database with role
-            db.save_session(token, username, expires_at, role='manager')
-            
-            # Also keep in memory for compatibility
-            active_sessions[token] = {
-                'username': username,
-                'role': 'manager',
-                'expires': expires_at,
-                'created': datetime.now()
-            }
+            # Generate token and save the session with its role
+            token, _ = session_store.create(username, 'manager')
             
             logger.info(f"Manager login successful: {username}")
             
@@ -1045,7 +1506,7 @@ def manager_login():
                 'success': True,
                 'token': token,
                 'username': username,
-                'expiresIn': 86400
+                'expiresIn': Config.SESSION_HOURS * 3600
             })
         else:
             return jsonify({
@@ -1075,29 +1536,14 @@ def get_manager_leads():
                 'message': 'Unauthorized - no token'
             }), 401
         
-        # Check in-memory sessions first
-        session_data = active_sessions.get(token)
+        session_data = session_store.get(token)
         
-        # If not in memory, check database
         if not session_data:
-            logger.info(f"Token not in memory, checking database...")
-            db_session = db.get_session(token)
-            if db_session:
-                logger.info(f"Found session in database for user: {db_session.get('username')}")
-                # Restore to memory
-                session_data = {
-                    'username': db_session['username'],
-                    'role': 'manager',
-                    'expires': db_session['expires_at'],
-                    'created': db_session['created_at']
-                }
-                active_sessions[token] = session_data
-            else:
-                logger.warning(f"Manager unauthorized - token not found in memory or database")
-                return jsonify({
-                    'success': False,
-                    'message': 'Unauthorized - invalid or expired token. Please log in again.'
-                }), 401
+            logger.warning(f"Manager unauthorized - token not found or expired")
+            return jsonify({
+                'success': False,
+                'message': 'Unauthorized - invalid or expired token. Please log in again.'
+            }), 401
         
         # Verify it's a manager session
         if session_data.get('role') != 'manager':
@@ -1131,36 +1577,21 @@ def update_website():
     """Update website content (admin only)"""
     try:
         data = request.get_json()
+        if not isinstance(data, dict):
+            return jsonify({
+                'success': False,
+                'message': 'Invalid request data'
+            }), 400
         
-        # Save website changes to a JSON file
-        website_config_file = 'website_config.json'
-        
-        # Load existing config or create new
-        if os.path.exists(website_config_file):
-            with open(website_config_file, 'r') as f:
-                config = json.load(f)
-        else:
-            config = {}
-        
-        # Update config with new changes
-        if 'content' in data:
-            config['content'] = {**config.get('content', {}), **data['content']}
-        if 'design' in data:
-            config['design'] = {**config.get('design', {}), **data['design']}
-        if 'images' in data:
-            config['images'] = {**config.get('images', {}), **data['images']}
-        
-        config['lastUpdated'] = datetime.now().isoformat()
-        
-        # Save updated config
-        with open(website_config_file, 'w') as f:
-            json.dump(config, f, indent=2)
+        # Merge the changes into the shared config (content, design and images sections)
+        version = website_config.update(data)
         
-        logger.info("Website configuration updated")
+        logger.info(f"Website configuration updated to version {version}")
         
         return jsonify({
             'success': True,
-            'message': 'Website updated successfully'
+            'message': 'Website updated successfully',
+            'version': version
         })
         
     except Exception as e:
@@ -1174,14 +1605,16 @@ def update_website():
 def get_website_config():
     """Get current website configuration"""
     try:
-        website_config_file = 'website_config.json'
+        version, _, body = website_config.get()
+        etag = f"config-v{version or 0}"
         
-        if os.path.exists(website_config_file):
-            with open(website_config_file, 'r') as f:
-                config = json.load(f)
-            return jsonify(config)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
         else:
-            return jsonify({})
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         logger.error(f"Error retrieving website config: {str(e)}")
         return jsonify({}), 500
@@ -1189,17 +1622,17 @@ def get_website_config():
 @app.route('/login')
 def admin_login_page():
     """Serve admin login page"""
-    return send_from_directory('.', 'login.html')
+    return serve_file('.', 'login.html')
 
 @app.route('/manager-login')
 def manager_login_page():
     """Serve manager login page"""
-    return send_from_directory('.', 'manager-login.html')
+    return serve_file('.', 'manager-login.html')
 
 @app.route('/manager')
 def manager_dashboard():
     """Serve manager dashboard"""
-    return send_from_directory('.', 'manager-dashboard.html')
+    return serve_file('.', 'manager-dashboard.html')
 
 if __name__ == '__main__':
     # Create leads file if it doesn't exist
@@ -1207,5 +1640,8 @@ if __name__ == '__main__':
         with open('leads.json', 'w') as f:
             json.dump([], f)
     
+    # Development server: bring a local database up to date (production runs migrations.py before deploy)
+    migrate(db.get())
+    
     # Run the Flask application
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
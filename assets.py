@@ -0,0 +1,294 @@
+"""
+Static Asset Build for Dubai Smart Investment
+Copies the pages and static files into a build directory with gzip and brotli
+variants next to each compressible file, so workers send precompressed bytes
+instead of compressing (or re-sending) them on every request.
+
+Files under static/ also get a content hash in their name
+(static/images/bedroom.3f9a1c0e2b7d.jpg) and pages are rewritten to use the
+hashed URLs, which are cached by browsers for a year. Pages and unhashed paths
+are revalidated with an ETag instead.
+
+Photos with responsive variants (python responsive_images.py build) also get a
+srcset pointing at the resized copies.
+
+Build (run before starting the server; unchanged files are skipped):
+    python assets.py build [--output dist]
+"""
+import os
+import re
+import sys
+import json
+import gzip
+import hashlib
+import argparse
+import mimetypes
+import logging
+
+from flask import send_file
+
+from responsive_images import MANIFEST_PATH as VARIANTS_MANIFEST, DEFAULT_SIZES, load_variants
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+# Files served from the project root besides the pages
+ROOT_ASSET_EXTENSIONS = {'.html', '.ico', '.png', '.webmanifest', '.xml'}
+ROOT_ASSET_NAMES = {'robots.txt'}
+COMPRESSIBLE_EXTENSIONS = {'.html', '.css', '.js', '.json', '.svg', '.txt', '.xml', '.webmanifest', '.ico'}
+# Smaller files aren't worth a compressed copy
+MIN_COMPRESS_SIZE = 512
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+# "/static/..." references inside pages (absolute https://... URLs are left alone)
+STATIC_REFERENCE = re.compile(r'''(?<=["'(])/static/([^"'()?#\s]+)''')
+IMG_TAG = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+IMG_SRC = re.compile(r'''\ssrc=(["'])/(static/[^"']+)\1''')
+
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+
+class AssetManifest:
+    def __init__(self, output_dir, source_dir='.'):
+        self.output_dir = output_dir
+        self.source_dir = source_dir
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            self.files = json.load(f)['files']
+
+        # Hashed names map back to their entry so they can be served directly
+        self.hashed = {entry['hashed']: key for key, entry in self.files.items() if entry.get('hashed')}
+
+    def source_key(self, key):
+        """Source path for a hashed path (other paths are returned unchanged)"""
+        return self.hashed.get(key, key)
+
+    def hashed_key(self, key):
+        """Hashed path for a source path, or the path itself if it has no hashed copy"""
+        entry = self.files.get(key)
+        return entry['hashed'] if entry and entry.get('hashed') else key
+
+    def current_entry(self, key):
+        """Manifest entry for a source path if the build is up to date with it, otherwise None"""
+        entry = self.files.get(key)
+        if entry is None or not self._is_current(key, entry):
+            return None
+        return entry
+
+    def read(self, path):
+        """Bytes of a built file (a path from a manifest entry)"""
+        with open(os.path.join(self.output_dir, path), 'rb') as f:
+            return f.read()
+
+    def response(self, key, accept_encodings):
+        """
+        Response for a request path (relative to the project root), or None when the
+        build has no current copy of it and the source file should be served instead
+        """
+        immutable = key in self.hashed
+        if immutable:
+            key = self.hashed[key]
+
+        entry = self.files.get(key)
+        if entry is None:
+            return None
+        if not immutable and not self._is_current(key, entry):
+            return None
+
+        encoding = self._choose_encoding(entry, accept_encodings)
+        path = entry['encodings'][encoding] if encoding else entry['file']
+        etag = f"{entry['hash']}-{encoding}" if encoding else entry['hash']
+
+        response = send_file(os.path.join(self.output_dir, path), mimetype=entry['mimetype'],
+                             etag=etag, conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if entry['encodings']:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE
+        return response
+
+    def _is_current(self, key, entry):
+        # Source files edited after the build are served from disk until the next build
+        try:
+            stat = os.stat(os.path.join(self.source_dir, key))
+        except OSError:
+            return False
+        return stat.st_size == entry['source_size'] and int(stat.st_mtime) == entry['source_mtime']
+
+    def _choose_encoding(self, entry, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in entry['encodings'] and accept_encodings[encoding]:
+                return encoding
+        return None
+
+def load_manifest(output_dir, source_dir='.'):
+    """Open an asset build, returning None if it is missing or unreadable"""
+    if not output_dir or not os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+        return None
+    try:
+        manifest = AssetManifest(output_dir, source_dir)
+        logger.info(f"Asset build loaded: {len(manifest.files)} files from {output_dir}")
+        return manifest
+    except Exception as e:
+        logger.error(f"Failed to load asset build {output_dir}: {str(e)}")
+        return None
+
+def source_files(source_dir='.'):
+    """Project-relative paths of every file the site serves"""
+    files = []
+    for name in sorted(os.listdir(source_dir)):
+        if not os.path.isfile(os.path.join(source_dir, name)):
+            continue
+        if name in ROOT_ASSET_NAMES or os.path.splitext(name)[1].lower() in ROOT_ASSET_EXTENSIONS:
+            files.append(name)
+
+    for root, _, names in os.walk(os.path.join(source_dir, 'static')):
+        for name in sorted(names):
+            if name.lower() in ('readme.txt', 'desktop.ini', 'thumbs.db'):
+                continue
+            files.append(os.path.relpath(os.path.join(root, name), source_dir).replace(os.sep, '/'))
+    return files
+
+def hashed_name(key, digest):
+    base, ext = os.path.splitext(key)
+    return f"{base}.{digest[:12]}{ext}"
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _compress(data):
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    # Keep a variant only if it saves at least 10%
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data) * 0.9}
+
+def build_assets(source_dir='.', output_dir='dist'):
+    """Write hashed and precompressed copies of the site into output_dir. Returns (built, skipped)."""
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        previous = {}
+
+    keys = source_files(source_dir)
+    contents = {}
+    for key in keys:
+        with open(os.path.join(source_dir, key), 'rb') as f:
+            contents[key] = f.read()
+
+    # Hash static files first so pages can point at the hashed URLs
+    hashed = {}
+    for key in keys:
+        if key.startswith('static/'):
+            hashed[key] = hashed_name(key, hashlib.sha256(contents[key]).hexdigest())
+
+    def rewrite(match):
+        target = hashed.get('static/' + match.group(1))
+        return '/' + target if target else match.group(0)
+
+    variants = load_variants(os.path.join(source_dir, VARIANTS_MANIFEST))
+
+    def add_srcset(match):
+        tag = match.group(0)
+        src = IMG_SRC.search(tag)
+        if not src or 'srcset=' in tag.lower():
+            return tag
+        srcset = variants.srcset(src.group(2))
+        if not srcset:
+            return tag
+        candidates = ', '.join(f"/{hashed.get(path, path)} {width}w" for path, width in srcset)
+        attrs = f' srcset="{candidates}"'
+        if 'sizes=' not in tag.lower():
+            attrs += f' sizes="{DEFAULT_SIZES}"'
+        return tag[:src.end()] + attrs + tag[src.end():]
+
+    files = {}
+    built = skipped = 0
+    for key in keys:
+        data = contents[key]
+        ext = os.path.splitext(key)[1].lower()
+        if ext == '.html':
+            html = data.decode('utf-8')
+            if variants:
+                html = IMG_TAG.sub(add_srcset, html)
+            data = STATIC_REFERENCE.sub(rewrite, html).encode('utf-8')
+
+        digest = hashlib.sha256(data).hexdigest()
+        stat = os.stat(os.path.join(source_dir, key))
+        entry = {
+            'file': hashed.get(key, key),
+            'hashed': hashed.get(key),
+            'hash': digest[:16],
+            'mimetype': mimetypes.guess_type(key)[0] or 'application/octet-stream',
+            'source_size': stat.st_size,
+            'source_mtime': int(stat.st_mtime),
+            'encodings': {}
+        }
+
+        old = previous.get(key)
+        outputs = [entry['file']] + (list(old['encodings'].values()) if old else [])
+        if old and old['hash'] == entry['hash'] and old['file'] == entry['file'] \
+                and all(os.path.exists(os.path.join(output_dir, path)) for path in outputs):
+            entry['encodings'] = old['encodings']
+            files[key] = entry
+            skipped += 1
+            continue
+
+        _write(os.path.join(output_dir, entry['file']), data)
+        if ext in COMPRESSIBLE_EXTENSIONS and len(data) >= MIN_COMPRESS_SIZE:
+            suffixes = {'gzip': '.gz', 'br': '.br'}
+            for encoding, body in _compress(data).items():
+                path = entry['file'] + suffixes[encoding]
+                _write(os.path.join(output_dir, path), body)
+                entry['encodings'][encoding] = path
+
+        files[key] = entry
+        built += 1
+
+    _write(manifest_path, json.dumps({'files': files}, indent=1, sort_keys=True).encode('utf-8'))
+    _prune(output_dir, files)
+    return built, skipped
+
+def _prune(output_dir, files):
+    """Remove outputs of earlier builds that the new manifest no longer references"""
+    keep = {MANIFEST_NAME}
+    for entry in files.values():
+        keep.add(entry['file'])
+        keep.update(entry['encodings'].values())
+
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), output_dir).replace(os.sep, '/')
+            if path not in keep:
+                os.remove(os.path.join(root, name))
+
+def main():
+    parser = argparse.ArgumentParser(description='Build precompressed, content-hashed static assets')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Build the asset directory')
+    build.add_argument('--source', default='.')
+    build.add_argument('--output', default=os.environ.get('ASSET_BUILD_DIR') or 'dist')
+
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("⚠️  brotli is not installed; writing gzip variants only")
+    built, skipped = build_assets(args.source, args.output)
+    print(f"✅ Assets written to {args.output}: {built} built, {skipped} unchanged")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Circuit Breakers for Dubai Smart Investment
+Every call to an outside dependency (the database, SMTP, ipapi.co) goes
+through that dependency's breaker. After failure_threshold failures in a row
+(errors, or calls slower than slow_call_seconds) the breaker opens and calls
+are refused straight away with CircuitOpenError, so requests don't queue up
+behind a dependency that is down. After reset_timeout seconds it lets
+half_open_max probe calls through: a success closes it again, a failure
+opens it for another reset_timeout.
+
+Breakers are shared by every thread of a process (get_breaker returns the
+same one for a name); each gunicorn worker keeps its own state.
+
+    CIRCUIT_FAILURE_THRESHOLD   failures in a row that open a breaker (default 5)
+    CIRCUIT_RESET_TIMEOUT       seconds before an open breaker is probed (default 30)
+"""
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD') or 5)
+RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT') or 30)
+
+class CircuitOpenError(RuntimeError):
+    """A call was refused because the dependency's breaker is open"""
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, half_open_max=1,
+                 slow_call_seconds=None, ignore=()):
+        # ignore: exception types raised by the caller's own mistakes (bad input), not by the dependency
+        self.name = name
+        self.failure_threshold = failure_threshold or FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or RESET_TIMEOUT
+        self.half_open_max = half_open_max
+        self.slow_call_seconds = slow_call_seconds
+        self.ignore = ignore
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self._probe_at = None
+        self._last_error = None
+        self._lock = threading.Lock()
+        self.stats = {'successes': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'opened': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def available(self):
+        """True if a call would be let through now (without reserving a half-open probe)"""
+        with self._lock:
+            self._refresh()
+            return self._state == CLOSED or (self._state == HALF_OPEN and self._probes < self.half_open_max)
+
+    def allow(self):
+        """
+        Ask to make a call. Returns False if the breaker is open; otherwise the caller must
+        report the outcome with record_success() or record_failure().
+        """
+        with self._lock:
+            self._refresh()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_max:
+                self._probes += 1
+                self._probe_at = time.monotonic()
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self, duration=None, slow_call_seconds=None):
+        """
+        Report a call that worked; one slower than slow_call_seconds (by default the
+        breaker's) counts as a failure
+        """
+        slow_call_seconds = slow_call_seconds or self.slow_call_seconds
+        if duration is not None and slow_call_seconds and duration > slow_call_seconds:
+            self.stats['slow_calls'] += 1
+            self.record_failure(f"call took {duration:.1f}s")
+            return
+
+        with self._lock:
+            self.stats['successes'] += 1
+            self._failures = 0
+            if self._state != CLOSED:
+                logger.info(f"Circuit {self.name} closed: dependency is answering again")
+                self._state = CLOSED
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.stats['failures'] += 1
+            self._failures += 1
+            self._last_error = str(error) if error is not None else None
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._open()
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn through the breaker, raising CircuitOpenError instead if it is open"""
+        return self.call_within(self.slow_call_seconds, fn, *args, **kwargs)
+
+    def call_within(self, slow_call_seconds, fn, *args, **kwargs):
+        """call() with its own slow-call threshold (None: however long it takes, it isn't slow)"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open): {self._last_error}")
+
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except self.ignore:
+            self._release()
+            raise
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success(time.monotonic() - started if slow_call_seconds else None, slow_call_seconds)
+        return result
+
+    def status(self):
+        """State and counters for the metrics endpoint"""
+        with self._lock:
+            self._refresh()
+            retry_in = None
+            if self._state == OPEN:
+                retry_in = round(max(self.reset_timeout - (time.monotonic() - self._opened_at), 0), 1)
+            return {'state': self._state, 'consecutive_failures': self._failures, 'retry_in': retry_in,
+                    'last_error': self._last_error, **self.stats}
+
+    def _release(self):
+        # The call failed before it reached the dependency: give a half-open probe back
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def _open(self):
+        # Called with the lock held
+        if self._state != OPEN:
+            logger.warning(f"Circuit {self.name} opened after {self._failures} failure(s): {self._last_error}")
+            self.stats['opened'] += 1
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+
+    def _refresh(self):
+        # Called with the lock held
+        now = time.monotonic()
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        elif self._state == HALF_OPEN and self._probes and now - self._probe_at >= self.reset_timeout:
+            # A probe that never reported back must not keep the breaker half-open forever
+            self._probes = 0
+
+    def _after_fork(self):
+        # Another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(name, **options):
+    """The process's breaker for a dependency, created with options on first use"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+def breaker_stats():
+    """{name: status} for every breaker in this process"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.status() for breaker in breakers}
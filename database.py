@@ -1,45 +1,139 @@
 """
 MongoDB Database Configuration for Dubai Smart Investment
 Handles leads, users, and website configuration storage
-MongoDB connection is REQUIRED - no local fallback
+Implements the storage interface (storage.py); sqlite_store.py is the local alternative
 """
 import os
+import re
+import json
+import time
+import base64
+import threading
+import copy
+import functools
 from pymongo import MongoClient, ASCENDING, DESCENDING
 from bson.objectid import ObjectId
-from datetime import datetime
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from datetime import datetime, timedelta, timezone
 import logging
 
+from lead_rollups import ROLLUP_FIELDS, rollup_updates, rebuild_pipeline
+from storage import Storage, open_database, take_swallowed_error
+from circuit_breaker import get_breaker, CircuitOpenError
+
 logger = logging.getLogger(__name__)
 
-class Database:
-    def __init__(self):
-        # MongoDB connection string from environment variable (REQUIRED)
-        mongo_uri = os.environ.get('MONGODB_URI')
+# Lead fields that can be filtered on with an equality match (each has a compound index)
+LEAD_FILTER_FIELDS = ['status', 'assigned_to', 'source', 'country']
+
+# Fields the admin dashboard's search box looks in (case-insensitive substring), and the
+# two fields a property interest may be stored in
+LEAD_SEARCH_FIELDS = ['firstName', 'lastName', 'email', 'whatsapp', 'phone', 'country',
+                      'contactMethod', 'timeframe', 'propertyType']
+LEAD_INTEREST_FIELDS = ['propertyType', 'interest']
+
+# Fail within seconds instead of pymongo's 30 s server selection when MongoDB is unreachable;
+# a single operation may take up to MONGODB_SOCKET_TIMEOUT_MS (0 = no limit)
+MONGODB_TIMEOUT_MS = int(os.environ.get('MONGODB_TIMEOUT_MS') or 3000)
+MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS') or 20000)
+
+# A database call slower than this counts as a failure for the 'database' circuit breaker
+DATABASE_SLOW_CALL_SECONDS = float(os.environ.get('DATABASE_SLOW_CALL_SECONDS') or 2.5)
+
+# rebuild_lead_rollups holds lead writes while it recounts, so its $out can't overwrite
+# counter changes: a write waits up to ROLLUP_REBUILD_WAIT_SECONDS for it, and the rebuild
+# gives writes already under way ROLLUP_REBUILD_SETTLE_SECONDS to finish before counting.
+# A rebuild that dies keeps the lock only for ROLLUP_REBUILD_LOCK_SECONDS.
+ROLLUP_REBUILD_WAIT_SECONDS = float(os.environ.get('ROLLUP_REBUILD_WAIT_SECONDS') or 30)
+ROLLUP_REBUILD_SETTLE_SECONDS = float(os.environ.get('ROLLUP_REBUILD_SETTLE_SECONDS') or 1)
+ROLLUP_REBUILD_LOCK_SECONDS = 600
+
+# Fields read before a lead changes, to move it between rollup buckets
+ROLLUP_PROJECTION = {field: 1 for field in ROLLUP_FIELDS + ['created_at']}
+
+# Adds the JSON-friendly '_id' and 'timestamp' fields on the server instead of in Python
+LEAD_JSON_FIELDS = {
+    '_id': {'$toString': '$_id'},
+    'timestamp': {'$cond': [
+        {'$ifNull': ['$created_at', False]},
+        {'$dateToString': {'date': '$created_at', 'format': '%Y-%m-%dT%H:%M:%S.%L'}},
+        '$$REMOVE'
+    ]}
+}
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def to_utc(value):
+    """
+    A naive local datetime (like datetime.now()) as naive UTC. MongoDB's TTL monitor
+    compares expireAfterSeconds fields with UTC, so those fields are stored in UTC.
+    """
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def from_utc(value):
+    """A naive UTC datetime read back from a TTL field as naive local time"""
+    return value.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+def with_object_id(lead):
+    """Store an '_id' given as a string (see storage.new_id) as an ObjectId, like generated ones"""
+    if isinstance(lead.get('_id'), str):
+        lead['_id'] = ObjectId(lead['_id'])
+    return lead
+
+def encode_cursor(created_at, lead_id):
+    """Encode a (created_at, _id) position as an opaque pagination cursor"""
+    raw = json.dumps({'t': created_at.isoformat(), 'id': str(lead_id)})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor, raising ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data['t']), ObjectId(data['id'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+class Database(Storage):
+    backend = 'mongodb'
+    
+    def __init__(self, verify_schema=True, mongo_uri=None):
+        # MongoDB connection string from environment variable (REQUIRED unless passed in)
+        mongo_uri = mongo_uri or os.environ.get('MONGODB_URI')
         
         if not mongo_uri:
             raise RuntimeError("MONGODB_URI environment variable is required")
         
         try:
-            self.client = MongoClient(mongo_uri)
+            self.client = MongoClient(mongo_uri, serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS,
+                                      connectTimeoutMS=MONGODB_TIMEOUT_MS,
+                                      socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS or None)
             self.db = self.client['dubai_smart_invest']
+            self.name = self.db.name
             
             # Collections
             self.leads = self.db['leads']
             self.users = self.db['users']
             self.sessions = self.db['sessions']
             self.config = self.db['website_config']
-            
-            # Create indexes for better performance
-            self.leads.create_index([('email', ASCENDING)])
-            self.leads.create_index([('created_at', DESCENDING)])
-            self.sessions.create_index([('token', ASCENDING)])
-            self.sessions.create_index([('expires_at', ASCENDING)])
-            self.users.create_index([('username', ASCENDING)], unique=True)
+            self.email_outbox = self.db['email_outbox']
+            self.geo_cache = self.db['geo_cache']
+            self.revoked_tokens = self.db['revoked_tokens']
+            self.lead_queue = self.db['lead_queue']
+            self.lead_rollups = self.db['lead_rollups']
+            self.lead_rollups_lock = self.db['lead_rollups_lock']
+            self.schema_migrations = self.db['schema_migrations']
             
             # Test connection
             self.client.admin.command('ping')
             logger.info("MongoDB connected successfully")
             
+            # Indexes are created by migrations.py before a deploy, not here
+            self.schema_version = self.verify_schema() if verify_schema else None
+            
         except Exception as e:
             logger.error(f"MongoDB connection failed: {str(e)}")
             raise RuntimeError(f"Failed to connect to MongoDB: {str(e)}")
@@ -47,11 +141,13 @@ class Database:
     def save_lead(self, lead_data):
         """Save a new lead to database"""
         try:
+            self._hold_for_rollup_rebuild()
             lead_data['created_at'] = datetime.now()
             lead_data['updated_at'] = datetime.now()
             lead_data['status'] = lead_data.get('status', 'new')
             
-            result = self.leads.insert_one(lead_data)
+            result = self.leads.insert_one(with_object_id(lead_data))
+            self._update_rollups(added=[lead_data])
             logger.info(f"Lead saved to MongoDB: {lead_data.get('email')}")
             return str(result.inserted_id)
             
@@ -59,59 +155,642 @@ class Database:
             logger.error(f"Error saving lead to MongoDB: {str(e)}")
             raise
     
-    def get_all_leads(self):
-        """Get all leads sorted by newest first"""
+    def save_lead_once(self, lead_data):
+        """
+        Save a lead that carries a source and lead_id unless that lead is already stored.
+        Returns the new lead's id, or None if it was a duplicate.
+        """
         try:
-            leads = list(self.leads.find().sort('created_at', DESCENDING))
+            self._hold_for_rollup_rebuild()
+            now = datetime.now()
+            lead_data['created_at'] = now
+            lead_data['updated_at'] = now
+            lead_data['status'] = lead_data.get('status', 'new')
             
-            # Convert ObjectId to string for JSON serialization
-            for lead in leads:
-                lead['_id'] = str(lead['_id'])
-                if 'created_at' in lead:
-                    lead['timestamp'] = lead['created_at'].isoformat()
+            key = {'source': lead_data['source'], 'lead_id': lead_data['lead_id']}
+            result = self.leads.update_one(key, {'$setOnInsert': with_object_id(lead_data)}, upsert=True)
+            if result.upserted_id is None:
+                logger.info(f"Duplicate lead ignored: {lead_data['source']} {lead_data['lead_id']}")
+                return None
             
-            return leads
+            self._update_rollups(added=[lead_data])
+            logger.info(f"Lead saved to MongoDB: {lead_data.get('email')}")
+            return str(result.upserted_id)
             
+        except DuplicateKeyError:
+            # A concurrent delivery of the same lead inserted it first
+            logger.info(f"Duplicate lead ignored: {lead_data['source']} {lead_data['lead_id']}")
+            return None
         except Exception as e:
+            logger.error(f"Error saving lead to MongoDB: {str(e)}")
+            raise
+    
+    def insert_leads(self, leads):
+        """
+        Insert a batch of leads in one unordered insert_many.
+        Returns {index: (error_code, message)} for the leads that were not inserted.
+        """
+        if not leads:
+            return {}
+        try:
+            self._hold_for_rollup_rebuild()
+            self.leads.insert_many([with_object_id(lead) for lead in leads], ordered=False)
+            self._update_rollups(added=leads)
+            return {}
+            
+        except BulkWriteError as e:
+            # Unordered inserts keep going past failed documents; report each one
+            failures = {error['index']: (error.get('code'), error.get('errmsg', ''))
+                        for error in e.details.get('writeErrors', [])}
+            self._update_rollups(added=[lead for index, lead in enumerate(leads) if index not in failures])
+            return failures
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error inserting leads: {str(e)}")
+            return {index: (None, str(e)) for index in range(len(leads))}
+    
+    def get_all_leads(self):
+        """Get all leads sorted by newest first"""
+        try:
+            return list(self.leads.aggregate([
+                {'$sort': {'created_at': DESCENDING, '_id': DESCENDING}},
+                {'$addFields': LEAD_JSON_FIELDS}
+            ]))
+            
+        except Exception as e:
+            self._record_error(e)
             logger.error(f"Error fetching leads from MongoDB: {str(e)}")
             return []
     
+    def build_lead_query(self, filters=None):
+        """
+        Build a MongoDB query from lead filters:
+        status, assigned_to, source, country (exact match), date_from / date_to (datetimes),
+        interest (propertyType or interest) and search (text in any LEAD_SEARCH_FIELDS)
+        """
+        filters = filters or {}
+        query = {}
+        
+        for field in LEAD_FILTER_FIELDS:
+            if filters.get(field):
+                query[field] = filters[field]
+        
+        created_at = {}
+        if filters.get('date_from'):
+            created_at['$gte'] = filters['date_from']
+        if filters.get('date_to'):
+            created_at['$lt'] = filters['date_to']
+        if created_at:
+            query['created_at'] = created_at
+        
+        alternatives = []
+        if filters.get('interest'):
+            alternatives.append([{field: filters['interest']} for field in LEAD_INTEREST_FIELDS])
+        if filters.get('search'):
+            pattern = {'$regex': re.escape(filters['search']), '$options': 'i'}
+            alternatives.append([{field: pattern} for field in LEAD_SEARCH_FIELDS])
+        if alternatives:
+            query['$and'] = [{'$or': conditions} for conditions in alternatives]
+        
+        return query
+    
+    def get_leads_page(self, filters=None, limit=50, cursor=None, fields=None):
+        """
+        Get one page of leads, newest first, using keyset pagination on (created_at, _id).
+        Returns (leads, next_cursor); next_cursor is None on the last page.
+        """
+        query = self.build_lead_query(filters)
+        
+        if cursor:
+            created_at, lead_id = decode_cursor(cursor)
+            query = {'$and': [query, {'$or': [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': lead_id}}
+            ]}]}
+        
+        pipeline = [
+            {'$match': query},
+            {'$sort': {'created_at': DESCENDING, '_id': DESCENDING}},
+            # One extra document tells us whether there is another page
+            {'$limit': limit + 1}
+        ]
+        
+        if fields:
+            # created_at is always needed to build the next cursor
+            pipeline.append({'$project': {field: 1 for field in set(fields) | {'created_at'}}})
+        
+        pipeline.append({'$addFields': {**LEAD_JSON_FIELDS, '_cursor_id': '$_id'}})
+        
+        try:
+            leads = list(self.leads.aggregate(pipeline))
+            
+        except Exception as e:
+            logger.error(f"Error fetching leads page from MongoDB: {str(e)}")
+            raise
+        
+        next_cursor = None
+        if len(leads) > limit:
+            leads = leads[:limit]
+            last = leads[-1]
+            next_cursor = encode_cursor(last['created_at'], last['_cursor_id'])
+        
+        for lead in leads:
+            del lead['_cursor_id']
+            if fields and 'created_at' not in fields:
+                del lead['created_at']
+        
+        return leads, next_cursor
+    
+    def iter_leads(self, filters=None, fields=None, batch_size=1000):
+        """Stream leads matching the filters, newest first, without loading them all into memory"""
+        projection = {field: 1 for field in fields} if fields else None
+        return self.leads.find(self.build_lead_query(filters), projection) \
+            .sort([('created_at', DESCENDING), ('_id', DESCENDING)]) \
+            .batch_size(batch_size)
+    
     def delete_lead(self, lead_id):
         """Delete a lead by ID"""
         try:
-            result = self.leads.delete_one({'_id': ObjectId(lead_id)})
-            return result.deleted_count > 0
+            self._hold_for_rollup_rebuild()
+            deleted = self.leads.find_one_and_delete({'_id': ObjectId(lead_id)}, projection=ROLLUP_PROJECTION)
+            if deleted is None:
+                return False
+            self._update_rollups(removed=[deleted])
+            return True
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error deleting lead from MongoDB: {str(e)}")
             return False
     
     def delete_leads_bulk(self, lead_ids):
         """Delete multiple leads"""
         try:
-            object_ids = [ObjectId(lid) for lid in lead_ids]
-            result = self.leads.delete_many({'_id': {'$in': object_ids}})
+            self._hold_for_rollup_rebuild()
+            # Read the rollup fields of the leads, then delete them and uncount them in one pass
+            query = {'_id': {'$in': [ObjectId(lead_id) for lead_id in lead_ids]}}
+            leads = list(self.leads.find(query, ROLLUP_PROJECTION))
+            if not leads:
+                return 0
+            result = self.leads.delete_many({'_id': {'$in': [lead['_id'] for lead in leads]}})
+            if result.deleted_count != len(leads):
+                logger.warning("Some leads were deleted by another request during a bulk delete: "
+                               "run python lead_rollups.py rebuild if the dashboard counts look off")
+            self._update_rollups(removed=leads)
             return result.deleted_count
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error bulk deleting leads from MongoDB: {str(e)}")
             return 0
     
     def update_lead(self, lead_id, update_data):
         """Update a lead"""
         try:
+            self._hold_for_rollup_rebuild()
             update_data['updated_at'] = datetime.now()
             
-            result = self.leads.update_one(
+            before = self.leads.find_one_and_update(
                 {'_id': ObjectId(lead_id)},
-                {'$set': update_data}
+                {'$set': update_data},
+                projection=ROLLUP_PROJECTION
             )
-            return result.modified_count > 0
+            if before is None:
+                return False
+            self._update_rollups(added=[{**before, **update_data}], removed=[before])
+            return True
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error updating lead in MongoDB: {str(e)}")
             return False
     
+    # Schema migration methods
+    def verify_schema(self):
+        """Log an error when migrations are pending. Returns the applied schema version."""
+        from migrations import LATEST_VERSION
+        
+        version = self.get_schema_version()
+        if version is None:
+            logger.error("Could not read the database schema version")
+        elif version < LATEST_VERSION:
+            logger.error(f"Database schema is at version {version}, this code expects {LATEST_VERSION}: "
+                         f"run python migrations.py")
+        elif version > LATEST_VERSION:
+            logger.warning(f"Database schema is at version {version}, newer than this code ({LATEST_VERSION})")
+        return version
+    
+    def get_applied_migrations(self):
+        """{version: record} for every applied migration"""
+        try:
+            return {record['version']: record
+                    for record in self.schema_migrations.find({'version': {'$exists': True}})}
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error reading schema migrations: {str(e)}")
+            return None
+    
+    def get_schema_version(self):
+        """Highest applied migration version (0 for a new database)"""
+        try:
+            latest = self.schema_migrations.find_one({'version': {'$exists': True}}, sort=[('version', DESCENDING)])
+            return latest['version'] if latest else 0
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error reading schema version: {str(e)}")
+            return None
+    
+    def record_migration(self, version, name, duration_ms):
+        """Mark a migration as applied"""
+        try:
+            self.schema_migrations.replace_one(
+                {'_id': version},
+                {'version': version, 'name': name, 'duration_ms': duration_ms, 'applied_at': datetime.now()},
+                upsert=True
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error recording migration {version}: {str(e)}")
+            return False
+    
+    def acquire_migration_lock(self, owner, lock_seconds):
+        """Take the migration lock so only one runner applies migrations; False if someone else holds it"""
+        try:
+            now = datetime.now()
+            # A runner that died keeps the lock only until it expires
+            self.schema_migrations.delete_one({'_id': 'lock', 'expires_at': {'$lt': now}})
+            self.schema_migrations.insert_one({
+                '_id': 'lock',
+                'owner': owner,
+                'expires_at': now + timedelta(seconds=lock_seconds)
+            })
+            return True
+            
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error taking migration lock: {str(e)}")
+            return False
+    
+    def release_migration_lock(self, owner):
+        try:
+            self.schema_migrations.delete_one({'_id': 'lock', 'owner': owner})
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error releasing migration lock: {str(e)}")
+            return False
+    
+    # Lead rollup methods
+    def _hold_for_rollup_rebuild(self):
+        """Wait while rebuild_lead_rollups recounts, so its $out doesn't overwrite this write's counts"""
+        deadline = time.monotonic() + ROLLUP_REBUILD_WAIT_SECONDS
+        while self.lead_rollups_lock.find_one({'_id': 'rebuild', 'expires_at': {'$gt': datetime.now()}}, {'_id': 1}):
+            if time.monotonic() >= deadline:
+                logger.warning("Lead write went ahead during a rollup rebuild: "
+                               "run python lead_rollups.py rebuild again if the dashboard counts look off")
+                return
+            time.sleep(0.05)
+    
+    def _update_rollups(self, added=(), removed=()):
+        """Adjust the rollup counters for leads that were added, removed or changed (removed + added)"""
+        try:
+            updates = rollup_updates(added, removed)
+            if updates:
+                self.lead_rollups.bulk_write(updates, ordered=False)
+                
+        except Exception as e:
+            self._record_error(e)
+            # The lead write itself succeeded; the counters are fixed by the next rebuild
+            logger.error(f"Error updating lead rollups (run python lead_rollups.py rebuild): {str(e)}")
+    
+    def get_lead_rollups(self, date_from=None, date_to=None):
+        """{dimension: {value: count}} from the rollup counters; day buckets can be limited to a date range"""
+        try:
+            rollups = {}
+            for bucket in self.lead_rollups.find({'count': {'$gt': 0}}):
+                dimension, value = bucket['dimension'], bucket['value']
+                if dimension == 'day' and ((date_from and value < date_from) or (date_to and value > date_to)):
+                    continue
+                rollups.setdefault(dimension, {})[value] = bucket['count']
+            return rollups
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching lead rollups: {str(e)}")
+            return None
+    
+    def rebuild_lead_rollups(self):
+        """
+        Recount every rollup bucket from the leads collection. Returns the number of buckets.
+        Lead writes wait while it runs (_hold_for_rollup_rebuild), so none is lost to the $out.
+        """
+        try:
+            now = datetime.now()
+            # A rebuild that died keeps the lock only until it expires
+            self.lead_rollups_lock.delete_one({'_id': 'rebuild', 'expires_at': {'$lt': now}})
+            self.lead_rollups_lock.insert_one({
+                '_id': 'rebuild',
+                'expires_at': now + timedelta(seconds=ROLLUP_REBUILD_LOCK_SECONDS)
+            })
+        except DuplicateKeyError:
+            logger.error("Lead rollups are already being rebuilt")
+            return None
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error taking the lead rollups lock: {str(e)}")
+            return None
+        
+        try:
+            # Writes that checked the lock before it was taken finish their counter updates first
+            time.sleep(ROLLUP_REBUILD_SETTLE_SECONDS)
+            self.leads.aggregate(rebuild_pipeline(self.lead_rollups.name), allowDiskUse=True)
+            return self.lead_rollups.count_documents({})
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error rebuilding lead rollups: {str(e)}")
+            return None
+        finally:
+            try:
+                self.lead_rollups_lock.delete_one({'_id': 'rebuild'})
+            except Exception as e:
+                logger.error(f"Error releasing the lead rollups lock (it expires in "
+                             f"{ROLLUP_REBUILD_LOCK_SECONDS} s): {str(e)}")
+    
+    # Email outbox methods
+    def enqueue_email(self, kind, payload):
+        """Add an email job to the outbox"""
+        try:
+            now = datetime.now()
+            result = self.email_outbox.insert_one({
+                'kind': kind,
+                'payload': payload,
+                'status': 'pending',
+                'attempts': 0,
+                'next_attempt_at': now,
+                'created_at': now,
+                'updated_at': now
+            })
+            return str(result.inserted_id)
+            
+        except Exception as e:
+            logger.error(f"Error queueing email: {str(e)}")
+            raise
+    
+    def claim_email_job(self, worker_id, lease_seconds=300):
+        """Atomically claim the next due email job (or one whose lease has expired)"""
+        try:
+            now = datetime.now()
+            return self.email_outbox.find_one_and_update(
+                {'$or': [
+                    {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                    {'status': 'sending', 'lease_expires_at': {'$lte': now}}
+                ]},
+                {
+                    '$set': {
+                        'status': 'sending',
+                        'worker': worker_id,
+                        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                        'updated_at': now
+                    },
+                    '$inc': {'attempts': 1}
+                },
+                sort=[('next_attempt_at', ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error claiming email job: {str(e)}")
+            return None
+    
+    def complete_email_job(self, job_id):
+        """Mark an email job as sent"""
+        try:
+            now = datetime.now()
+            self.email_outbox.update_one(
+                {'_id': ObjectId(job_id)},
+                {'$set': {'status': 'sent', 'sent_at': now, 'updated_at': now},
+                 '$unset': {'lease_expires_at': '', 'worker': ''}}
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error completing email job {job_id}: {str(e)}")
+            return False
+    
+    def retry_email_job(self, job_id, next_attempt_at, error):
+        """Put a failed email job back in the queue for a later attempt"""
+        try:
+            self.email_outbox.update_one(
+                {'_id': ObjectId(job_id)},
+                {'$set': {
+                    'status': 'pending',
+                    'next_attempt_at': next_attempt_at,
+                    'last_error': error,
+                    'updated_at': datetime.now()
+                },
+                 '$unset': {'lease_expires_at': '', 'worker': ''}}
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error rescheduling email job {job_id}: {str(e)}")
+            return False
+    
+    def fail_email_job(self, job_id, error):
+        """Give up on an email job after too many attempts"""
+        try:
+            self.email_outbox.update_one(
+                {'_id': ObjectId(job_id)},
+                {'$set': {'status': 'failed', 'last_error': error, 'updated_at': datetime.now()},
+                 '$unset': {'lease_expires_at': '', 'worker': ''}}
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error failing email job {job_id}: {str(e)}")
+            return False
+    
+    def get_email_outbox_stats(self):
+        """Count outbox jobs by status"""
+        try:
+            pipeline = [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+            return {row['_id']: row['count'] for row in self.email_outbox.aggregate(pipeline)}
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching outbox stats: {str(e)}")
+            return {}
+    
+    # Lead processing queue methods
+    def enqueue_lead_job(self, kind, payload, key=None):
+        """Queue a lead for background processing. Returns False if a job with this key already exists."""
+        try:
+            now = datetime.now()
+            job = {
+                'kind': kind,
+                'payload': payload,
+                'status': 'pending',
+                'attempts': 0,
+                'next_attempt_at': now,
+                'created_at': now,
+                'updated_at': now
+            }
+            if key is None:
+                self.lead_queue.insert_one(job)
+                return True
+            
+            job['key'] = key
+            result = self.lead_queue.update_one({'key': key}, {'$setOnInsert': job}, upsert=True)
+            return result.upserted_id is not None
+            
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            logger.error(f"Error queueing lead: {str(e)}")
+            raise
+    
+    def claim_lead_job(self, worker_id, lease_seconds=120):
+        """Atomically claim the next due lead job (or one whose lease has expired)"""
+        try:
+            now = datetime.now()
+            return self.lead_queue.find_one_and_update(
+                {'$or': [
+                    {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                    {'status': 'processing', 'lease_expires_at': {'$lte': now}}
+                ]},
+                {
+                    '$set': {
+                        'status': 'processing',
+                        'worker': worker_id,
+                        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                        'updated_at': now
+                    },
+                    '$inc': {'attempts': 1}
+                },
+                sort=[('next_attempt_at', ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error claiming lead job: {str(e)}")
+            return None
+    
+    def complete_lead_job(self, job_id):
+        """Mark a lead job as processed"""
+        try:
+            now = datetime.now()
+            self.lead_queue.update_one(
+                {'_id': ObjectId(job_id)},
+                {'$set': {'status': 'done', 'done_at': now, 'updated_at': now},
+                 '$unset': {'lease_expires_at': '', 'worker': ''}}
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error completing lead job {job_id}: {str(e)}")
+            return False
+    
+    def retry_lead_job(self, job_id, next_attempt_at, error):
+        """Put a failed lead job back in the queue for a later attempt"""
+        try:
+            self.lead_queue.update_one(
+                {'_id': ObjectId(job_id)},
+                {'$set': {
+                    'status': 'pending',
+                    'next_attempt_at': next_attempt_at,
+                    'last_error': error,
+                    'updated_at': datetime.now()
+                },
+                 '$unset': {'lease_expires_at': '', 'worker': ''}}
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error rescheduling lead job {job_id}: {str(e)}")
+            return False
+    
+    def fail_lead_job(self, job_id, error):
+        """Give up on a lead job after too many attempts (the payload is kept for recovery)"""
+        try:
+            self.lead_queue.update_one(
+                {'_id': ObjectId(job_id)},
+                {'$set': {'status': 'failed', 'last_error': error, 'updated_at': datetime.now()},
+                 '$unset': {'lease_expires_at': '', 'worker': ''}}
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error failing lead job {job_id}: {str(e)}")
+            return False
+    
+    def get_lead_queue_stats(self):
+        """Count lead jobs by status, plus the age in seconds of the oldest unfinished job"""
+        try:
+            pipeline = [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+            stats = {row['_id']: row['count'] for row in self.lead_queue.aggregate(pipeline)}
+            
+            oldest = self.lead_queue.find_one({'status': {'$in': ['pending', 'processing']}},
+                                              {'created_at': 1}, sort=[('created_at', ASCENDING)])
+            stats['oldest_pending_seconds'] = (
+                round((datetime.now() - oldest['created_at']).total_seconds(), 1) if oldest else 0
+            )
+            return stats
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching lead queue stats: {str(e)}")
+            return {}
+    
+    # Shared geolocation cache methods
+    def get_cached_country(self, ip_address):
+        """Get a cached (country_code, country_name, expires_at) for an IP address"""
+        try:
+            # The TTL monitor only runs once a minute, so filter expired entries here too
+            entry = self.geo_cache.find_one({'_id': ip_address, 'expires_at': {'$gt': utc_now()}})
+            if entry:
+                return entry['country_code'], entry['country_name'], from_utc(entry['expires_at'])
+            return None
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error reading geo cache: {str(e)}")
+            return None
+    
+    def cache_country(self, ip_address, country_code, country_name, ttl_seconds):
+        """Store a geolocation result for all workers"""
+        try:
+            self.geo_cache.update_one(
+                {'_id': ip_address},
+                {'$set': {
+                    'country_code': country_code,
+                    'country_name': country_name,
+                    'expires_at': utc_now() + timedelta(seconds=ttl_seconds)
+                }},
+                upsert=True
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error writing geo cache: {str(e)}")
+            return False
+    
     def save_session(self, token, username, expires_at, role='manager'):
         """Save user session"""
         try:
@@ -119,26 +798,44 @@ class Database:
                 'token': token,
                 'username': username,
                 'role': role,
-                'created_at': datetime.now(),
-                'expires_at': expires_at
+                'expires_at': to_utc(expires_at)
             })
             return True
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error saving session: {str(e)}")
             return False
     
     def get_session(self, token):
-        """Get session by token"""
+        """Get session by token (None if there is no such session; raises if MongoDB can't be read)"""
         try:
-            session = self.sessions.find_one({'token': token})
-            if session and session['expires_at'] > datetime.now():
-                return session
-            return None
+            # The TTL monitor only runs once a minute, so filter expired sessions here too
+            session = self.sessions.find_one(
+                {'token': token, 'expires_at': {'$gt': utc_now()}},
+                {'_id': 0, 'username': 1, 'role': 1, 'expires_at': 1}
+            )
+            if session:
+                session['expires_at'] = from_utc(session['expires_at'])
+            return session
             
         except Exception as e:
             logger.error(f"Error fetching session: {str(e)}")
-            return None
+            raise
+    
+    def extend_sessions(self, expiries):
+        """Set new expiry times for several sessions at once ({token: expires_at})"""
+        try:
+            self.sessions.bulk_write([
+                UpdateOne({'token': token}, {'$set': {'expires_at': to_utc(expires_at)}})
+                for token, expires_at in expiries.items()
+            ], ordered=False)
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error extending sessions: {str(e)}")
+            return False
     
     def delete_session(self, token):
         """Delete session"""
@@ -147,45 +844,89 @@ class Database:
             return result.deleted_count > 0
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error deleting session: {str(e)}")
             return False
     
-    def cleanup_expired_sessions(self):
-        """Remove expired sessions"""
+    def revoke_token(self, jti, expires_at):
+        """Add a signed token id to the revocation list"""
+        try:
+            self.revoked_tokens.update_one(
+                {'_id': jti},
+                {'$set': {'expires_at': to_utc(expires_at), 'revoked_at': datetime.now()}},
+                upsert=True
+            )
+            return True
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error revoking token: {str(e)}")
+            return False
+    
+    def get_revoked_tokens(self):
+        """Get {jti: expires_at} for revoked tokens that have not expired yet"""
         try:
-            self.sessions.delete_many({'expires_at': {'$lt': datetime.now()}})
+            return {
+                entry['_id']: from_utc(entry['expires_at'])
+                for entry in self.revoked_tokens.find({'expires_at': {'$gt': utc_now()}}, {'expires_at': 1})
+            }
             
         except Exception as e:
-            logger.error(f"Error cleaning up sessions: {str(e)}")
+            self._record_error(e)
+            logger.error(f"Error fetching revoked tokens: {str(e)}")
+            return None
     
     def get_website_config(self):
-        """Get website configuration"""
+        """Get website configuration (including its version number)"""
         try:
-            config = self.config.find_one({'type': 'website'})
+            config = self.config.find_one({'type': 'website'}, {'_id': 0, 'type': 0})
             if config:
-                config.pop('_id', None)
+                config.setdefault('version', 0)
                 return config
-            return {}
+            return {'version': 0}
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error fetching config: {str(e)}")
-            return {}
+            return None
+    
+    def get_website_config_version(self):
+        """Get just the version number of the website configuration (0 if there is none yet)"""
+        try:
+            config = self.config.find_one({'type': 'website'}, {'_id': 0, 'version': 1})
+            return (config or {}).get('version', 0)
+            
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching config version: {str(e)}")
+            return None
     
-    def save_website_config(self, config_data):
-        """Save website configuration"""
+    def save_website_config(self, config_data, expected_version):
+        """
+        Replace the website configuration if it is still at expected_version.
+        Returns the new version, or None if another writer got there first.
+        """
         try:
-            config_data['updated_at'] = datetime.now()
+            version = expected_version + 1
+            document = {**config_data, 'type': 'website', 'version': version, 'updated_at': datetime.now()}
+            document.pop('_id', None)
             
-            self.config.update_one(
-                {'type': 'website'},
-                {'$set': config_data},
+            # Documents written before versioning have no version field, which matches None
+            current = [None, 0] if expected_version == 0 else [expected_version]
+            self.config.replace_one(
+                {'type': 'website', 'version': {'$in': current}},
+                document,
                 upsert=True
             )
-            return True
+            return version
             
+        except DuplicateKeyError:
+            # The upsert lost the race against a concurrent save
+            return None
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error saving config: {str(e)}")
-            return False
+            return None
     
     # Manager user management methods
     def create_manager(self, username, password_hash, email=''):
@@ -205,6 +946,7 @@ class Database:
             return True
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error creating manager: {str(e)}")
             return False
     
@@ -217,6 +959,7 @@ class Database:
             return manager
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error fetching manager: {str(e)}")
             return None
     
@@ -229,6 +972,7 @@ class Database:
             return managers
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error fetching managers: {str(e)}")
             return []
     
@@ -244,6 +988,7 @@ class Database:
             return result.modified_count > 0
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error updating manager: {str(e)}")
             return False
     
@@ -254,50 +999,140 @@ class Database:
             return result.deleted_count > 0
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error deleting manager: {str(e)}")
             return False
     
     def assign_lead_to_manager(self, lead_id, manager_username):
         """Assign a lead to a specific manager"""
         try:
-            # Check if lead exists first
-            lead = self.leads.find_one({'_id': ObjectId(lead_id)})
-            if not lead:
-                logger.error(f"Lead not found with ID: {lead_id}")
-                return False
-            
-            result = self.leads.update_one(
+            self._hold_for_rollup_rebuild()
+            before = self.leads.find_one_and_update(
                 {'_id': ObjectId(lead_id)},
                 {'$set': {
                     'assigned_to': manager_username,
                     'assigned_at': datetime.now()
-                }}
+                }},
+                projection=ROLLUP_PROJECTION
             )
-            # Return True if matched (even if not modified, means already assigned)
-            success = result.matched_count > 0
-            if success:
-                logger.info(f"Lead {lead_id} assigned to {manager_username}")
-            return success
+            if before is None:
+                logger.error(f"Lead not found with ID: {lead_id}")
+                return False
+            
+            # Succeeds even if the lead was already assigned to this manager
+            self._update_rollups(added=[{**before, 'assigned_to': manager_username}], removed=[before])
+            logger.info(f"Lead {lead_id} assigned to {manager_username}")
+            return True
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error assigning lead {lead_id}: {str(e)}")
             return False
     
     def get_manager_leads(self, manager_username):
         """Get all leads assigned to a specific manager"""
         try:
-            leads = list(self.leads.find({'assigned_to': manager_username}).sort('created_at', DESCENDING))
-            
-            for lead in leads:
-                lead['_id'] = str(lead['_id'])
-                if 'created_at' in lead:
-                    lead['timestamp'] = lead['created_at'].isoformat()
-            
-            return leads
+            return list(self.leads.aggregate([
+                {'$match': {'assigned_to': manager_username}},
+                {'$sort': {'created_at': DESCENDING, '_id': DESCENDING}},
+                {'$addFields': LEAD_JSON_FIELDS}
+            ]))
             
         except Exception as e:
+            self._record_error(e)
             logger.error(f"Error fetching manager leads: {str(e)}")
             return []
 
-# Global database instance
-db = Database()
+class _SwallowedError(Exception):
+    # Carries the failure value of a call whose error the backend logged instead of raising
+    def __init__(self, error, result):
+        super().__init__(str(error))
+        self.result = result
+
+class LazyDatabase:
+    """
+    The process's storage backend (see storage.open_database), connected on first
+    use instead of at import. A forked worker (gunicorn preload_app) opens its own
+    MongoClient or SQLite connections rather than sharing the parent's, which are
+    not fork-safe. After a failed connect, further attempts wait retry_interval
+    seconds so requests fail fast while the database is down.
+
+    Storage methods called through it go through breaker (circuit_breaker.py):
+    once the database keeps failing or answering slowly they are refused straight
+    away until a probe call succeeds again (a method marked bulk_operation never
+    counts as slow). A refused method marked returns_on_error returns its failure
+    value, as it would for a database error; the others raise CircuitOpenError
+    (a RuntimeError). An error such a method logs and swallows still counts as a
+    failed call.
+    """
+    def __init__(self, factory=open_database, retry_interval=5.0, breaker=None):
+        self._factory = factory
+        self.retry_interval = retry_interval
+        self.breaker = breaker
+        self._instance = None
+        self._failed_at = None
+        self._error = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def connected(self):
+        return self._instance is not None
+
+    def get(self):
+        """The connected backend, connecting if needed (raises RuntimeError if it is unavailable)"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if self._instance is None:
+                if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+                    raise RuntimeError(self._error)
+                try:
+                    self._instance = self._factory()
+                    self._failed_at = None
+                except Exception as e:
+                    self._failed_at = time.monotonic()
+                    self._error = str(e)
+                    raise
+            return self._instance
+
+    def __getattr__(self, name):
+        method = getattr(Storage, name, None)
+        if self.breaker is not None and callable(method):
+            return functools.partial(self._guarded, name, method)
+        return getattr(self.get(), name)
+
+    def _guarded(self, name, method, *args, **kwargs):
+        # Bulk methods are slow by design: only their errors count against the breaker
+        slow_call_seconds = None if getattr(method, 'bulk', False) else self.breaker.slow_call_seconds
+        try:
+            return self.breaker.call_within(slow_call_seconds, self._call, name, *args, **kwargs)
+        except CircuitOpenError:
+            if not hasattr(method, 'on_error'):
+                raise
+            return copy.copy(method.on_error)
+        except _SwallowedError as e:
+            return e.result
+
+    def _call(self, name, *args, **kwargs):
+        take_swallowed_error()
+        result = getattr(self.get(), name)(*args, **kwargs)
+        error = take_swallowed_error()
+        if error is not None and not isinstance(error, self.breaker.ignore):
+            # Logged and answered with the failure value: still a failure for the breaker
+            raise _SwallowedError(error, result)
+        return result
+
+    def _after_fork(self):
+        # The parent's client (and a lock another thread may have held) can't be used in the child
+        self._instance = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+# Global database instance (connects on first use in each process)
+# ValueError is a malformed pagination cursor and InvalidId a malformed id from the caller, not database failures
+db = LazyDatabase(breaker=get_breaker('database', slow_call_seconds=DATABASE_SLOW_CALL_SECONDS,
+                                      ignore=(ValueError, InvalidId)))
@@ -0,0 +1,288 @@
+"""
+Offline IP-to-Country lookup for Dubai Smart Investment
+Country ranges are compiled from a CSV dump into a compact binary table that is
+memory-mapped (so all gunicorn workers share the same pages) and searched with
+a binary search for both IPv4 and IPv6 addresses.
+
+Build the table:
+    python geoip.py build ip-country.csv geoip.bin
+
+Supported CSV rows (a header row is skipped automatically):
+    1.0.0.0/24,AU,Australia                    (CIDR network)
+    1.0.0.0,1.0.0.255,AU,Australia             (first and last address)
+    "16777216","16777471","AU","Australia"     (IP2Location LITE style integers)
+
+Integer rows are IPv6 when either end is above 0xFFFFFFFF, when the header has an
+address family column (family, ip_version: 4/6 or ipv4/ipv6) saying so, or when
+the dump is built with --family 6 (IP2Location's IPV6 files). IPv4-mapped ranges
+(::ffff:0:0/96) are stored as IPv4, the way lookups search them.
+
+Where ranges overlap, the most specific one wins: an enclosing range is split
+around the ranges nested in it.
+"""
+import os
+import sys
+import csv
+import heapq
+import mmap
+import json
+import struct
+import argparse
+import ipaddress
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DSIGEO1\0'
+# magic, IPv4 range count, IPv6 range count, size of the country JSON blob
+HEADER = struct.Struct('<8sIII')
+# Header names of an address family column and the values it may hold
+FAMILY_COLUMNS = ('family', 'address_family', 'ip_version', 'ip_family')
+FAMILIES = {'4': 4, 'ipv4': 4, '6': 6, 'ipv6': 6}
+
+class GeoIPTable:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.v4_count, self.v6_count, countries_size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a geoip table")
+
+        # Section offsets (see build_table for the layout)
+        self._v4_starts = HEADER.size
+        self._v4_ends = self._v4_starts + 4 * self.v4_count
+        self._v4_countries = self._v4_ends + 4 * self.v4_count
+        self._v6_starts = self._v4_countries + 2 * self.v4_count
+        self._v6_ends = self._v6_starts + 16 * self.v6_count
+        self._v6_countries = self._v6_ends + 16 * self.v6_count
+        countries_offset = self._v6_countries + 2 * self.v6_count
+
+        self.countries = [tuple(c) for c in json.loads(self._mm[countries_offset:countries_offset + countries_size])]
+
+    def lookup(self, ip_address):
+        """Return (country_code, country_name) for an address, or None if it is not in the table"""
+        try:
+            ip = ipaddress.ip_address(ip_address.strip())
+        except ValueError:
+            return None
+
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+
+        if ip.version == 4:
+            index = self._search(int(ip), self.v4_count, self._v4_starts, self._v4_ends, self._read_v4, 4)
+            country_offset = self._v4_countries
+        else:
+            index = self._search(ip.packed, self.v6_count, self._v6_starts, self._v6_ends, self._read_v6, 16)
+            country_offset = self._v6_countries
+
+        if index is None:
+            return None
+        country_index, = struct.unpack_from('<H', self._mm, country_offset + 2 * index)
+        return self.countries[country_index]
+
+    def _read_v4(self, offset):
+        return struct.unpack_from('<I', self._mm, offset)[0]
+
+    def _read_v6(self, offset):
+        # IPv6 addresses are stored big-endian so byte comparison matches numeric order
+        return self._mm[offset:offset + 16]
+
+    def _search(self, key, count, starts, ends, read, width):
+        # Find the last range whose start is <= key, then check the key is within its end
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            if read(starts + mid * width) <= key:
+                low = mid + 1
+            else:
+                high = mid
+
+        index = low - 1
+        if index >= 0 and key <= read(ends + index * width):
+            return index
+        return None
+
+    def close(self):
+        self._mm.close()
+
+def load_table(path):
+    """Open a geoip table, returning None if it is missing or unreadable"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        table = GeoIPTable(path)
+        logger.info(f"GeoIP table loaded: {table.v4_count} IPv4 and {table.v6_count} IPv6 ranges")
+        return table
+    except Exception as e:
+        logger.error(f"Failed to load GeoIP table {path}: {str(e)}")
+        return None
+
+def _parse_address(value, family=None):
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        if family == 6 or number > 0xFFFFFFFF:
+            return ipaddress.IPv6Address(number)
+        return ipaddress.IPv4Address(number)
+    return ipaddress.ip_address(value)
+
+def parse_row(row, family=None, family_column=None):
+    """Turn one CSV row into (first_ip, last_ip, country_code, country_name), or None to skip it
+
+    family (4 or 6) says how integer addresses are read; family_column is the index
+    of a column giving it per row, which is not part of the range or country.
+    """
+    fields = [field.strip() for field in row]
+    if family_column is not None and family_column < len(fields):
+        row_family = FAMILIES.get(fields.pop(family_column).lower())
+        if row_family is None:
+            return None
+        family = row_family
+    if not fields or not fields[0] or fields[0].startswith('#'):
+        return None
+
+    try:
+        if '/' in fields[0]:
+            network = ipaddress.ip_network(fields[0], strict=False)
+            first, last = network.network_address, network.broadcast_address
+            rest = fields[1:]
+        else:
+            # A range can't span families, so one end above 0xFFFFFFFF makes both IPv6
+            if family is None and fields[0].isdigit() and fields[1].isdigit() and int(fields[1]) > 0xFFFFFFFF:
+                family = 6
+            first, last = _parse_address(fields[0], family), _parse_address(fields[1], family)
+            rest = fields[2:]
+    except (ValueError, IndexError):
+        return None
+
+    if first.version == 6 and first.ipv4_mapped and last.ipv4_mapped:
+        first, last = first.ipv4_mapped, last.ipv4_mapped
+
+    if not rest or first.version != last.version or first > last:
+        return None
+
+    code = rest[0].upper()
+    if not code or code == '-':
+        return None
+    name = rest[1] if len(rest) > 1 and rest[1] else code
+    return first, last, code, name
+
+def _family_column(row):
+    """Index of the address family column if row is a header naming one, else None"""
+    names = [field.strip().lower() for field in row]
+    for name in FAMILY_COLUMNS:
+        if name in names:
+            return names.index(name)
+    return None
+
+def most_specific_ranges(items):
+    """Flatten (start, end, value) ranges into sorted non-overlapping ones
+
+    Each address takes the value of the smallest range containing it (the first
+    listed on a tie), so an enclosing range is split around the ranges nested in
+    it. Adjacent pieces with the same value are merged.
+    """
+    ordered = sorted((start, end, order, value) for order, (start, end, value) in enumerate(items))
+    points = sorted({start for start, _, _, _ in ordered} | {end + 1 for _, end, _, _ in ordered})
+
+    result = []
+    active = []
+    next_range = 0
+    for point, next_point in zip(points, points[1:]):
+        while next_range < len(ordered) and ordered[next_range][0] == point:
+            start, end, order, value = ordered[next_range]
+            heapq.heappush(active, (end - start, order, end, value))
+            next_range += 1
+        while active and active[0][2] < point:
+            heapq.heappop(active)
+        if not active:
+            continue
+
+        value = active[0][3]
+        if result and result[-1][1] == point - 1 and result[-1][2] == value:
+            result[-1] = (result[-1][0], next_point - 1, value)
+        else:
+            result.append((point, next_point - 1, value))
+    return result
+
+def build_table(csv_path, output_path, family=None):
+    """Compile a CSV range dump into the binary table format
+
+    family (4 or 6) says how integer rows are read when the dump has no family column.
+    """
+    ranges = {4: [], 6: []}
+    skipped = 0
+    family_column = None
+
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for line_number, row in enumerate(csv.reader(f)):
+            if line_number == 0:
+                family_column = _family_column(row)
+            parsed = parse_row(row, family, family_column)
+            if parsed is None:
+                skipped += 1
+                continue
+            first, last, code, name = parsed
+            ranges[first.version].append((int(first), int(last), (code, name)))
+
+    countries = []
+    country_index = {}
+
+    def sorted_ranges(items):
+        # Overlapping ranges are flattened so the binary search stays exact
+        result = []
+        for start, end, (code, name) in most_specific_ranges(items):
+            if code not in country_index:
+                country_index[code] = len(countries)
+                countries.append((code, name))
+            result.append((start, end, country_index[code]))
+        return result
+    v4 = sorted_ranges(ranges[4])
+    v6 = sorted_ranges(ranges[6])
+    countries_blob = json.dumps(countries, ensure_ascii=False).encode('utf-8')
+
+    # Layout: header | v4 starts | v4 ends | v4 country ids | v6 starts | v6 ends | v6 country ids | countries
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, len(v4), len(v6), len(countries_blob)))
+        out.write(b''.join(struct.pack('<I', start) for start, _, _ in v4))
+        out.write(b''.join(struct.pack('<I', end) for _, end, _ in v4))
+        out.write(b''.join(struct.pack('<H', country) for _, _, country in v4))
+        out.write(b''.join(start.to_bytes(16, 'big') for start, _, _ in v6))
+        out.write(b''.join(end.to_bytes(16, 'big') for _, end, _ in v6))
+        out.write(b''.join(struct.pack('<H', country) for _, _, country in v6))
+        out.write(countries_blob)
+    os.replace(tmp_path, output_path)
+
+    return len(v4), len(v6), len(countries), skipped
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the offline GeoIP table')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Compile a CSV dump into a binary table')
+    build.add_argument('csv_path')
+    build.add_argument('output_path', nargs='?', default='geoip.bin')
+    build.add_argument('--family', type=int, choices=(4, 6),
+                       help='Address family of integer rows (e.g. 6 for IP2Location IPV6 dumps)')
+
+    lookup = commands.add_parser('lookup', help='Look up addresses in a table')
+    lookup.add_argument('table_path')
+    lookup.add_argument('addresses', nargs='+')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        v4, v6, countries, skipped = build_table(args.csv_path, args.output_path, args.family)
+        print(f"✅ Wrote {args.output_path}: {v4:,} IPv4 ranges, {v6:,} IPv6 ranges, "
+              f"{countries} countries ({skipped:,} rows skipped)")
+    else:
+        table = GeoIPTable(args.table_path)
+        for address in args.addresses:
+            print(f"{address}: {table.lookup(address) or 'not found'}")
+
+if __name__ == '__main__':
+    sys.exit(main())
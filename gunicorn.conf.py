@@ -0,0 +1,41 @@
+"""
+Gunicorn Configuration for Dubai Smart Investment
+Read automatically by `gunicorn app:app` from the project directory.
+
+Requests spend most of their time waiting on MongoDB, SMTP and ipapi.co, so each
+worker process runs several threads. The app is loaded once in the master and
+forked; MongoDB connections and background threads are opened in each worker
+after the fork. Benchmark: README-BACKEND.md, "Using Gunicorn".
+"""
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Threaded workers: an I/O-bound request only holds the GIL while it is running Python
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2)
+threads = int(os.environ.get('GUNICORN_THREADS') or 8)
+
+# Import the app (pages, GeoIP table, asset manifest) once and share it copy-on-write
+preload_app = True
+
+# Recycle workers now and then, staggered so they don't all restart together
+max_requests = 10000
+max_requests_jitter = 1000
+
+# Keep connections from the load balancer open between requests
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+
+# Worker heartbeats in memory rather than on a possibly slow disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+
+def post_fork(server, worker):
+    # Start the session, email and lead queue threads now rather than on the first request
+    from app import start_background_workers
+    start_background_workers()
@@ -0,0 +1,70 @@
+"""
+Lead Export for Dubai Smart Investment
+One row layout shared by the CSV and Excel downloads. Rows are built from a
+MongoDB cursor one at a time and streamed to the client.
+"""
+import io
+import csv
+from datetime import date, time
+
+from xlsx_writer import stream_xlsx
+
+# (header, value type, function that reads the value from a lead document)
+EXPORT_COLUMNS = [
+    ('Date', 'date', lambda lead: lead['created_at'].date() if lead.get('created_at') else None),
+    ('Time', 'time', lambda lead: lead['created_at'].time().replace(microsecond=0) if lead.get('created_at') else None),
+    ('First Name', 'text', lambda lead: lead.get('firstName', '')),
+    ('Last Name', 'text', lambda lead: lead.get('lastName', '')),
+    ('Email', 'text', lambda lead: lead.get('email', '')),
+    ('WhatsApp', 'text', lambda lead: lead.get('whatsapp', lead.get('phone', ''))),
+    ('Country', 'text', lambda lead: lead.get('country', 'Unknown')),
+    ('Contact Method', 'text', lambda lead: lead.get('contactMethod', '')),
+    ('Buying Timeframe', 'text', lambda lead: lead.get('timeframe', '')),
+    ('Property Type', 'text', lambda lead: lead.get('propertyType', lead.get('interest', ''))),
+    ('IP Address', 'text', lambda lead: lead.get('ip_address', '')),
+    ('User Agent', 'text', lambda lead: lead.get('user_agent', ''))
+]
+
+# Only these fields are read from MongoDB for exports
+EXPORT_FIELDS = [
+    'created_at', 'firstName', 'lastName', 'email', 'whatsapp', 'phone', 'country',
+    'contactMethod', 'timeframe', 'propertyType', 'interest', 'ip_address', 'user_agent'
+]
+
+def export_rows(leads):
+    """Yield typed export rows for each lead, closing the cursor when done"""
+    try:
+        for lead in leads:
+            yield [read(lead) for _, _, read in EXPORT_COLUMNS]
+    finally:
+        if hasattr(leads, 'close'):
+            leads.close()
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, time):
+        return value.strftime('%H:%M:%S')
+    return value
+
+def stream_csv(leads, chunk_size=64 * 1024):
+    """Yield the export as CSV text in ~64 KB chunks"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([title for title, _, _ in EXPORT_COLUMNS])
+
+    for row in export_rows(leads):
+        writer.writerow([_csv_value(value) for value in row])
+        if output.tell() >= chunk_size:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    yield output.getvalue()
+
+def stream_excel(leads, chunk_size=64 * 1024):
+    """Yield the export as an .xlsx workbook in byte chunks"""
+    columns = [(title, kind) for title, kind, _ in EXPORT_COLUMNS]
+    return stream_xlsx(columns, export_rows(leads), sheet_name='Leads', chunk_size=chunk_size)
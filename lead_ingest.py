@@ -0,0 +1,217 @@
+"""
+Bulk Lead Import for Dubai Smart Investment
+Reads leads from NDJSON, CSV (including this app's own CSV export) or a JSON
+array such as the legacy leads.json, validates each row with the same rules as
+the contact form and writes them with unordered insert_many batches.
+
+Usage:
+    python lead_ingest.py leads.ndjson
+    python lead_ingest.py export.csv --source "Campaign backfill"
+    python lead_ingest.py leads.json --batch-size 2000
+"""
+import io
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+import logging
+
+from validators import validate_email, validate_phone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE = 'Bulk Import'
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+DUPLICATE_KEY = 11000
+
+# Lead fields an import may set; anything else in a row is ignored
+LEAD_FIELDS = [
+    'firstName', 'lastName', 'email', 'whatsapp', 'phone', 'country', 'contactMethod', 'timeframe',
+    'propertyType', 'interest', 'message', 'source', 'campaign_id', 'lead_id', 'status', 'assigned_to',
+    'ip_address', 'user_agent', 'detected_country', 'detected_country_code', 'country_code'
+]
+
+# Column titles used by the CSV/Excel export (lead_export.py)
+HEADER_ALIASES = {
+    'First Name': 'firstName', 'Last Name': 'lastName', 'Email': 'email', 'WhatsApp': 'whatsapp',
+    'Country': 'country', 'Contact Method': 'contactMethod', 'Buying Timeframe': 'timeframe',
+    'Property Type': 'propertyType', 'IP Address': 'ip_address', 'User Agent': 'user_agent'
+}
+
+FORMATS = {
+    'ndjson': 'ndjson', 'jsonl': 'ndjson', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson',
+    'csv': 'csv', 'text/csv': 'csv',
+    'json': 'json', 'application/json': 'json'
+}
+
+def detect_format(name):
+    """Import format for a file extension, format name or MIME type, or None"""
+    if not name:
+        return None
+    name = name.lower()
+    return FORMATS.get(name) or FORMATS.get(name.rsplit('.', 1)[-1])
+
+def read_rows(stream, fmt):
+    """Yield (row_number, row) from a text stream; row is a dict, or an error message if it can't be parsed"""
+    if fmt == 'ndjson':
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, f"Invalid JSON: {str(e)}"
+                continue
+            yield number, row if isinstance(row, dict) else 'Row is not a JSON object'
+
+    elif fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {HEADER_ALIASES.get(key, key): value for key, value in row.items() if key}
+
+    elif fmt == 'json':
+        try:
+            rows = json.load(stream)
+        except ValueError as e:
+            yield 1, f"Invalid JSON: {str(e)}"
+            return
+        if isinstance(rows, dict):
+            rows = rows.get('leads', [])
+        for number, row in enumerate(rows, start=1):
+            yield number, row if isinstance(row, dict) else 'Row is not a JSON object'
+
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+def _parse_created_at(row):
+    value = row.get('created_at') or row.get('timestamp')
+    if not value and row.get('Date'):
+        value = f"{row['Date']}T{row.get('Time') or '00:00:00'}"
+    if not value:
+        return None
+    if isinstance(value, dict) and '$date' in value:
+        value = value['$date']
+    created_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    # Stored created_at values are naive local time; convert an offset before dropping it
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone().replace(tzinfo=None)
+    return created_at
+
+def build_lead(row, source=DEFAULT_SOURCE, now=None):
+    """Turn an import row into a lead document. Returns (lead, None) or (None, error message)."""
+    lead = {}
+    for field in LEAD_FIELDS:
+        value = row.get(field)
+        if value is None or value == '':
+            continue
+        lead[field] = value.strip() if isinstance(value, str) else str(value)
+
+    if not validate_email(lead.get('email')):
+        return None, 'Invalid email format' if lead.get('email') else 'Missing email'
+    for field in ('whatsapp', 'phone'):
+        if field in lead and not validate_phone(lead[field]):
+            return None, f"Invalid {field} number format"
+
+    try:
+        created_at = _parse_created_at(row)
+    except (ValueError, TypeError):
+        return None, 'Invalid timestamp'
+
+    now = now or datetime.now()
+    lead['created_at'] = created_at or now
+    lead['updated_at'] = now
+    lead.setdefault('status', 'new')
+    lead.setdefault('source', source)
+    return lead, None
+
+class ImportResult:
+    def __init__(self, max_errors=MAX_REPORTED_ERRORS):
+        self.max_errors = max_errors
+        self.counts = {'received': 0, 'inserted': 0, 'invalid': 0, 'duplicates': 0, 'failed': 0}
+        self.errors = []
+
+    def reject(self, row_number, status, message):
+        self.counts[status] += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_number, 'status': status, 'error': message})
+
+    def to_dict(self):
+        return {
+            **self.counts,
+            'errors': self.errors,
+            'errors_truncated': len(self.errors) < self.counts['invalid'] + self.counts['duplicates'] + self.counts['failed']
+        }
+
+def ingest_rows(database, rows, source=DEFAULT_SOURCE, batch_size=DEFAULT_BATCH_SIZE, max_errors=MAX_REPORTED_ERRORS):
+    """
+    Validate and insert (row_number, row) pairs in batches of batch_size.
+    Rows that are not reported in the result's errors were inserted.
+    """
+    result = ImportResult(max_errors)
+    batch, numbers = [], []
+
+    def flush():
+        failures = database.insert_leads(batch)
+        for index, (code, message) in failures.items():
+            if code == DUPLICATE_KEY:
+                result.reject(numbers[index], 'duplicates', 'Duplicate lead')
+            else:
+                result.reject(numbers[index], 'failed', message)
+        result.counts['inserted'] += len(batch) - len(failures)
+        batch.clear()
+        numbers.clear()
+
+    now = datetime.now()
+    for row_number, row in rows:
+        result.counts['received'] += 1
+        if isinstance(row, str):
+            result.reject(row_number, 'invalid', row)
+            continue
+
+        lead, error = build_lead(row, source, now)
+        if error:
+            result.reject(row_number, 'invalid', error)
+            continue
+
+        batch.append(lead)
+        numbers.append(row_number)
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Import leads from NDJSON, CSV or a JSON array')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['ndjson', 'csv', 'json'], help='Default: from the file extension')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='Source for rows that have none')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    if not fmt:
+        parser.error('Cannot tell the format from the file name, use --format')
+
+    from database import db
+
+    started = time.monotonic()
+    with io.open(args.path, encoding='utf-8-sig', newline='') as f:
+        result = ingest_rows(db, read_rows(f, fmt), source=args.source, batch_size=args.batch_size)
+    elapsed = time.monotonic() - started
+
+    counts = result.counts
+    rate = counts['inserted'] / elapsed if elapsed else 0
+    print(f"✅ {counts['inserted']:,} of {counts['received']:,} leads imported in {elapsed:.1f}s ({rate:,.0f}/s)")
+    print(f"   {counts['invalid']:,} invalid, {counts['duplicates']:,} duplicates, {counts['failed']:,} failed")
+    for error in result.errors[:20]:
+        print(f"   row {error['row']}: {error['status']} - {error['error']}")
+    if len(result.errors) > 20:
+        print(f"   ... {len(result.errors) - 20} more")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Concurrent Lead Pipeline for Dubai Smart Investment
+Runs the independent stages of a lead submission (geolocation, queueing the
+emails, saving the lead) on a shared, bounded thread pool so a submission takes
+about as long as its slowest stage. Each stage has a deadline; a stage that
+misses it is reported as degraded and the request carries on without its
+result while the stage finishes in the background.
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    def __init__(self, name, future, timeout):
+        self.name = name
+        self.future = future
+        self.timeout = timeout
+        self.started = time.monotonic()
+
+class PipelineRun:
+    """The stages of one submission, with their timings in milliseconds"""
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.started = time.monotonic()
+        self.timings = {}
+        self.degraded = []
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Start a stage on the pool"""
+        future = self.pipeline.executor.submit(fn, *args, **kwargs)
+        return Stage(name, future, self.pipeline.timeouts.get(name, self.pipeline.default_timeout))
+
+    def result(self, stage, default=None):
+        """
+        Wait for a stage until its deadline (counted from when it was submitted).
+        Returns default, and marks the stage degraded, if it misses the deadline or fails.
+        """
+        remaining = max(stage.timeout - (time.monotonic() - stage.started), 0)
+        try:
+            value = stage.future.result(timeout=remaining)
+        except FutureTimeoutError:
+            logger.warning(f"Lead pipeline stage '{stage.name}' missed its {stage.timeout}s deadline")
+            self._degrade(stage, 'timeouts')
+            return default
+        except Exception as e:
+            logger.error(f"Lead pipeline stage '{stage.name}' failed: {str(e)}")
+            self._degrade(stage, 'errors')
+            return default
+
+        self.timings[stage.name] = round((time.monotonic() - stage.started) * 1000, 1)
+        return value
+
+    def finish(self):
+        """Record the run; returns {'total_ms', 'stages', 'degraded'} for the response"""
+        total = round((time.monotonic() - self.started) * 1000, 1)
+        self.pipeline._record(self)
+        return {'total_ms': total, 'stages': self.timings, 'degraded': self.degraded}
+
+    def _degrade(self, stage, counter):
+        self.timings[stage.name] = None
+        self.degraded.append(stage.name)
+        with self.pipeline._lock:
+            self.pipeline.stats[counter][stage.name] = self.pipeline.stats[counter].get(stage.name, 0) + 1
+
+class LeadPipeline:
+    def __init__(self, workers=8, timeouts=None, default_timeout=5.0):
+        # timeouts maps a stage name to its deadline in seconds
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        # Threads are only created when the first stage is submitted, so this is safe before a fork
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lead-pipeline')
+        self._lock = threading.Lock()
+        self.stats = {'runs': 0, 'degraded_runs': 0, 'timeouts': {}, 'errors': {}}
+
+    def start(self):
+        """Begin a submission"""
+        return PipelineRun(self)
+
+    def _record(self, run):
+        with self._lock:
+            self.stats['runs'] += 1
+            if run.degraded:
+                self.stats['degraded_runs'] += 1
@@ -0,0 +1,127 @@
+"""
+Lead Processing Queue for Dubai Smart Investment
+In queue mode the contact form and Google Ads webhook only validate the request
+and store its payload in MongoDB, then answer straight away. Background worker
+threads claim the queued payloads and do the slow part (geolocation, saving the
+lead, queueing emails), retrying with backoff when that fails.
+"""
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LeadQueue:
+    def __init__(self, database, handlers, workers=2, poll_interval=2.0, max_attempts=8,
+                 base_delay=10, max_delay=1800, lease_seconds=120):
+        # handlers maps a job kind to a function(payload) that processes it and raises on failure
+        self.database = database
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {'processed': 0, 'retried': 0, 'failed': 0, 'last_lag_seconds': None}
+
+    def enqueue(self, kind, payload, key=None):
+        """
+        Store a job and wake up a worker. Jobs with a key are only queued once;
+        returns False when a job with that key was already queued.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown lead job kind: {kind}")
+
+        queued = self.database.enqueue_lead_job(kind, payload, key)
+        self._wakeup.set()
+        return queued
+
+    def start(self):
+        """Start the worker threads (once per process)"""
+        with self._lock:
+            if self._pid == os.getpid() or self.workers <= 0:
+                return
+
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = []
+            for i in range(self.workers):
+                worker_id = f"{socket.gethostname()}:{self._pid}:{i}"
+                thread = threading.Thread(target=self._run, args=(worker_id,),
+                                          name=f"lead-queue-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+            logger.info(f"Lead queue started with {self.workers} worker(s)")
+
+    def stop(self, timeout=5):
+        """Stop the worker threads"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def process_next(self, worker_id='inline'):
+        """Claim and process one due job. Returns False when nothing was due."""
+        job = self.database.claim_lead_job(worker_id, self.lease_seconds)
+        if not job:
+            return False
+
+        job_id = str(job['_id'])
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is None:
+                raise ValueError(f"No handler for lead job kind: {job['kind']}")
+            handler(job.get('payload', {}))
+
+        except Exception as e:
+            if job['attempts'] >= self.max_attempts:
+                logger.error(f"Lead job {job_id} ({job['kind']}) failed permanently: {str(e)}")
+                self.database.fail_lead_job(job_id, str(e))
+                self.stats['failed'] += 1
+            else:
+                delay = self.retry_delay(job['attempts'])
+                logger.warning(f"Lead job {job_id} ({job['kind']}) failed, retrying in {delay}s: {str(e)}")
+                self.database.retry_lead_job(job_id, datetime.now() + timedelta(seconds=delay), str(e))
+                self.stats['retried'] += 1
+            return True
+
+        self.database.complete_lead_job(job_id)
+        self.stats['processed'] += 1
+        # Time from the request being accepted to the lead being fully processed
+        self.stats['last_lag_seconds'] = round((datetime.now() - job['created_at']).total_seconds(), 3)
+        return True
+
+    def drain(self):
+        """Process every job that is currently due (useful from scripts)"""
+        processed = 0
+        while self.process_next():
+            processed += 1
+        return processed
+
+    def retry_delay(self, attempts):
+        """Exponential backoff: base_delay, 2x, 4x ... capped at max_delay"""
+        return min(self.base_delay * (2 ** max(attempts - 1, 0)), self.max_delay)
+
+    def _run(self, worker_id):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                if self.process_next(worker_id):
+                    continue
+            except Exception as e:
+                logger.error(f"Lead queue worker {worker_id} error: {str(e)}")
+
+            # Nothing due: sleep until the next poll or until a new job is queued
+            self._wakeup.wait(self.poll_interval)
@@ -0,0 +1,100 @@
+"""
+Lead Rollups for Dubai Smart Investment
+Counts of leads per status, source, country, campaign, assigned manager and
+day, kept in the lead_rollups collection. Database methods that add, change or
+remove leads adjust the counters with $inc, so the dashboard reads a few
+hundred small documents instead of every lead.
+
+Rebuild the counters from the leads collection (e.g. after editing leads by hand):
+    python lead_rollups.py rebuild
+"""
+import sys
+import argparse
+from collections import Counter
+from datetime import datetime
+import logging
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Lead fields with a counter for each value; every lead is also counted in 'total' and 'day'
+ROLLUP_FIELDS = ['status', 'source', 'country', 'campaign_id', 'assigned_to']
+DIMENSIONS = ['total'] + ROLLUP_FIELDS + ['day']
+# Bucket for leads without a value (missing, null or empty)
+MISSING = 'none'
+DAY_FORMAT = '%Y-%m-%d'
+
+def rollup_keys(lead):
+    """(dimension, value) of every bucket a lead is counted in"""
+    keys = [('total', 'all')]
+    for field in ROLLUP_FIELDS:
+        keys.append((field, str(lead.get(field) or MISSING)))
+    created_at = lead.get('created_at')
+    keys.append(('day', created_at.strftime(DAY_FORMAT) if isinstance(created_at, datetime) else MISSING))
+    return keys
+
+def rollup_changes(added=(), removed=()):
+    """{(dimension, value): delta} for the added and removed leads, without zero deltas"""
+    changes = Counter()
+    for lead in added:
+        changes.update(rollup_keys(lead))
+    for lead in removed:
+        changes.subtract(rollup_keys(lead))
+    return {key: delta for key, delta in changes.items() if delta}
+
+def rollup_updates(added=(), removed=()):
+    """$inc upserts that count the added leads and uncount the removed ones"""
+    return [
+        UpdateOne({'_id': f"{dimension}:{value}"},
+                  {'$inc': {'count': delta}, '$setOnInsert': {'dimension': dimension, 'value': value}},
+                  upsert=True)
+        for (dimension, value), delta in rollup_changes(added, removed).items()
+    ]
+
+def _bucket_value(expression):
+    # Same rule as rollup_keys: missing, null and '' all go in the MISSING bucket
+    return {'$cond': [{'$eq': [{'$ifNull': [expression, '']}, '']}, MISSING, {'$toString': expression}]}
+
+def rebuild_pipeline(output_collection):
+    """Aggregation over the leads collection that replaces output_collection with fresh counters"""
+    groups = {field: _bucket_value(f'${field}') for field in ROLLUP_FIELDS}
+    groups['total'] = 'all'
+    groups['day'] = {'$cond': [{'$ifNull': ['$created_at', False]},
+                               {'$dateToString': {'date': '$created_at', 'format': DAY_FORMAT}}, MISSING]}
+
+    facets = {dimension: [{'$group': {'_id': groups[dimension], 'count': {'$sum': 1}}}] for dimension in DIMENSIONS}
+    buckets = [
+        {'$map': {'input': f'${dimension}', 'in': {
+            '_id': {'$concat': [f'{dimension}:', '$$this._id']},
+            'dimension': dimension,
+            'value': '$$this._id',
+            'count': '$$this.count'
+        }}}
+        for dimension in DIMENSIONS
+    ]
+    return [
+        {'$facet': facets},
+        {'$project': {'buckets': {'$concatArrays': buckets}}},
+        {'$unwind': '$buckets'},
+        {'$replaceRoot': {'newRoot': '$buckets'}},
+        # $out swaps the collection in one step, so readers never see partial counts
+        {'$out': output_collection}
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the lead rollup counters')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help='Recount every bucket from the leads collection')
+    parser.parse_args()
+
+    from database import db
+
+    buckets = db.rebuild_lead_rollups()
+    if buckets is None:
+        print("❌ Rebuild failed, see the log")
+        return 1
+    print(f"✅ Lead rollups rebuilt: {buckets} bucket(s)")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,434 @@
+"""
+Lead Spool for Dubai Smart Investment
+A local write-ahead journal for leads the database could not take in time.
+Each lead gets its id before the first write attempt. If the database write
+fails or misses its latency budget, the lead is appended to spool/leads.jsonl
+(one JSON document per line, fsync'd before the visitor is thanked). A
+background replayer moves the journal aside and drains it into the database
+with insert_leads batches once it answers again.
+
+Replaying is idempotent: a lead whose slow write finished after all, or that
+was replayed before a crash, comes back as a duplicate id and is skipped. The
+worker processes on one machine share the spool directory; file locks keep
+appends whole and let one process replay at a time.
+
+A spooled lead's id is returned as a SpooledLeadId: it is not in the database
+yet, so whether it is new is not known. on_saved(lead) is called once it is
+stored as a new lead, by its late write or by the replay. Fields that arrive
+later (the country) are journalled with update() and set after the replay.
+
+A lead the database refuses while it is otherwise answering (a validation
+error, a document too large to store) is moved to spool/leads.rejected.jsonl,
+at once if the database reports an error code for it, otherwise after
+max_attempts replays, so it never holds up the leads behind it.
+
+With directory=None there is no spool (no database is configured): leads are
+written directly and a failed write returns False.
+
+Usage:
+    python lead_spool.py status     # leads waiting in the spool
+    python lead_spool.py replay     # drain the spool now
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (development server): one process, so the thread lock is enough
+    fcntl = None
+
+from lead_ingest import DUPLICATE_KEY
+from storage import new_id, json_default, json_object_hook
+from circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+SPOOL_FILE = 'leads.jsonl'
+REPLAY_FILE = 'leads.replaying.jsonl'
+REJECTED_FILE = 'leads.rejected.jsonl'
+LOCK_FILE = 'replay.lock'
+
+def _lock_exclusive(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+class SpooledLeadId(str):
+    """The id of a lead that is waiting in the spool"""
+
+class LeadSpool:
+    def __init__(self, database, write, directory='spool', budget=1.5, writers=8,
+                 max_bytes=64 * 1024 * 1024, batch_size=500, replay_interval=10.0, on_saved=None,
+                 max_attempts=3):
+        # write(lead) saves a lead and returns its id (None for a duplicate lead_id), raising on failure
+        self.database = database
+        self.write = write
+        self.on_saved = on_saved
+        self.directory = directory
+        self.budget = budget
+        self.writers = writers
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.replay_interval = replay_interval
+        self.max_attempts = max_attempts
+        self.path = os.path.join(directory, SPOOL_FILE) if directory else None
+        self.replay_path = os.path.join(directory, REPLAY_FILE) if directory else None
+        # Failed replays of leads the database refused without an error code, by lead id
+        self._attempts = {}
+
+        # Threads are only created when the first write is submitted, so this is safe before a fork
+        self._executor = ThreadPoolExecutor(max_workers=writers, thread_name_prefix='lead-write')
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.stats = {'spooled': 0, 'slow_writes': 0, 'failed_writes': 0, 'spool_full': 0,
+                      'replayed': 0, 'replay_duplicates': 0, 'rejected': 0}
+
+    def save(self, lead):
+        """
+        Save a lead through write() within the budget, or append it to the spool.
+        Returns the lead id (a SpooledLeadId if it was spooled), None for a duplicate lead_id,
+        or False if it could be neither saved nor spooled.
+        """
+        lead.setdefault('_id', new_id())
+        now = datetime.now()
+        lead.setdefault('created_at', now)
+        lead.setdefault('updated_at', now)
+        lead.setdefault('status', 'new')
+
+        if self.directory is None:
+            try:
+                return self.write(lead)
+            except Exception as e:
+                logger.error(f"Lead write failed for {lead.get('email')} (no spool configured): {str(e)}")
+                self.stats['failed_writes'] += 1
+                return False
+
+        with self._lock:
+            # Every writer is stuck on the database: don't queue behind them
+            saturated = self._in_flight >= self.writers
+            if not saturated:
+                self._in_flight += 1
+        if saturated:
+            self.stats['slow_writes'] += 1
+            return self._spool(lead)
+
+        # The writer gets its own copy: the database driver may add fields while we serialise this one
+        future = self._executor.submit(self.write, dict(lead))
+        future.add_done_callback(self._write_done)
+        try:
+            return future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            logger.warning(f"Lead write missed its {self.budget}s budget, spooling {lead.get('email')}")
+            self.stats['slow_writes'] += 1
+            # The write carries on and may still store the lead before the replay does
+            future.add_done_callback(lambda late: self._late_write_done(late, lead))
+        except Exception as e:
+            logger.error(f"Lead write failed, spooling {lead.get('email')}: {str(e)}")
+            self.stats['failed_writes'] += 1
+        return self._spool(lead)
+
+    def _write_done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _late_write_done(self, future, lead):
+        try:
+            stored = future.result()
+        except Exception:
+            # Left to the replay
+            return
+        if stored:
+            self._saved(lead)
+
+    def _saved(self, lead):
+        if self.on_saved is None:
+            return
+        try:
+            self.on_saved(lead)
+        except Exception as e:
+            logger.error(f"Spooled lead for {lead.get('email')} stored, but on_saved failed: {str(e)}")
+
+    def _spool(self, lead):
+        return SpooledLeadId(lead['_id']) if self.append(lead) else False
+
+    def append(self, lead):
+        """Append a lead to the spool and fsync it. Returns False if the spool is full or can't be written."""
+        if not self._append(lead, f"lead for {lead.get('email')}"):
+            return False
+        self.stats['spooled'] += 1
+        return True
+
+    def update(self, lead_id, fields):
+        """Journal fields to set on a spooled lead once it has been replayed. Returns False if they can't be."""
+        return self._append({'$set': fields, '_id': str(lead_id)}, f"update of lead {lead_id}")
+
+    def _append(self, document, description):
+        if self.directory is None:
+            return False
+        line = (json.dumps(document, default=json_default, separators=(',', ':')) + '\n').encode()
+        try:
+            with self._append_lock:
+                os.makedirs(self.directory, exist_ok=True)
+                while True:
+                    fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                    try:
+                        _lock_exclusive(fd)
+                        # The replayer may have moved the file aside while we waited for the lock
+                        try:
+                            current = os.stat(self.path).st_ino == os.fstat(fd).st_ino
+                        except FileNotFoundError:
+                            current = False
+                        if not current:
+                            continue
+
+                        size = os.fstat(fd).st_size
+                        if size + len(line) > self.max_bytes:
+                            logger.error(f"Lead spool is full ({size} bytes), {description} not saved")
+                            self.stats['spool_full'] += 1
+                            return False
+                        os.write(fd, line)
+                        os.fsync(fd)
+                        if size == 0:
+                            self._fsync_directory()
+                    finally:
+                        # Closing the file releases the lock
+                        os.close(fd)
+                    return True
+
+        except OSError as e:
+            logger.error(f"Could not write lead spool {self.path}: {str(e)}")
+            return False
+
+    def _fsync_directory(self):
+        # A new file's directory entry must be on disk too
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def pending_bytes(self):
+        """Bytes waiting in the spool (including a replay in progress)"""
+        total = 0
+        if self.directory is None:
+            return total
+        for path in (self.path, self.replay_path):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def replay(self):
+        """
+        Drain the spool into the database (one process at a time).
+        Returns the number of leads inserted, or None if another process is replaying.
+        """
+        if self.directory is None:
+            return 0
+        if not os.path.exists(self.path) and not os.path.exists(self.replay_path):
+            return 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        lock_fd = os.open(os.path.join(self.directory, LOCK_FILE), os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+
+            # Finish an earlier replay (interrupted, or stopped by a database error) before starting a new one
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                    return 0
+                os.rename(self.path, self.replay_path)
+                # Wait for appends that opened the file before it was moved
+                fd = os.open(self.replay_path, os.O_RDONLY)
+                _lock_exclusive(fd)
+                os.close(fd)
+
+            return self._replay_file()
+
+        finally:
+            os.close(lock_fd)
+
+    def _replay_file(self):
+        with open(self.replay_path, 'rb') as f:
+            lines = [line for line in f.read().splitlines() if line.strip()]
+
+        inserted = 0
+        # Lines left for the next round, and the ids of leads kept or rejected (their updates go with them)
+        kept, kept_ids, rejected_ids = [], set(), set()
+        for start in range(0, len(lines), self.batch_size):
+            batch, batch_lines, updates = [], [], []
+            for line in lines[start:start + self.batch_size]:
+                try:
+                    document = json.loads(line, object_hook=json_object_hook)
+                except ValueError:
+                    # A line torn by a crash mid-append; that request was never acknowledged
+                    self._reject(line, 'unreadable line')
+                    continue
+                if '$set' in document:
+                    updates.append((document, line))
+                else:
+                    batch.append(document)
+                    batch_lines.append(line)
+
+            failures = self._insert(batch)
+            if failures is None:
+                # The database is down: keep what is left for the next round
+                logger.warning(f"Lead spool replay stopped after {inserted} lead(s)")
+                self._rewrite(kept + batch_lines + [line for _, line in updates] + lines[start + self.batch_size:])
+                return inserted
+
+            for index, lead in enumerate(batch):
+                lead_id = str(lead['_id'])
+                if index not in failures:
+                    inserted += 1
+                    self.stats['replayed'] += 1
+                    self._attempts.pop(lead_id, None)
+                    self._saved(lead)
+                    continue
+                code, message = failures[index]
+                if code == DUPLICATE_KEY:
+                    self.stats['replay_duplicates'] += 1
+                    continue
+                self._attempts[lead_id] = self._attempts.get(lead_id, 0) + 1
+                if code is not None or self._attempts[lead_id] >= self.max_attempts:
+                    # Refused by a database that is answering: don't let it hold up the leads behind it
+                    self._reject(batch_lines[index], f"lead {lead_id} refused: {message}")
+                    self._attempts.pop(lead_id, None)
+                    rejected_ids.add(lead_id)
+                else:
+                    logger.warning(f"Spooled lead {lead_id} not stored, retrying next round: {message}")
+                    kept.append(batch_lines[index])
+                    kept_ids.add(lead_id)
+
+            for update, line in updates:
+                if update['_id'] in kept_ids:
+                    kept.append(line)
+                elif update['_id'] in rejected_ids:
+                    self._reject(line, f"update of refused lead {update['_id']}")
+                elif not self.database.update_lead(update['_id'], update['$set']):
+                    logger.warning(f"Spooled update of lead {update['_id']} could not be applied")
+
+        if kept:
+            self._rewrite(kept)
+        else:
+            os.remove(self.replay_path)
+        if inserted:
+            logger.info(f"Lead spool replayed: {inserted} lead(s) saved")
+        return inserted
+
+    def _insert(self, batch):
+        """insert_leads failures for batch, or None if the database is down"""
+        if not batch:
+            return {}
+        failures = self.database.insert_leads(batch)
+        if len(failures) < len(batch) or any(code is not None for code, _ in failures.values()):
+            return failures
+
+        # Nothing stored and no error code: the database is down, or one lead it can't
+        # encode or store failed the whole batch
+        if self.database.get_schema_version() is None:
+            logger.warning(f"Database unavailable for the lead spool replay: {next(iter(failures.values()))[1]}")
+            return None
+        # The database answers: one lead at a time finds the ones it refuses
+        # (leads the batch stored before it failed come back as duplicates)
+        failures = {}
+        for index, lead in enumerate(batch):
+            failure = self.database.insert_leads([lead]).get(0)
+            if failure is not None:
+                failures[index] = failure
+        return failures
+
+    def _rewrite(self, lines):
+        temporary = self.replay_path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(b''.join(line + b'\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.replay_path)
+
+    def _reject(self, line, reason):
+        logger.error(f"Lead spool line moved to {REJECTED_FILE} ({reason})")
+        self.stats['rejected'] += 1
+        with open(os.path.join(self.directory, REJECTED_FILE), 'ab') as f:
+            f.write(line + b'\n')
+
+    def start(self):
+        """Start the replayer thread (once per process)"""
+        if self.directory is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='lead-spool', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the replayer thread"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+        self._pid = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Not woken by new spool entries: they mean the database has just failed
+            self._wakeup.wait(self.replay_interval)
+            if self._stopping.is_set():
+                break
+            try:
+                self.replay()
+            except CircuitOpenError:
+                # The database is still down; its breaker lets a probe through later
+                pass
+            except Exception as e:
+                logger.error(f"Lead spool replay error: {str(e)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or drain the local lead spool')
+    parser.add_argument('command', choices=['status', 'replay'])
+    parser.add_argument('--dir', default=os.environ.get('LEAD_SPOOL_DIR') or 'spool')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        spool = LeadSpool(None, None, directory=args.dir)
+        count = 0
+        for path in (spool.path, spool.replay_path):
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    count += sum(1 for line in f if line.strip() and not line.startswith(b'{"$set"'))
+        print(f"✅ {count} lead(s), {spool.pending_bytes():,} bytes waiting in {args.dir}")
+        return
+
+    from database import db
+    from app import queue_spooled_lead_emails
+    spool = LeadSpool(db, None, directory=args.dir, on_saved=queue_spooled_lead_emails)
+    inserted = spool.replay()
+    if inserted is None:
+        print("❌ Another process is replaying the spool, try again shortly")
+        return 1
+    left = spool.pending_bytes()
+    print(f"✅ {inserted} lead(s) replayed" + (f", {left:,} bytes left (database errors, see the log)" if left else ""))
+
+if __name__ == '__main__':
+    sys.exit(main())
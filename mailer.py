@@ -0,0 +1,176 @@
+"""
+SMTP Connection Pool for Dubai Smart Investment
+Keeps a few authenticated SMTP connections open and sends several messages
+over each one instead of doing STARTTLS + login for every email.
+With a circuit breaker, batches are refused straight away while the server is unreachable.
+"""
+import os
+import smtplib
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Errors that only affect a single message; the connection itself is still usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+class _PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+class SMTPConnectionPool:
+    def __init__(self, host, port, username, password, max_connections=2,
+                 max_messages_per_connection=100, keepalive_interval=30, idle_timeout=240, timeout=30,
+                 breaker=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_connections = max_connections
+        self.max_messages_per_connection = max_messages_per_connection
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.breaker = breaker
+
+        self.stats = {'connections_opened': 0, 'reconnects': 0, 'messages_sent': 0, 'messages_failed': 0,
+                      'messages_refused': 0}
+        self._reset()
+
+    def _reset(self):
+        # Called at start-up and after a fork: inherited sockets belong to the parent
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._idle = []
+
+    def send_messages(self, messages):
+        """
+        Send (from_addr, to_addrs, message) tuples over a single pooled connection.
+        Returns a list of (sent, error) tuples in the same order.
+        """
+        if os.getpid() != self._pid:
+            self._reset()
+
+        if self.breaker is not None and not self.breaker.allow():
+            self.stats['messages_refused'] += len(messages)
+            return [(False, 'SMTP server unavailable (circuit open)')] * len(messages)
+
+        results = []
+        conn = None
+        unreachable = None
+        self._slots.acquire()
+        try:
+            for index, (from_addr, to_addrs, message) in enumerate(messages):
+                try:
+                    if conn is None or conn.sent >= self.max_messages_per_connection:
+                        self._close(conn)
+                        conn = self._checkout()
+                    self._send(conn, from_addr, to_addrs, message)
+                    results.append((True, None))
+                    continue
+                except MESSAGE_ERRORS as e:
+                    results.append((False, str(e)))
+                    self.stats['messages_failed'] += 1
+                    continue
+                except (smtplib.SMTPException, OSError) as e:
+                    logger.warning(f"SMTP connection lost, reconnecting: {str(e)}")
+                    self._close(conn)
+                    conn = None
+
+                # Connection-level failure: reconnect once and retry this message
+                try:
+                    self.stats['reconnects'] += 1
+                    conn = self._connect()
+                    self._send(conn, from_addr, to_addrs, message)
+                    results.append((True, None))
+                except MESSAGE_ERRORS as e:
+                    # Reconnected, but the server refused this message: the connection is fine
+                    results.append((False, str(e)))
+                    self.stats['messages_failed'] += 1
+                except (smtplib.SMTPException, OSError) as e:
+                    # Server is unreachable; fail the rest of the batch without more connect attempts
+                    unreachable = e
+                    self._close(conn)
+                    conn = None
+                    remaining = len(messages) - index
+                    results.extend([(False, str(e))] * remaining)
+                    self.stats['messages_failed'] += remaining
+                    break
+        finally:
+            self._checkin(conn)
+            self._slots.release()
+            if self.breaker is not None:
+                if unreachable is None:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure(unreachable)
+
+        return results
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def _send(self, conn, from_addr, to_addrs, message):
+        conn.smtp.sendmail(from_addr, to_addrs, message)
+        conn.sent += 1
+        conn.last_used = time.monotonic()
+        self.stats['messages_sent'] += 1
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.starttls()
+            smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.stats['connections_opened'] += 1
+        return _PooledConnection(smtp)
+
+    def _checkout(self):
+        """Reuse an idle connection if it is still alive, otherwise open a new one"""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if self._is_alive(conn):
+                return conn
+            self._close(conn)
+
+    def _checkin(self, conn):
+        if conn is None:
+            return
+        if conn.sent >= self.max_messages_per_connection:
+            self._close(conn)
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    def _is_alive(self, conn):
+        idle_for = time.monotonic() - conn.last_used
+        if idle_for > self.idle_timeout:
+            return False
+        if idle_for > self.keepalive_interval:
+            try:
+                code, _ = conn.smtp.noop()
+                return code == 250
+            except (smtplib.SMTPException, OSError):
+                return False
+        return True
+
+    def _close(self, conn):
+        if conn is None:
+            return
+        try:
+            conn.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.smtp.close()
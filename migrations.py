@@ -0,0 +1,170 @@
+"""
+Schema Migrations for Dubai Smart Investment
+Indexes (and one-off data fixes) are applied once, before a deploy, instead of
+by every worker on every start. Applied steps are recorded in the
+schema_migrations collection; the app only checks that it is up to date.
+
+Usage:
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # show applied and pending migrations
+
+Add a step by appending a function to MIGRATIONS; never change or reorder
+steps that have been released. The SQLite backend (sqlite_store.py) creates
+its own schema when it is opened, so there is nothing to apply for it.
+"""
+import sys
+import time
+import socket
+import argparse
+import logging
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from database import LEAD_FILTER_FIELDS, to_utc
+
+logger = logging.getLogger(__name__)
+
+LOCK_SECONDS = 3600
+
+# background=True only matters before MongoDB 4.2; newer servers always build
+# indexes without blocking reads and writes for the whole build
+BACKGROUND = {'background': True}
+
+def lead_indexes(database):
+    """Lead listing, filter and dedupe indexes; user and config lookups"""
+    leads = database.leads
+    leads.create_index([('email', ASCENDING)], **BACKGROUND)
+    leads.create_index([('created_at', DESCENDING)], **BACKGROUND)
+    # Keyset pagination: newest first, _id breaks ties between equal timestamps
+    leads.create_index([('created_at', DESCENDING), ('_id', DESCENDING)], **BACKGROUND)
+    # One per filter (status, assigned_to, source, country), sorted like the listing
+    for field in LEAD_FILTER_FIELDS:
+        leads.create_index([(field, ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], **BACKGROUND)
+    # One lead per (source, lead_id); leads without a lead_id (website form) are not indexed.
+    # Fails if older duplicates exist: remove them and run the migration again.
+    leads.create_index([('source', ASCENDING), ('lead_id', ASCENDING)], name='source_lead_id_unique',
+                       unique=True, partialFilterExpression={'lead_id': {'$gt': ''}}, **BACKGROUND)
+
+    database.users.create_index([('username', ASCENDING)], unique=True, **BACKGROUND)
+    database.config.create_index([('type', ASCENDING)], unique=True, **BACKGROUND)
+
+def session_indexes(database):
+    """Unique token index and TTL expiry, replacing the older plain indexes of the same name"""
+    sessions = database.sessions
+    existing = sessions.index_information()
+    if 'token_1' in existing and not existing['token_1'].get('unique'):
+        sessions.drop_index('token_1')
+    if 'expires_at_1' in existing and 'expireAfterSeconds' not in existing['expires_at_1']:
+        sessions.drop_index('expires_at_1')
+
+    sessions.create_index([('token', ASCENDING)], unique=True, **BACKGROUND)
+    # MongoDB removes sessions once they expire
+    sessions.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0, **BACKGROUND)
+    # Revoked signed tokens only need to be remembered until they expire
+    database.revoked_tokens.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0, **BACKGROUND)
+
+def queue_indexes(database):
+    """Email outbox, lead queue, geolocation cache and rollup indexes"""
+    database.email_outbox.create_index([('status', ASCENDING), ('next_attempt_at', ASCENDING)], **BACKGROUND)
+    # Sent emails are kept for a week for troubleshooting, then removed by MongoDB
+    database.email_outbox.create_index([('sent_at', ASCENDING)], expireAfterSeconds=7 * 24 * 3600, **BACKGROUND)
+
+    database.lead_queue.create_index([('status', ASCENDING), ('next_attempt_at', ASCENDING)], **BACKGROUND)
+    # A webhook delivery is only queued once, however often it is retried
+    database.lead_queue.create_index([('key', ASCENDING)], unique=True,
+                                     partialFilterExpression={'key': {'$type': 'string'}}, **BACKGROUND)
+    database.lead_queue.create_index([('done_at', ASCENDING)], expireAfterSeconds=7 * 24 * 3600, **BACKGROUND)
+
+    database.geo_cache.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0, **BACKGROUND)
+    database.lead_rollups.create_index([('dimension', ASCENDING), ('value', ASCENDING)], **BACKGROUND)
+
+def build_lead_rollups(database):
+    """Count the leads saved before rollups were kept"""
+    if database.rebuild_lead_rollups() is None:
+        raise RuntimeError('Lead rollup rebuild failed')
+
+def utc_expiry_times(database):
+    """Session and revocation expiry times in UTC, which their TTL indexes compare with"""
+    # Written before this step as local time, so hosts behind UTC removed them early
+    for collection in (database.sessions, database.revoked_tokens):
+        updates = [UpdateOne({'_id': entry['_id']}, {'$set': {'expires_at': to_utc(entry['expires_at'])}})
+                   for entry in collection.find({'expires_at': {'$exists': True}}, {'expires_at': 1})]
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+
+# (version, function) in the order they are applied
+MIGRATIONS = [
+    (1, lead_indexes),
+    (2, session_indexes),
+    (3, queue_indexes),
+    (4, build_lead_rollups),
+    (5, utc_expiry_times),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def pending_migrations(applied_versions):
+    return [(version, step) for version, step in MIGRATIONS if version not in applied_versions]
+
+def migrate(database, target=LATEST_VERSION, log=print):
+    """Apply pending migrations up to target. Returns the number applied."""
+    if database.manages_schema:
+        return 0
+    
+    owner = f"{socket.gethostname()}:{id(database)}"
+    if not database.acquire_migration_lock(owner, LOCK_SECONDS):
+        raise RuntimeError('Another migration is running (schema_migrations lock); try again when it finishes')
+
+    try:
+        applied = database.get_applied_migrations()
+        if applied is None:
+            raise RuntimeError('Could not read schema_migrations')
+
+        count = 0
+        for version, step in pending_migrations(applied):
+            if version > target:
+                break
+            log(f"  → {version}: {step.__doc__}")
+            started = time.monotonic()
+            step(database)
+            duration_ms = round((time.monotonic() - started) * 1000)
+            if not database.record_migration(version, step.__name__, duration_ms):
+                raise RuntimeError(f"Migration {version} was applied but could not be recorded")
+            log(f"  ✓ {version}: {step.__name__} ({duration_ms} ms)")
+            count += 1
+        return count
+
+    finally:
+        database.release_migration_lock(owner)
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply or inspect schema migrations')
+    parser.add_argument('command', nargs='?', choices=['migrate', 'status'], default='migrate')
+    parser.add_argument('--target', type=int, default=LATEST_VERSION, help='Stop after this version')
+    args = parser.parse_args()
+
+    from storage import open_database
+    database = open_database(verify_schema=False)
+
+    if database.manages_schema:
+        print(f"✅ The {database.backend} backend creates its schema when it is opened "
+              f"(version {database.get_schema_version()}), nothing to apply")
+        return
+
+    if args.command == 'status':
+        applied = database.get_applied_migrations() or {}
+        for version, step in MIGRATIONS:
+            record = applied.get(version)
+            state = f"applied {record['applied_at']:%Y-%m-%d %H:%M}" if record else 'pending'
+            print(f"  {version}: {step.__name__:<20} {state}")
+        return
+
+    print("Applying schema migrations...")
+    try:
+        count = migrate(database, args.target)
+    except Exception as e:
+        print(f"❌ Migration failed: {str(e)}")
+        return 1
+    print(f"✅ {count} migration(s) applied, schema at version {database.get_schema_version()}")
+
+if __name__ == '__main__':
+    sys.exit(main())
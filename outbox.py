@@ -0,0 +1,151 @@
+"""
+Email Outbox for Dubai Smart Investment
+Lead emails are queued in MongoDB and sent by background worker threads,
+so API requests return as soon as the lead is saved. Workers claim due jobs
+in batches and send each batch over one SMTP connection. While the SMTP
+circuit breaker is open, workers leave the jobs queued instead of using up
+their attempts on a server that is down.
+"""
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EmailOutbox:
+    def __init__(self, database, builders, send_batch, workers=2, batch_size=20, poll_interval=5.0,
+                 max_attempts=6, base_delay=30, max_delay=3600, lease_seconds=300, breaker=None):
+        # builders maps a job kind to a function(**payload) returning (from_addr, to_addrs, message);
+        # send_batch sends a list of those and returns a (sent, error) tuple for each;
+        # breaker is the circuit breaker send_batch goes through (see circuit_breaker.py)
+        self.database = database
+        self.builders = builders
+        self.send_batch = send_batch
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.breaker = breaker
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, kind, **payload):
+        """Queue an email job and wake up a worker"""
+        if kind not in self.builders:
+            raise ValueError(f"Unknown email job kind: {kind}")
+
+        job_id = self.database.enqueue_email(kind, payload)
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        """Start the worker threads (once per process)"""
+        with self._lock:
+            if self._pid == os.getpid() or self.workers <= 0:
+                return
+
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = []
+            for i in range(self.workers):
+                worker_id = f"{socket.gethostname()}:{self._pid}:{i}"
+                thread = threading.Thread(target=self._run, args=(worker_id,),
+                                          name=f"email-outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+            logger.info(f"Email outbox started with {self.workers} worker(s)")
+
+    def stop(self, timeout=5):
+        """Stop the worker threads"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def process_batch(self, worker_id='inline'):
+        """Claim up to batch_size due jobs and send them together. Returns the number claimed."""
+        if self.breaker is not None and not self.breaker.available():
+            return 0
+
+        jobs = []
+        while len(jobs) < self.batch_size:
+            job = self.database.claim_email_job(worker_id, self.lease_seconds)
+            if not job:
+                break
+            jobs.append(job)
+
+        if not jobs:
+            return 0
+
+        # Build every message first so one bad payload doesn't hold up the batch
+        ready = []
+        for job in jobs:
+            builder = self.builders.get(job['kind'])
+            try:
+                if builder is None:
+                    raise ValueError(f"No builder for email job kind: {job['kind']}")
+                ready.append((job, builder(**job.get('payload', {}))))
+            except Exception as e:
+                logger.debug(f"Email job {job['_id']} could not be built", exc_info=True)
+                self._finish(job, False, str(e))
+
+        if ready:
+            try:
+                results = self.send_batch([message for _, message in ready])
+            except Exception as e:
+                results = [(False, str(e))] * len(ready)
+
+            for (job, _), (sent, error) in zip(ready, results):
+                self._finish(job, sent, error)
+
+        return len(jobs)
+
+    def drain(self):
+        """Send every job that is currently due (useful from scripts)"""
+        processed = 0
+        while True:
+            claimed = self.process_batch()
+            if not claimed:
+                return processed
+            processed += claimed
+
+    def _finish(self, job, sent, error):
+        job_id = str(job['_id'])
+
+        if sent:
+            self.database.complete_email_job(job_id)
+        elif job['attempts'] >= self.max_attempts:
+            logger.error(f"Email job {job_id} ({job['kind']}) failed permanently: {error}")
+            self.database.fail_email_job(job_id, error)
+        else:
+            delay = self.retry_delay(job['attempts'])
+            logger.warning(f"Email job {job_id} ({job['kind']}) failed, retrying in {delay}s: {error}")
+            self.database.retry_email_job(job_id, datetime.now() + timedelta(seconds=delay), error)
+
+    def retry_delay(self, attempts):
+        """Exponential backoff: base_delay, 2x, 4x ... capped at max_delay"""
+        return min(self.base_delay * (2 ** max(attempts - 1, 0)), self.max_delay)
+
+    def _run(self, worker_id):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                if self.process_batch(worker_id):
+                    continue
+            except Exception as e:
+                logger.error(f"Email outbox worker {worker_id} error: {str(e)}")
+
+            # Nothing due: sleep until the next poll or until a new job is queued
+            self._wakeup.wait(self.poll_interval)
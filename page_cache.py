@@ -0,0 +1,125 @@
+"""
+HTML Page Cache for Dubai Smart Investment
+Each worker keeps the site's pages in memory with their compressed bodies,
+a strong ETag and Last-Modified, so page requests (and conditional requests
+answered with 304) don't touch the disk. A page is reloaded when its file's
+modification time changes; files are checked at most every check_interval seconds.
+"""
+import os
+import gzip
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+import logging
+
+from flask import Response
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+
+REVALIDATE_CACHE = 'no-cache'
+
+class _Page:
+    def __init__(self, path, stat, etag, bodies):
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.checked_at = time.monotonic()
+        self.etag = etag
+        self.bodies = bodies  # encoding ('identity', 'gzip', 'br') -> bytes
+        self.last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+class PageCache:
+    def __init__(self, root, assets=None, check_interval=2.0):
+        # assets is an AssetManifest; its precompressed pages are used when they are up to date
+        self.root = root
+        self.assets = assets
+        self.check_interval = check_interval
+
+        self._pages = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'loads': 0, 'not_modified': 0}
+
+    def response(self, filename, request):
+        """Response for an HTML page relative to root, or None if there is no such file"""
+        page = self._get(filename)
+        if page is None:
+            return None
+
+        encoding = self._choose_encoding(page, request.accept_encodings)
+        etag = page.etag if encoding == 'identity' else f"{page.etag}-{encoding}"
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = bool(request.if_modified_since and request.if_modified_since >= page.last_modified)
+
+        if not_modified:
+            self.stats['not_modified'] += 1
+            response = Response(status=304)
+        else:
+            response = Response(page.bodies[encoding], mimetype='text/html')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.last_modified = page.last_modified
+        response.headers['Cache-Control'] = REVALIDATE_CACHE
+        if len(page.bodies) > 1:
+            response.vary.add('Accept-Encoding')
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._pages = {}
+
+    def _get(self, filename):
+        page = self._pages.get(filename)
+        if page is not None and time.monotonic() - page.checked_at < self.check_interval:
+            self.stats['hits'] += 1
+            return page
+
+        path = safe_join(self.root, filename)
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        if stat is None:
+            with self._lock:
+                self._pages.pop(filename, None)
+            return None
+
+        if page is not None and page.mtime == stat.st_mtime and page.size == stat.st_size:
+            page.checked_at = time.monotonic()
+            self.stats['hits'] += 1
+            return page
+
+        page = self._load(filename, path, stat)
+        with self._lock:
+            self._pages[filename] = page
+        self.stats['loads'] += 1
+        return page
+
+    def _load(self, filename, path, stat):
+        entry = self.assets.current_entry(filename) if self.assets else None
+        if entry is not None:
+            bodies = {'identity': self.assets.read(entry['file'])}
+            for encoding, built_path in entry['encodings'].items():
+                bodies[encoding] = self.assets.read(built_path)
+            return _Page(path, stat, entry['hash'], bodies)
+
+        # Not in the asset build: compress once here instead of on every request
+        with open(path, 'rb') as f:
+            body = f.read()
+        bodies = {'identity': body}
+        compressed = gzip.compress(body, compresslevel=6, mtime=0)
+        if len(compressed) < len(body):
+            bodies['gzip'] = compressed
+        return _Page(path, stat, hashlib.sha256(body).hexdigest()[:16], bodies)
+
+    def _choose_encoding(self, page, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in page.bodies and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
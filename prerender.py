@@ -0,0 +1,271 @@
+"""
+Static Site Prerender for Dubai Smart Investment
+Writes the public marketing pages into public_site/ with the editor's website
+config already merged in, so they can be served from a CDN with no Python and
+no /api/website/config round trip before first paint.
+
+Pages are minified; static files, favicons, robots.txt and the sitemap are
+copied alongside. Pages are only regenerated when their source or the config
+values they use change.
+
+Usage (reads the config from MongoDB, or from an exported JSON file):
+    python prerender.py [--output public_site] [--config website_config.json]
+"""
+import os
+import re
+import sys
+import json
+import html
+import shutil
+import hashlib
+import argparse
+from html.parser import HTMLParser
+import logging
+
+from assets import load_manifest
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_PAGES = ['index.html', 'terms.html', 'privacy.html', 'disclaimer.html', 'cookies.html', 'thank-you.html']
+PUBLIC_FILES = ['sitemap.xml', 'robots.txt', 'site.webmanifest', 'favicon.ico', 'favicon-16x16.png',
+                'favicon-32x32.png', 'apple-touch-icon.png', 'android-chrome-192x192.png',
+                'android-chrome-512x512.png']
+STATE_NAME = '.prerender.json'
+
+# Design settings applied as CSS variables, as loadWebsiteConfig() does in the browser
+DESIGN_VARIABLES = {'primaryColor': '--primary-color', 'darkColor': '--dark-color', 'lightColor': '--light-color'}
+
+# Elements without an end tag
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                 'source', 'track', 'wbr'}
+IMG_SRC = re.compile(r'''\ssrc\s*=\s*(?:"[^"]*"|'[^']*'|[^\s>]+)''', re.IGNORECASE)
+
+HTML_TAG = re.compile(r'<html\b[^>]*>', re.IGNORECASE)
+# Blocks whose whitespace matters (or that we don't try to minify)
+RAW_BLOCK = re.compile(r'(<(pre|textarea|script)\b.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+STYLE_BLOCK = re.compile(r'(<style\b[^>]*>)(.*?)(</style\s*>)', re.IGNORECASE | re.DOTALL)
+HTML_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+
+class _ConfigTargets(HTMLParser):
+    """
+    Finds the first element for each data-config key, as document.querySelector does:
+    {key: (tag, start, start_tag_end, end_tag_start)} as offsets into the page
+    (end_tag_start is None for <img> and other void elements)
+    """
+    def __init__(self, page_html):
+        super().__init__(convert_charrefs=True)
+        self.targets = {}
+        # getpos() counts lines by '\n' only
+        self._line_starts = [0] + [match.end() for match in re.finditer('\n', page_html)]
+        self._open = []  # [key, tag, start, start_tag_end, depth] for targets whose end tag is pending
+        self.feed(page_html)
+        self.close()
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        for target in self._open:
+            if target[1] == tag:
+                target[4] += 1
+
+        key = dict(attrs).get('data-config')
+        if key is None or key in self.targets or any(target[0] == key for target in self._open):
+            return
+        start = self._offset()
+        start_tag_end = start + len(self.get_starttag_text())
+        if tag in VOID_ELEMENTS:
+            self.targets[key] = (tag, start, start_tag_end, None)
+        else:
+            self._open.append([key, tag, start, start_tag_end, 1])
+
+    def handle_startendtag(self, tag, attrs):
+        key = dict(attrs).get('data-config')
+        if key is not None and key not in self.targets:
+            start = self._offset()
+            self.targets[key] = (tag, start, start + len(self.get_starttag_text()), None)
+
+    def handle_endtag(self, tag):
+        for target in list(self._open):
+            if target[1] != tag:
+                continue
+            # A nested element of the same name closes first
+            target[4] -= 1
+            if target[4] == 0:
+                self._open.remove(target)
+                key, tag, start, start_tag_end, _ = target
+                self.targets[key] = (tag, start, start_tag_end, self._offset())
+
+def page_config(page_html, config):
+    """The parts of the config a page uses (the page is rebuilt when these change)"""
+    # Pages without loadWebsiteConfig() never apply the config in the browser either
+    if 'loadWebsiteConfig' not in page_html:
+        return {}
+    keys = _ConfigTargets(page_html).targets
+    used = {}
+    content = {key: value for key, value in config.get('content', {}).items() if key in keys}
+    if content:
+        used['content'] = content
+    design = {name: config.get('design', {}).get(name) for name in DESIGN_VARIABLES}
+    used['design'] = {name: value for name, value in design.items() if value}
+    return used
+
+def apply_config(page_html, used, version):
+    """
+    Merge config values into the page the same way loadWebsiteConfig() does in the browser:
+    the content section (an <img> gets a new src, any other element new text) and the design colours
+    """
+    targets = _ConfigTargets(page_html).targets
+    edits = []
+    for key, value in used.get('content', {}).items():
+        if key not in targets:
+            continue
+        tag, start, start_tag_end, end_tag_start = targets[key]
+        if tag == 'img':
+            start_tag = IMG_SRC.sub('', page_html[start:start_tag_end])
+            edits.append((start, start_tag_end, start_tag[:4] + f' src="{html.escape(str(value))}"' + start_tag[4:]))
+        elif end_tag_start is not None:
+            # textContent replaces everything inside the element, nested tags included
+            text = '' if value is None else str(value)
+            edits.append((start_tag_end, end_tag_start, html.escape(text, quote=False)))
+
+    # An element inside another one whose text is replaced is gone from the page
+    edits = [edit for edit in edits
+             if not any(other is not edit and other[0] <= edit[0] and edit[1] <= other[1] for other in edits)]
+    # Back to front, so earlier offsets stay valid
+    for start, end, replacement in sorted(edits, reverse=True):
+        page_html = page_html[:start] + replacement + page_html[end:]
+
+    variables = ''.join(f"{DESIGN_VARIABLES[name]}: {value};"
+                        for name, value in used.get('design', {}).items())
+
+    def mark_html(match):
+        tag = match.group(0)[:-1]
+        # The page script skips its config request when this attribute is present
+        tag += f' data-config-version="{version}"'
+        if variables:
+            tag += f' style="{html.escape(variables)}"'
+        return tag + '>'
+    return HTML_TAG.sub(mark_html, page_html, count=1)
+
+def minify_html(page_html):
+    """Drop comments and collapse whitespace outside <pre>, <textarea> and <script>"""
+    parts = RAW_BLOCK.split(page_html)
+    result = []
+    # re.split with two groups yields: text, block, tag name, text, block, tag name, ...
+    for index in range(0, len(parts), 3):
+        text = HTML_COMMENT.sub('', parts[index])
+        text = STYLE_BLOCK.sub(lambda m: m.group(1) + minify_css(m.group(2)) + m.group(3), text)
+        text = re.sub(r'\s+', ' ', text)
+        result.append(text)
+        if index + 1 < len(parts):
+            result.append(parts[index + 1])
+    return ''.join(result).strip()
+
+def minify_css(css):
+    css = CSS_COMMENT.sub('', css)
+    css = re.sub(r'\s+', ' ', css)
+    return re.sub(r'\s*([{};,>])\s*', r'\1', css).strip()
+
+def _copy_if_changed(source, target):
+    try:
+        source_stat = os.stat(source)
+        target_stat = os.stat(target)
+        if source_stat.st_size == target_stat.st_size and int(source_stat.st_mtime) == int(target_stat.st_mtime):
+            return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    shutil.copy2(source, target)
+    return True
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def prerender_site(config, version, output_dir='public_site', source_dir='.', asset_dir='dist'):
+    """Write the public site into output_dir. Returns (pages_built, pages_unchanged, files_copied)."""
+    state_path = os.path.join(output_dir, STATE_NAME)
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    # Use the asset build's copy of a page when it is current (hashed URLs, srcset)
+    assets = load_manifest(os.path.join(source_dir, asset_dir), source_dir)
+
+    built = unchanged = copied = 0
+    new_state = {}
+    for page in PUBLIC_PAGES:
+        entry = assets.current_entry(page) if assets else None
+        if entry is not None:
+            source = assets.read(entry['file']).decode('utf-8')
+        else:
+            with open(os.path.join(source_dir, page), encoding='utf-8') as f:
+                source = f.read()
+
+        used = page_config(source, config)
+        fingerprint = hashlib.sha256(
+            (source + json.dumps(used, sort_keys=True, default=str)).encode('utf-8')).hexdigest()
+        new_state[page] = fingerprint
+
+        target = os.path.join(output_dir, page)
+        if state.get(page) == fingerprint and os.path.exists(target):
+            unchanged += 1
+            continue
+
+        _write(target, minify_html(apply_config(source, used, version)))
+        built += 1
+
+    for name in PUBLIC_FILES:
+        if os.path.exists(os.path.join(source_dir, name)):
+            copied += _copy_if_changed(os.path.join(source_dir, name), os.path.join(output_dir, name))
+
+    # Static files under their own names, plus the hashed copies the built pages refer to
+    static_roots = [(os.path.join(source_dir, 'static'), os.path.join(output_dir, 'static'))]
+    if assets:
+        static_roots.append((os.path.join(assets.output_dir, 'static'), os.path.join(output_dir, 'static')))
+    for source_root, target_root in static_roots:
+        for root, _, names in os.walk(source_root):
+            for name in names:
+                if name.endswith(('.gz', '.br')):
+                    continue
+                source = os.path.join(root, name)
+                target = os.path.join(target_root, os.path.relpath(source, source_root))
+                copied += _copy_if_changed(source, target)
+
+    _write(state_path, json.dumps(new_state, indent=1, sort_keys=True))
+    return built, unchanged, copied
+
+def load_config(config_path=None):
+    """(version, config) from a JSON export, or from MongoDB"""
+    if config_path:
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+        return config.pop('version', 0), config
+
+    from database import db
+    from website_config import WebsiteConfig
+    version, config, _ = WebsiteConfig(db, check_interval=0).get()
+    return version or 0, config
+
+def main():
+    parser = argparse.ArgumentParser(description='Prerender the public site with the website config merged in')
+    parser.add_argument('--output', default='public_site')
+    parser.add_argument('--config', help='Website config JSON file (default: read from MongoDB)')
+    parser.add_argument('--asset-dir', default=os.environ.get('ASSET_BUILD_DIR') or 'dist')
+    args = parser.parse_args()
+
+    version, config = load_config(args.config)
+    built, unchanged, copied = prerender_site(config, version, args.output, asset_dir=args.asset_dir)
+    print(f"✅ {args.output}: {built} page(s) rendered, {unchanged} unchanged, "
+          f"{copied} file(s) copied (config version {version})")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Responsive Images for Dubai Smart Investment
+Generates width-stepped JPEG and WebP copies of the photos in static/images so
+phones on landing-page traffic don't download 2-4 MB originals. Images are
+processed in parallel (one process per core) and only images whose content
+changed since the last run are redone.
+
+Generate (then run python assets.py build, which adds srcset to the pages):
+    python responsive_images.py build
+
+The server sends the WebP copy of an image to browsers that accept image/webp;
+an original is sent as a full-size WebP, so it never comes back smaller.
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DIR = 'static/images'
+OUTPUT_DIR = 'static/images/responsive'
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, 'manifest.json')
+
+SOURCE_EXTENSIONS = {'.jpg', '.jpeg'}
+WIDTHS = [480, 768, 1200, 1920]
+JPEG_QUALITY = 80
+WEBP_QUALITY = 78
+
+# Property cards are full width on phones and half width from tablets up
+DEFAULT_SIZES = '(max-width: 768px) 100vw, 50vw'
+
+class ImageVariants:
+    def __init__(self, manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            self.images = json.load(f)['images']
+
+        # Every JPEG URL (original or resized) maps to the WebP copy with the same content
+        self._webp = {}
+        for key, image in self.images.items():
+            for variant in image['variants']:
+                self._webp[variant['jpeg']] = variant['webp']
+            if 'webp' in image:
+                self._webp[key] = image['webp']
+
+    def has_webp(self, key):
+        return key in self._webp
+
+    def webp_for(self, key, accept_mimetypes):
+        """WebP path to send instead of key when the browser explicitly accepts it, otherwise None"""
+        webp = self._webp.get(key)
+        if webp and any(mimetype == 'image/webp' and quality > 0 for mimetype, quality in accept_mimetypes):
+            return webp
+        return None
+
+    def srcset(self, key):
+        """[(jpeg_path, width)] for an original image, smallest first, or None"""
+        image = self.images.get(key)
+        if not image:
+            return None
+        return [(variant['jpeg'], variant['width']) for variant in image['variants']]
+
+def load_variants(manifest_path=MANIFEST_PATH):
+    """Open the variants manifest, returning None if it is missing or unreadable"""
+    if not manifest_path or not os.path.exists(manifest_path):
+        return None
+    try:
+        return ImageVariants(manifest_path)
+    except Exception as e:
+        logger.error(f"Failed to load image variants {manifest_path}: {str(e)}")
+        return None
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def settings_hash(digest):
+    """Hash of an image's content and the settings its variants are made with"""
+    settings = json.dumps({'widths': WIDTHS, 'jpeg_quality': JPEG_QUALITY, 'webp_quality': WEBP_QUALITY})
+    return hashlib.sha256(f"{digest}:{settings}".encode('utf-8')).hexdigest()
+
+def target_widths(width):
+    """Standard widths smaller than the image, plus the image's own width if it is not too large"""
+    widths = [w for w in WIDTHS if w < width]
+    if width <= WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+def generate_variants(source_path, output_dir):
+    """Write the JPEG and WebP variants of one image and return its manifest entry"""
+    from PIL import Image, ImageOps
+
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    with Image.open(source_path) as original:
+        # Apply the camera orientation before resizing, then drop the EXIF data
+        img = ImageOps.exif_transpose(original).convert('RGB')
+
+    variants = []
+    for width in target_widths(img.width):
+        height = round(img.height * width / img.width)
+        resized = img if width == img.width else img.resize((width, height), Image.LANCZOS)
+
+        jpeg_path = f"{output_dir}/{name}-{width}.jpg"
+        webp_path = f"{output_dir}/{name}-{width}.webp"
+        resized.save(jpeg_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        resized.save(webp_path, 'WEBP', quality=WEBP_QUALITY, method=6)
+        variants.append({'width': width, 'height': height, 'jpeg': jpeg_path, 'webp': webp_path})
+
+    # The original URL is answered with a WebP of the same size, not the largest variant
+    if variants[-1]['width'] == img.width:
+        full_webp = variants[-1]['webp']
+    else:
+        full_webp = f"{output_dir}/{name}-{img.width}.webp"
+        img.save(full_webp, 'WEBP', quality=WEBP_QUALITY, method=6)
+
+    return {'width': img.width, 'height': img.height, 'webp': full_webp, 'variants': variants}
+
+def build_variants(source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, workers=None):
+    """Generate variants for new or changed images. Returns (generated, unchanged)."""
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)['images']
+    except (OSError, ValueError, KeyError):
+        previous = {}
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    images = {}
+    pending = {}
+    for name in sorted(os.listdir(source_dir)):
+        if os.path.splitext(name)[1].lower() not in SOURCE_EXTENSIONS:
+            continue
+        key = f"{source_dir}/{name}"
+        # Changing the widths or qualities redoes every image
+        digest = settings_hash(file_hash(key))
+
+        old = previous.get(key)
+        if old and old['hash'] == digest and os.path.exists(old['webp']) and all(
+                os.path.exists(variant[kind]) for variant in old['variants'] for kind in ('jpeg', 'webp')):
+            images[key] = old
+        else:
+            pending[key] = digest
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = {key: executor.submit(generate_variants, key, output_dir) for key in pending}
+            for key, future in futures.items():
+                images[key] = {'hash': pending[key], **future.result()}
+                print(f"  ✓ {key}: {', '.join(str(v['width']) for v in images[key]['variants'])}")
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'images': images}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    # Remove variants of images that were deleted or resized differently
+    keep = {os.path.basename(manifest_path)}
+    for image in images.values():
+        keep.add(os.path.basename(image['webp']))
+        for variant in image['variants']:
+            keep.update(os.path.basename(variant[kind]) for kind in ('jpeg', 'webp'))
+    for name in os.listdir(output_dir):
+        if name not in keep:
+            os.remove(os.path.join(output_dir, name))
+
+    return len(pending), len(images) - len(pending)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate responsive JPEG and WebP image variants')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Generate variants for new or changed images')
+    build.add_argument('--workers', type=int, default=None, help='Processes to use (default: one per core)')
+
+    args = parser.parse_args()
+
+    print("Generating responsive images for Dubai Smart Investment...")
+    generated, unchanged = build_variants(workers=args.workers)
+    print(f"✅ {generated} image(s) generated, {unchanged} unchanged ({MANIFEST_PATH})")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Session Store for Dubai Smart Investment
+MongoDB's sessions collection is the source of truth, so every gunicorn worker
+knows every admin and manager token. Each worker keeps a small TTL cache in
+front of it; expiry extensions are queued and written back in batches, and a
+background sweeper keeps the cache bounded.
+
+With a TokenSigner the store issues signed tokens instead: they are verified
+without touching the database, and only logouts are shared (via the revocation
+list, which the background thread reloads every flush_interval seconds).
+"""
+import os
+import atexit
+import secrets
+import threading
+from datetime import datetime, timedelta
+import logging
+
+from ttl_cache import TTLCache
+from tokens import RevocationList, is_signed_token
+
+logger = logging.getLogger(__name__)
+
+# Cached marker for tokens the database does not know about
+_INVALID = {}
+
+class SessionStore:
+    def __init__(self, database, session_hours=24, refresh_threshold=3600, cache_size=10000,
+                 cache_ttl=30, flush_interval=5, sweep_interval=60, signer=None):
+        self.database = database
+        self.signer = signer
+        self.revocations = RevocationList(database) if signer else None
+        self.session_lifetime = timedelta(hours=session_hours)
+        self.refresh_threshold = refresh_threshold
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._pending = {}  # token -> new expires_at, not yet written to the database
+        self._pending_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def create(self, username, role):
+        """Create a session and return (token, expires_at)"""
+        expires_at = datetime.now() + self.session_lifetime
+        if self.signer:
+            return self.signer.sign(username, role, expires_at), expires_at
+
+        token = secrets.token_urlsafe(32)
+
+        if not self.database.save_session(token, username, expires_at, role=role):
+            raise RuntimeError('Could not save session')
+
+        self._cache(token, {'username': username, 'role': role, 'expires_at': expires_at})
+        return token, expires_at
+
+    def get(self, token):
+        """Return {'username', 'role', 'expires_at'} for a valid token, or None"""
+        if not token:
+            return None
+        if is_signed_token(token):
+            return self._verify_signed(token)
+
+        session = self.cache.get(token)
+        if session is None:
+            try:
+                stored = self.database.get_session(token)
+            except Exception as e:
+                # Don't remember the token as invalid: the database may be back in a moment
+                logger.warning(f"Session lookup failed: {str(e)}")
+                return None
+            if stored:
+                session = {
+                    'username': stored['username'],
+                    'role': stored.get('role', 'manager'),
+                    'expires_at': stored['expires_at']
+                }
+                with self._pending_lock:
+                    # A refresh from this worker may not have been written back yet
+                    if token in self._pending:
+                        session['expires_at'] = max(session['expires_at'], self._pending[token])
+            else:
+                session = _INVALID
+            self._cache(token, session)
+
+        if session is _INVALID or session['expires_at'] <= datetime.now():
+            return None
+        return session
+
+    def refresh(self, token, force=False):
+        """
+        Extend a session to a full lifetime from now. Unless force is set this only happens
+        once the session is within refresh_threshold of expiring. Returns the session or None.
+        Signed tokens cannot be extended in place: a forced refresh returns the session with
+        a replacement 'token' instead.
+        """
+        session = self.get(token)
+        if session is None:
+            return None
+
+        if is_signed_token(token):
+            if force:
+                new_token, expires_at = self.create(session['username'], session['role'])
+                session = {**session, 'token': new_token, 'expires_at': expires_at}
+            return session
+
+        remaining = (session['expires_at'] - datetime.now()).total_seconds()
+        if force or remaining < self.refresh_threshold:
+            session = {**session, 'expires_at': datetime.now() + self.session_lifetime}
+            self._cache(token, session)
+            with self._pending_lock:
+                self._pending[token] = session['expires_at']
+            logger.info(f"Session refreshed for user: {session['username']}")
+
+        return session
+
+    def revoke(self, token):
+        """Delete a session everywhere"""
+        if is_signed_token(token):
+            session = self._verify_signed(token)
+            return session is not None and self.revocations.revoke(session['jti'], session['expires_at'])
+
+        with self._pending_lock:
+            self._pending.pop(token, None)
+        self.cache.delete(token)
+        return self.database.delete_session(token)
+
+    def flush(self):
+        """Write queued expiry extensions to the database"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        if not self.database.extend_sessions(pending):
+            # Put them back (unless a newer refresh arrived) and try again on the next flush
+            with self._pending_lock:
+                for token, expires_at in pending.items():
+                    self._pending.setdefault(token, expires_at)
+            return 0
+        return len(pending)
+
+    def start(self):
+        """Start the write-behind / sweeper thread (once per process)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='session-store', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+        if self.revocations is not None:
+            self.revocations.sync()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+        self.flush()
+        self._pid = None
+
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        stats = {**self.cache.stats(), 'pending_refreshes': pending}
+        if self.revocations is not None:
+            stats['revoked_tokens'] = len(self.revocations)
+        return stats
+
+    def _verify_signed(self, token):
+        if not self.signer:
+            return None
+        session = self.signer.verify(token)
+        if session is None or session['jti'] in self.revocations:
+            return None
+        return session
+
+    def _cache(self, token, session):
+        # Never keep a session in the cache past its expiry
+        ttl = self.cache_ttl
+        if session is not _INVALID:
+            ttl = min(ttl, max((session['expires_at'] - datetime.now()).total_seconds(), 0))
+        self.cache.set(token, session, ttl=ttl)
+
+    def _run(self):
+        last_sweep = datetime.now()
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+                if self.revocations is not None:
+                    self.revocations.sync()
+                if (datetime.now() - last_sweep).total_seconds() >= self.sweep_interval:
+                    removed = self.cache.purge_expired()
+                    last_sweep = datetime.now()
+                    if removed:
+                        logger.debug(f"Session cache sweep removed {removed} entries")
+            except Exception as e:
+                logger.error(f"Session store maintenance error: {str(e)}")
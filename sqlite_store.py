@@ -0,0 +1,956 @@
+"""
+SQLite Storage Backend for Dubai Smart Investment
+The storage interface (storage.py) on one SQLite file, for single-node
+deployments, CI and offline benchmarks. Selected with DATABASE_URL=sqlite:///leads.db
+
+- WAL journal: readers never wait for the writer, and with synchronous=NORMAL
+  a commit appends to the WAL without an fsync (a power cut can lose the last
+  commits but never corrupts the file)
+- One connection per thread. The SQL below is fixed text with ? parameters,
+  so each statement is prepared once per connection and then reused from
+  its statement cache
+- The lead fields that are filtered and sorted on are real columns with the
+  same indexes migrations.py creates on MongoDB; the whole lead is kept as JSON
+- The schema is created when the file is opened (migrations.py has nothing to
+  do here); expired sessions, tokens and geolocation entries and week-old
+  finished jobs are deleted every PURGE_INTERVAL seconds, which MongoDB does
+  with TTL indexes
+
+WAL needs a local disk, not a network filesystem. Several gunicorn workers on
+one machine can share the file.
+"""
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import logging
+
+from database import LEAD_FILTER_FIELDS, LEAD_SEARCH_FIELDS, LEAD_INTEREST_FIELDS, encode_cursor, decode_cursor
+from lead_ingest import DUPLICATE_KEY
+from lead_rollups import ROLLUP_FIELDS, MISSING, rollup_changes
+from migrations import LATEST_VERSION
+from storage import Storage, SQLITE_SCHEME, new_id, json_default, json_object_hook
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT = 5.0
+STATEMENT_CACHE_SIZE = 256
+PURGE_INTERVAL = 600
+FINISHED_JOB_DAYS = 7
+
+# Lead fields copied into their own columns (the rest only live in the JSON document)
+LEAD_COLUMNS = LEAD_FILTER_FIELDS + ['campaign_id', 'lead_id', 'email']
+
+QUEUE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TEXT NOT NULL,
+    lease_expires_at TEXT,
+    worker TEXT,
+    last_error TEXT,
+    key TEXT UNIQUE,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS {table}_due ON {table} (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS {table}_finished_at ON {table} (finished_at) WHERE finished_at IS NOT NULL;
+"""
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS leads (
+    id TEXT PRIMARY KEY,
+    created_at TEXT,
+    {', '.join(f'{column} TEXT' for column in LEAD_COLUMNS)},
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leads_created_at ON leads (created_at DESC, id DESC);
+{''.join(f'CREATE INDEX IF NOT EXISTS leads_{field} ON leads ({field}, created_at DESC, id DESC);'
+         for field in LEAD_FILTER_FIELDS)}
+CREATE INDEX IF NOT EXISTS leads_email ON leads (email);
+-- One lead per (source, lead_id); leads without a lead_id (website form) are not indexed
+CREATE UNIQUE INDEX IF NOT EXISTS leads_source_lead_id ON leads (source, lead_id) WHERE lead_id > '';
+
+CREATE TABLE IF NOT EXISTS lead_rollups (
+    id TEXT PRIMARY KEY,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    role TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    role TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti TEXT PRIMARY KEY,
+    expires_at TEXT NOT NULL,
+    revoked_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revoked_tokens_expires_at ON revoked_tokens (expires_at);
+
+CREATE TABLE IF NOT EXISTS website_config (
+    type TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS geo_cache (
+    ip TEXT PRIMARY KEY,
+    country_code TEXT,
+    country_name TEXT,
+    expires_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS geo_cache_expires_at ON geo_cache (expires_at);
+{QUEUE_TABLE.format(table='email_outbox')}
+{QUEUE_TABLE.format(table='lead_queue')}
+"""
+
+LEAD_ORDER = ' ORDER BY created_at DESC, id DESC'
+SELECT_LEADS = 'SELECT id, document FROM leads'
+INSERT_LEAD = (f"INSERT INTO leads (id, created_at, {', '.join(LEAD_COLUMNS)}, document) "
+               f"VALUES ({', '.join('?' * (len(LEAD_COLUMNS) + 3))})")
+INSERT_LEAD_ONCE = INSERT_LEAD.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1)
+UPDATE_LEAD = (f"UPDATE leads SET created_at = ?, {', '.join(f'{column} = ?' for column in LEAD_COLUMNS)}, "
+               f"document = ? WHERE id = ?")
+UPSERT_ROLLUP = ('INSERT INTO lead_rollups (id, dimension, value, count) VALUES (?, ?, ?, ?) '
+                 'ON CONFLICT (id) DO UPDATE SET count = count + excluded.count')
+
+def _ts(value):
+    """A datetime as ISO text, which sorts and compares in time order"""
+    return value.isoformat(timespec='microseconds') if value is not None else None
+
+def _dt(value):
+    return datetime.fromisoformat(value) if value else None
+
+def _dumps(document):
+    return json.dumps({key: value for key, value in document.items() if key != '_id'},
+                      default=json_default, separators=(',', ':'))
+
+def _loads(text):
+    return json.loads(text, object_hook=json_object_hook)
+
+def _column(value):
+    return None if value is None else str(value)
+
+def _lead_row(lead):
+    """created_at, the LEAD_COLUMNS and the JSON document, in INSERT_LEAD / UPDATE_LEAD order"""
+    return (_ts(lead.get('created_at')), *[_column(lead.get(column)) for column in LEAD_COLUMNS], _dumps(lead))
+
+def _json_timestamp(created_at):
+    # Same format as LEAD_JSON_FIELDS in database.py (milliseconds)
+    return created_at.strftime('%Y-%m-%dT%H:%M:%S.') + f"{created_at.microsecond // 1000:03d}"
+
+def _lead_json(lead_id, document, fields=None):
+    """A lead shaped like the MongoDB backend's: string '_id' and a 'timestamp'"""
+    lead = _loads(document)
+    created_at = lead.get('created_at')
+    if fields:
+        lead = {field: lead[field] for field in fields if field in lead}
+    lead = {'_id': lead_id, **lead}
+    if isinstance(created_at, datetime):
+        lead['timestamp'] = _json_timestamp(created_at)
+    return lead
+
+def lead_conditions(filters=None):
+    """SQL WHERE conditions and parameters for lead filters (see Database.build_lead_query)"""
+    filters = filters or {}
+    conditions, params = [], []
+    for field in LEAD_FILTER_FIELDS:
+        if filters.get(field):
+            conditions.append(f'{field} = ?')
+            params.append(filters[field])
+    if filters.get('date_from'):
+        conditions.append('created_at >= ?')
+        params.append(_ts(filters['date_from']))
+    if filters.get('date_to'):
+        conditions.append('created_at < ?')
+        params.append(_ts(filters['date_to']))
+    if filters.get('interest'):
+        conditions.append('(' + ' OR '.join(f"json_extract(document, '$.{field}') = ?"
+                                            for field in LEAD_INTEREST_FIELDS) + ')')
+        params.extend([filters['interest']] * len(LEAD_INTEREST_FIELDS))
+    if filters.get('search'):
+        conditions.append('(' + ' OR '.join(f"instr(lower(json_extract(document, '$.{field}')), ?) > 0"
+                                            for field in LEAD_SEARCH_FIELDS) + ')')
+        params.extend([filters['search'].lower()] * len(LEAD_SEARCH_FIELDS))
+    return conditions, params
+
+def _where(conditions):
+    return f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+def sqlite_path(url):
+    """File path from sqlite:///relative.db or sqlite:////absolute.db"""
+    path = url[len(SQLITE_SCHEME):]
+    if path.startswith('///'):
+        path = path[3:]
+    elif path.startswith('//'):
+        path = path[2:]
+    if not path or path == ':memory:':
+        raise RuntimeError('SQLite needs a file path (an in-memory database is private to one connection)')
+    return path
+
+class SQLiteDatabase(Storage):
+    backend = 'sqlite'
+    manages_schema = True
+
+    def __init__(self, url, busy_timeout=BUSY_TIMEOUT):
+        self.path = sqlite_path(url)
+        self.name = self.path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._purged_at = 0
+
+        try:
+            connection = self._connection()
+            connection.executescript(SCHEMA)
+            if connection.execute('PRAGMA user_version').fetchone()[0] < LATEST_VERSION:
+                connection.execute(f'PRAGMA user_version = {LATEST_VERSION}')
+            self.schema_version = self.get_schema_version()
+            logger.info(f"SQLite database opened: {self.path}")
+
+        except Exception as e:
+            logger.error(f"SQLite open failed: {str(e)}")
+            raise RuntimeError(f"Failed to open SQLite database {self.path}: {str(e)}")
+
+    def _connect(self):
+        # isolation_level=None: statements autocommit unless run inside _transaction()
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                     cached_statements=STATEMENT_CACHE_SIZE)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute('PRAGMA temp_store = MEMORY')
+        return connection
+
+    def _connection(self):
+        """This thread's connection"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE takes the write lock up front, so a read-then-write can't be interleaved"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _maybe_purge(self):
+        """Delete expired rows at most once every PURGE_INTERVAL seconds"""
+        if time.monotonic() - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = time.monotonic()
+        try:
+            now = _ts(datetime.now())
+            finished_before = _ts(datetime.now() - timedelta(days=FINISHED_JOB_DAYS))
+            with self._transaction() as connection:
+                connection.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+                connection.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?', (now,))
+                connection.execute('DELETE FROM geo_cache WHERE expires_at <= ?', (now,))
+                connection.execute('DELETE FROM email_outbox WHERE finished_at <= ?', (finished_before,))
+                connection.execute('DELETE FROM lead_queue WHERE finished_at <= ?', (finished_before,))
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error purging expired SQLite rows: {str(e)}")
+
+    def save_lead(self, lead_data):
+        """Save a new lead to database"""
+        try:
+            now = datetime.now()
+            lead_data['created_at'] = now
+            lead_data['updated_at'] = now
+            lead_data['status'] = lead_data.get('status', 'new')
+
+            lead_id = str(lead_data.get('_id') or new_id())
+            with self._transaction() as connection:
+                connection.execute(INSERT_LEAD, (lead_id, *_lead_row(lead_data)))
+                self._update_rollups(connection, added=[lead_data])
+            logger.info(f"Lead saved to SQLite: {lead_data.get('email')}")
+            return lead_id
+
+        except Exception as e:
+            logger.error(f"Error saving lead to SQLite: {str(e)}")
+            raise
+
+    def save_lead_once(self, lead_data):
+        """
+        Save a lead that carries a source and lead_id unless that lead is already stored.
+        Returns the new lead's id, or None if it was a duplicate.
+        """
+        try:
+            now = datetime.now()
+            lead_data['created_at'] = now
+            lead_data['updated_at'] = now
+            lead_data['status'] = lead_data.get('status', 'new')
+
+            lead_id = str(lead_data.get('_id') or new_id())
+            with self._transaction() as connection:
+                # The unique (source, lead_id) index turns a duplicate into a no-op
+                inserted = connection.execute(INSERT_LEAD_ONCE, (lead_id, *_lead_row(lead_data))).rowcount
+                if inserted:
+                    self._update_rollups(connection, added=[lead_data])
+            if not inserted:
+                logger.info(f"Duplicate lead ignored: {lead_data['source']} {lead_data['lead_id']}")
+                return None
+            logger.info(f"Lead saved to SQLite: {lead_data.get('email')}")
+            return lead_id
+
+        except Exception as e:
+            logger.error(f"Error saving lead to SQLite: {str(e)}")
+            raise
+
+    def insert_leads(self, leads):
+        """
+        Insert a batch of leads in one transaction.
+        Returns {index: (error_code, message)} for the leads that were not inserted.
+        """
+        if not leads:
+            return {}
+        try:
+            failures, inserted = {}, []
+            with self._transaction() as connection:
+                for index, lead in enumerate(leads):
+                    try:
+                        connection.execute(INSERT_LEAD, (str(lead.get('_id') or new_id()), *_lead_row(lead)))
+                        inserted.append(lead)
+                    except sqlite3.IntegrityError as e:
+                        # Only this statement is rolled back; the batch carries on like an unordered insert_many
+                        failures[index] = (DUPLICATE_KEY if 'UNIQUE' in str(e) else None, str(e))
+                self._update_rollups(connection, added=inserted)
+            return failures
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error inserting leads: {str(e)}")
+            return {index: (None, str(e)) for index in range(len(leads))}
+
+    def get_all_leads(self):
+        """Get all leads sorted by newest first"""
+        try:
+            rows = self._connection().execute(SELECT_LEADS + LEAD_ORDER).fetchall()
+            return [_lead_json(lead_id, document) for lead_id, document in rows]
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching leads from SQLite: {str(e)}")
+            return []
+
+    def get_leads_page(self, filters=None, limit=50, cursor=None, fields=None):
+        """
+        Get one page of leads, newest first, using keyset pagination on (created_at, id).
+        Returns (leads, next_cursor); next_cursor is None on the last page.
+        """
+        conditions, params = lead_conditions(filters)
+        if cursor:
+            created_at, lead_id = decode_cursor(cursor)
+            # A row value comparison walks the (created_at DESC, id DESC) index from the cursor
+            conditions.append('(created_at, id) < (?, ?)')
+            params += [_ts(created_at), str(lead_id)]
+
+        try:
+            # One extra row tells us whether there is another page
+            rows = self._connection().execute(
+                'SELECT id, created_at, document FROM leads' + _where(conditions) + LEAD_ORDER + ' LIMIT ?',
+                (*params, limit + 1)
+            ).fetchall()
+
+        except Exception as e:
+            logger.error(f"Error fetching leads page from SQLite: {str(e)}")
+            raise
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_id, last_created_at, _ = rows[-1]
+            next_cursor = encode_cursor(_dt(last_created_at), last_id)
+
+        return [_lead_json(lead_id, document, fields) for lead_id, _, document in rows], next_cursor
+
+    def iter_leads(self, filters=None, fields=None, batch_size=1000):
+        """Stream leads matching the filters, newest first, without loading them all into memory"""
+        conditions, params = lead_conditions(filters)
+        # A connection of its own, so a half-read export never holds open a statement on the thread's connection
+        connection = self._connect()
+        try:
+            rows = connection.execute(SELECT_LEADS + _where(conditions) + LEAD_ORDER, params)
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    break
+                for lead_id, document in batch:
+                    lead = _loads(document)
+                    if fields:
+                        lead = {field: lead[field] for field in fields if field in lead}
+                    yield {'_id': lead_id, **lead}
+        finally:
+            connection.close()
+
+    def _read_leads(self, connection, lead_ids):
+        return {lead_id: _loads(document) for lead_id, document in connection.execute(
+            f"SELECT id, document FROM leads WHERE id IN ({', '.join('?' * len(lead_ids))})", lead_ids)}
+
+    def _change_lead(self, lead_id, changes):
+        """Apply changes to a lead and move it between rollup buckets. Returns False if it doesn't exist."""
+        with self._transaction() as connection:
+            before = self._read_leads(connection, [lead_id]).get(lead_id)
+            if before is None:
+                return False
+            after = {**before, **changes}
+            connection.execute(UPDATE_LEAD, (*_lead_row(after), lead_id))
+            self._update_rollups(connection, added=[after], removed=[before])
+        return True
+
+    def delete_lead(self, lead_id):
+        """Delete a lead by ID"""
+        return self.delete_leads_bulk([lead_id]) == 1
+
+    def delete_leads_bulk(self, lead_ids):
+        """Delete multiple leads"""
+        try:
+            lead_ids = [str(lead_id) for lead_id in lead_ids]
+            if not lead_ids:
+                return 0
+            with self._transaction() as connection:
+                deleted = self._read_leads(connection, lead_ids)
+                connection.executemany('DELETE FROM leads WHERE id = ?', [(lead_id,) for lead_id in deleted])
+                self._update_rollups(connection, removed=list(deleted.values()))
+            return len(deleted)
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error deleting leads from SQLite: {str(e)}")
+            return 0
+
+    def update_lead(self, lead_id, update_data):
+        """Update a lead"""
+        try:
+            update_data['updated_at'] = datetime.now()
+            return self._change_lead(str(lead_id), update_data)
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error updating lead in SQLite: {str(e)}")
+            return False
+
+    def assign_lead_to_manager(self, lead_id, manager_username):
+        """Assign a lead to a specific manager"""
+        try:
+            if not self._change_lead(str(lead_id), {'assigned_to': manager_username, 'assigned_at': datetime.now()}):
+                logger.error(f"Lead not found with ID: {lead_id}")
+                return False
+            logger.info(f"Lead {lead_id} assigned to {manager_username}")
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error assigning lead {lead_id}: {str(e)}")
+            return False
+
+    def get_manager_leads(self, manager_username):
+        """Get all leads assigned to a specific manager"""
+        try:
+            rows = self._connection().execute(SELECT_LEADS + ' WHERE assigned_to = ?' + LEAD_ORDER,
+                                              (manager_username,)).fetchall()
+            return [_lead_json(lead_id, document) for lead_id, document in rows]
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching manager leads: {str(e)}")
+            return []
+
+    # Schema
+    def get_schema_version(self):
+        """Schema version stored in the file header (PRAGMA user_version)"""
+        try:
+            return self._connection().execute('PRAGMA user_version').fetchone()[0]
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error reading schema version: {str(e)}")
+            return None
+
+    # Lead rollup methods
+    def _update_rollups(self, connection, added=(), removed=()):
+        """Adjust the rollup counters in the same transaction as the lead write"""
+        connection.executemany(UPSERT_ROLLUP, [
+            (f"{dimension}:{value}", dimension, value, delta)
+            for (dimension, value), delta in rollup_changes(added, removed).items()
+        ])
+
+    def get_lead_rollups(self, date_from=None, date_to=None):
+        """{dimension: {value: count}} from the rollup counters; day buckets can be limited to a date range"""
+        try:
+            rollups = {}
+            for dimension, value, count in self._connection().execute(
+                    'SELECT dimension, value, count FROM lead_rollups WHERE count > 0'):
+                if dimension == 'day' and ((date_from and value < date_from) or (date_to and value > date_to)):
+                    continue
+                rollups.setdefault(dimension, {})[value] = count
+            return rollups
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching lead rollups: {str(e)}")
+            return None
+
+    def rebuild_lead_rollups(self):
+        """Recount every rollup bucket from the leads table. Returns the number of buckets."""
+        # Same buckets as lead_rollups.rollup_keys: missing, null and '' values count as MISSING
+        values = {field: f"COALESCE(NULLIF({field}, ''), '{MISSING}')" for field in ROLLUP_FIELDS}
+        values['total'] = "'all'"
+        values['day'] = f"COALESCE(substr(created_at, 1, 10), '{MISSING}')"
+        try:
+            with self._transaction() as connection:
+                connection.execute('DELETE FROM lead_rollups')
+                for dimension, value in values.items():
+                    connection.execute(
+                        f"INSERT INTO lead_rollups (id, dimension, value, count) "
+                        f"SELECT '{dimension}:' || {value}, '{dimension}', {value}, COUNT(*) FROM leads "
+                        f"GROUP BY {value} HAVING COUNT(*) > 0"
+                    )
+                return connection.execute('SELECT COUNT(*) FROM lead_rollups').fetchone()[0]
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error rebuilding lead rollups: {str(e)}")
+            return None
+
+    # Email outbox and lead queue: the same table layout, with different status names
+    def _enqueue(self, table, kind, payload, key=None):
+        now = _ts(datetime.now())
+        job_id = new_id()
+        inserted = self._connection().execute(
+            f"INSERT OR IGNORE INTO {table} (id, kind, payload, status, attempts, next_attempt_at, key, "
+            f"created_at, updated_at) VALUES (?, ?, ?, 'pending', 0, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload, default=json_default), now, key, now, now)
+        ).rowcount
+        return job_id if inserted else None
+
+    def _claim(self, table, active_status, worker_id, lease_seconds):
+        now = datetime.now()
+        rows = self._connection().execute(
+            f"UPDATE {table} SET status = ?, worker = ?, lease_expires_at = ?, updated_at = ?, "
+            f"attempts = attempts + 1 WHERE id = ("
+            f"SELECT id FROM {table} WHERE (status = 'pending' AND next_attempt_at <= ?) "
+            f"OR (status = ? AND lease_expires_at <= ?) ORDER BY next_attempt_at LIMIT 1"
+            f") RETURNING id, kind, payload, attempts, created_at",
+            (active_status, worker_id, _ts(now + timedelta(seconds=lease_seconds)), _ts(now),
+             _ts(now), active_status, _ts(now))
+        ).fetchall()
+        if not rows:
+            return None
+        job_id, kind, payload, attempts, created_at = rows[0]
+        return {'_id': job_id, 'kind': kind, 'payload': _loads(payload), 'attempts': attempts,
+                'created_at': _dt(created_at)}
+
+    def _finish(self, table, job_id, status, error=None, next_attempt_at=None):
+        now = datetime.now()
+        self._connection().execute(
+            f"UPDATE {table} SET status = ?, last_error = COALESCE(?, last_error), "
+            f"next_attempt_at = COALESCE(?, next_attempt_at), finished_at = ?, updated_at = ?, "
+            f"lease_expires_at = NULL, worker = NULL WHERE id = ?",
+            (status, error, _ts(next_attempt_at), _ts(now) if status in ('sent', 'done') else None,
+             _ts(now), job_id)
+        )
+        if status in ('sent', 'done'):
+            self._maybe_purge()
+
+    def _queue_stats(self, table):
+        return dict(self._connection().execute(f"SELECT status, COUNT(*) FROM {table} GROUP BY status"))
+
+    def enqueue_email(self, kind, payload):
+        """Add an email job to the outbox"""
+        try:
+            return self._enqueue('email_outbox', kind, payload)
+
+        except Exception as e:
+            logger.error(f"Error queueing email: {str(e)}")
+            raise
+
+    def claim_email_job(self, worker_id, lease_seconds=300):
+        """Atomically claim the next due email job (or one whose lease has expired)"""
+        try:
+            return self._claim('email_outbox', 'sending', worker_id, lease_seconds)
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error claiming email job: {str(e)}")
+            return None
+
+    def complete_email_job(self, job_id):
+        """Mark an email job as sent"""
+        try:
+            self._finish('email_outbox', job_id, 'sent')
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error completing email job {job_id}: {str(e)}")
+            return False
+
+    def retry_email_job(self, job_id, next_attempt_at, error):
+        """Put a failed email job back in the queue for a later attempt"""
+        try:
+            self._finish('email_outbox', job_id, 'pending', error, next_attempt_at)
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error rescheduling email job {job_id}: {str(e)}")
+            return False
+
+    def fail_email_job(self, job_id, error):
+        """Give up on an email job after too many attempts"""
+        try:
+            self._finish('email_outbox', job_id, 'failed', error)
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error failing email job {job_id}: {str(e)}")
+            return False
+
+    def get_email_outbox_stats(self):
+        """Count outbox jobs by status"""
+        try:
+            return self._queue_stats('email_outbox')
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching outbox stats: {str(e)}")
+            return {}
+
+    def enqueue_lead_job(self, kind, payload, key=None):
+        """Queue a lead for background processing. Returns False if a job with this key already exists."""
+        try:
+            return self._enqueue('lead_queue', kind, payload, key) is not None
+
+        except Exception as e:
+            logger.error(f"Error queueing lead: {str(e)}")
+            raise
+
+    def claim_lead_job(self, worker_id, lease_seconds=120):
+        """Atomically claim the next due lead job (or one whose lease has expired)"""
+        try:
+            return self._claim('lead_queue', 'processing', worker_id, lease_seconds)
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error claiming lead job: {str(e)}")
+            return None
+
+    def complete_lead_job(self, job_id):
+        """Mark a lead job as processed"""
+        try:
+            self._finish('lead_queue', job_id, 'done')
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error completing lead job {job_id}: {str(e)}")
+            return False
+
+    def retry_lead_job(self, job_id, next_attempt_at, error):
+        """Put a failed lead job back in the queue for a later attempt"""
+        try:
+            self._finish('lead_queue', job_id, 'pending', error, next_attempt_at)
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error rescheduling lead job {job_id}: {str(e)}")
+            return False
+
+    def fail_lead_job(self, job_id, error):
+        """Give up on a lead job after too many attempts (the payload is kept for recovery)"""
+        try:
+            self._finish('lead_queue', job_id, 'failed', error)
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error failing lead job {job_id}: {str(e)}")
+            return False
+
+    def get_lead_queue_stats(self):
+        """Count lead jobs by status, plus the age in seconds of the oldest unfinished job"""
+        try:
+            stats = self._queue_stats('lead_queue')
+            oldest = self._connection().execute(
+                "SELECT MIN(created_at) FROM lead_queue WHERE status IN ('pending', 'processing')"
+            ).fetchone()[0]
+            stats['oldest_pending_seconds'] = (
+                round((datetime.now() - _dt(oldest)).total_seconds(), 1) if oldest else 0
+            )
+            return stats
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching lead queue stats: {str(e)}")
+            return {}
+
+    # Shared geolocation cache methods
+    def get_cached_country(self, ip_address):
+        """Get a cached (country_code, country_name, expires_at) for an IP address"""
+        try:
+            entry = self._connection().execute(
+                'SELECT country_code, country_name, expires_at FROM geo_cache WHERE ip = ? AND expires_at > ?',
+                (ip_address, _ts(datetime.now()))
+            ).fetchone()
+            if entry:
+                return entry[0], entry[1], _dt(entry[2])
+            return None
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error reading geo cache: {str(e)}")
+            return None
+
+    def cache_country(self, ip_address, country_code, country_name, ttl_seconds):
+        """Store a geolocation result for all workers"""
+        try:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO geo_cache (ip, country_code, country_name, expires_at) VALUES (?, ?, ?, ?)',
+                (ip_address, country_code, country_name, _ts(datetime.now() + timedelta(seconds=ttl_seconds)))
+            )
+            self._maybe_purge()
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error writing geo cache: {str(e)}")
+            return False
+
+    def save_session(self, token, username, expires_at, role='manager'):
+        """Save user session"""
+        try:
+            self._connection().execute(
+                'INSERT INTO sessions (token, username, role, expires_at) VALUES (?, ?, ?, ?)',
+                (token, username, role, _ts(expires_at))
+            )
+            self._maybe_purge()
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error saving session: {str(e)}")
+            return False
+
+    def get_session(self, token):
+        """Get session by token"""
+        try:
+            session = self._connection().execute(
+                'SELECT username, role, expires_at FROM sessions WHERE token = ? AND expires_at > ?',
+                (token, _ts(datetime.now()))
+            ).fetchone()
+            if session:
+                return {'username': session[0], 'role': session[1], 'expires_at': _dt(session[2])}
+            return None
+
+        except Exception as e:
+            logger.error(f"Error fetching session: {str(e)}")
+            raise
+
+    def extend_sessions(self, expiries):
+        """Set new expiry times for several sessions at once ({token: expires_at})"""
+        try:
+            with self._transaction() as connection:
+                connection.executemany('UPDATE sessions SET expires_at = ? WHERE token = ?',
+                                       [(_ts(expires_at), token) for token, expires_at in expiries.items()])
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error extending sessions: {str(e)}")
+            return False
+
+    def delete_session(self, token):
+        """Delete session"""
+        try:
+            return self._connection().execute('DELETE FROM sessions WHERE token = ?', (token,)).rowcount > 0
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error deleting session: {str(e)}")
+            return False
+
+    def revoke_token(self, jti, expires_at):
+        """Add a signed token id to the revocation list"""
+        try:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO revoked_tokens (jti, expires_at, revoked_at) VALUES (?, ?, ?)',
+                (jti, _ts(expires_at), _ts(datetime.now()))
+            )
+            self._maybe_purge()
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error revoking token: {str(e)}")
+            return False
+
+    def get_revoked_tokens(self):
+        """Get {jti: expires_at} for revoked tokens that have not expired yet"""
+        try:
+            return {jti: _dt(expires_at) for jti, expires_at in self._connection().execute(
+                'SELECT jti, expires_at FROM revoked_tokens WHERE expires_at > ?', (_ts(datetime.now()),))}
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching revoked tokens: {str(e)}")
+            return None
+
+    def get_website_config(self):
+        """Get website configuration (including its version number)"""
+        try:
+            row = self._connection().execute(
+                "SELECT version, updated_at, document FROM website_config WHERE type = 'website'"
+            ).fetchone()
+            if row:
+                return {**_loads(row[2]), 'version': row[0], 'updated_at': _dt(row[1])}
+            return {'version': 0}
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching config: {str(e)}")
+            return None
+
+    def get_website_config_version(self):
+        """Get just the version number of the website configuration (0 if there is none yet)"""
+        try:
+            row = self._connection().execute("SELECT version FROM website_config WHERE type = 'website'").fetchone()
+            return row[0] if row else 0
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching config version: {str(e)}")
+            return None
+
+    def save_website_config(self, config_data, expected_version):
+        """
+        Replace the website configuration if it is still at expected_version.
+        Returns the new version, or None if another writer got there first.
+        """
+        try:
+            version = expected_version + 1
+            document = _dumps({key: value for key, value in config_data.items()
+                               if key not in ('type', 'version', 'updated_at')})
+            now = _ts(datetime.now())
+
+            if expected_version == 0:
+                saved = self._connection().execute(
+                    "INSERT OR IGNORE INTO website_config (type, version, updated_at, document) "
+                    "VALUES ('website', ?, ?, ?)", (version, now, document)).rowcount
+            else:
+                saved = self._connection().execute(
+                    "UPDATE website_config SET version = ?, updated_at = ?, document = ? "
+                    "WHERE type = 'website' AND version = ?", (version, now, document, expected_version)).rowcount
+            return version if saved else None
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error saving config: {str(e)}")
+            return None
+
+    # Manager user management methods
+    def create_manager(self, username, password_hash, email=''):
+        """Create a new manager user"""
+        try:
+            manager_data = {
+                'username': username,
+                'password_hash': password_hash,
+                'email': email,
+                'role': 'manager',
+                'created_at': datetime.now(),
+                'active': True
+            }
+
+            self._connection().execute('INSERT INTO users (id, username, role, document) VALUES (?, ?, ?, ?)',
+                                       (new_id(), username, 'manager', _dumps(manager_data)))
+            logger.info(f"Manager created: {username}")
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error creating manager: {str(e)}")
+            return False
+
+    def get_manager(self, username):
+        """Get manager by username"""
+        try:
+            row = self._connection().execute(
+                "SELECT id, document FROM users WHERE username = ? AND role = 'manager'", (username,)
+            ).fetchone()
+            return {'_id': row[0], **_loads(row[1])} if row else None
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching manager: {str(e)}")
+            return None
+
+    def get_all_managers(self):
+        """Get all manager users"""
+        try:
+            return [{'_id': user_id, **_loads(document)} for user_id, document in self._connection().execute(
+                "SELECT id, document FROM users WHERE role = 'manager' ORDER BY rowid")]
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error fetching managers: {str(e)}")
+            return []
+
+    def update_manager(self, username, update_data):
+        """Update manager information"""
+        try:
+            update_data['updated_at'] = datetime.now()
+
+            with self._transaction() as connection:
+                row = connection.execute("SELECT document FROM users WHERE username = ? AND role = 'manager'",
+                                         (username,)).fetchone()
+                if row is None:
+                    return False
+                manager = {**_loads(row[0]), **update_data}
+                connection.execute('UPDATE users SET username = ?, role = ?, document = ? WHERE username = ?',
+                                   (manager['username'], manager['role'], _dumps(manager), username))
+            return True
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error updating manager: {str(e)}")
+            return False
+
+    def delete_manager(self, username):
+        """Delete a manager user"""
+        try:
+            return self._connection().execute("DELETE FROM users WHERE username = ? AND role = 'manager'",
+                                              (username,)).rowcount > 0
+
+        except Exception as e:
+            self._record_error(e)
+            logger.error(f"Error deleting manager: {str(e)}")
+            return False
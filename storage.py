@@ -0,0 +1,446 @@
+"""
+Storage Interface for Dubai Smart Investment
+The methods the app, the background workers and the command line tools call
+on `db`. Two backends implement it:
+
+    Database         (database.py)      MongoDB, the production backend
+    SQLiteDatabase   (sqlite_store.py)  one SQLite file in WAL mode, for
+                                        single-node deployments, CI and benchmarks
+
+The backend is chosen by DATABASE_URL:
+
+    DATABASE_URL=sqlite:///leads.db            relative path
+    DATABASE_URL=sqlite:////var/data/leads.db  absolute path
+    DATABASE_URL=mongodb+srv://...             MongoDB at this URI
+    (unset or another scheme)                  MongoDB at MONGODB_URI
+
+Ids (leads, jobs, managers) are strings outside the backend; a lead passed to
+save_lead, save_lead_once or insert_leads with an '_id' (from new_id()) is
+stored under that id. Timestamps are naive local datetimes, like datetime.now().
+Storage is an abstract base class: a backend that is missing one of its methods
+raises TypeError when it is created, not when the method is first called.
+Methods marked returns_on_error log a database error and return that value
+(passing the error to _record_error); the others raise.
+
+Time the common operations on a backend (the benchmark leads and sessions are
+deleted again afterwards):
+    python storage.py bench --url sqlite:///bench.db
+    python storage.py bench --url "$MONGODB_URI" -n 500
+"""
+import os
+import sys
+import time
+import secrets
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import logging
+
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+SQLITE_SCHEME = 'sqlite:'
+MONGODB_SCHEMES = ('mongodb:', 'mongodb+srv:')
+
+def new_id():
+    """A new document id (ObjectId hex, so ids sort by creation time on both backends)"""
+    return str(ObjectId())
+
+def json_default(value):
+    """json.dumps default for stored documents: datetimes as {'$date': ISO text}, ObjectIds as strings"""
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat(timespec='microseconds')}
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot store {type(value).__name__} as JSON")
+
+def json_object_hook(obj):
+    """json.loads object_hook that turns {'$date': ...} back into a datetime"""
+    if len(obj) == 1 and '$date' in obj:
+        return datetime.fromisoformat(obj['$date'])
+    return obj
+
+# The error a backend method logged and answered with its failure value, per thread
+_swallowed = threading.local()
+# Guards the default, in-memory migration lock (Storage.acquire_migration_lock)
+_migration_lock_guard = threading.Lock()
+
+def returns_on_error(value):
+    """Mark a Storage method that logs its errors and returns value instead of raising"""
+    def mark(method):
+        method.on_error = value
+        return method
+    return mark
+
+def bulk_operation(method):
+    """Mark a Storage method that is slow by design (whole collection, import batches): the breaker only counts its errors"""
+    method.bulk = True
+    return method
+
+def take_swallowed_error():
+    """The error the last backend call in this thread noted with _record_error (cleared)"""
+    error = getattr(_swallowed, 'error', None)
+    _swallowed.error = None
+    return error
+
+class Storage(ABC):
+    # Short backend name for the health check ('mongodb' or 'sqlite')
+    backend = None
+    # Database name (MongoDB) or file path (SQLite)
+    name = None
+    # Applied schema version, checked against migrations.LATEST_VERSION
+    schema_version = None
+    # True when the backend creates its own schema and migrations.py has nothing to apply
+    manages_schema = False
+
+    def _record_error(self, error):
+        # Called where a method logs an error and returns its failure value, so that the
+        # breaker around db (database.LazyDatabase) still counts the call as failed
+        _swallowed.error = error
+
+    # Leads
+    @abstractmethod
+    def save_lead(self, lead_data):
+        """Save a new lead (under lead_data['_id'] if set); returns its id (raises on failure)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_lead_once(self, lead_data):
+        """Save a lead with a source and lead_id unless it is already stored; returns its id or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @bulk_operation
+    def insert_leads(self, leads):
+        """Insert a batch of leads; returns {index: (error_code, message)} for those not inserted"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @bulk_operation
+    @returns_on_error([])
+    def get_all_leads(self):
+        """Every lead, newest first, with a string '_id' and a 'timestamp'"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_leads_page(self, filters=None, limit=50, cursor=None, fields=None):
+        """One page of leads, newest first; returns (leads, next_cursor)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @bulk_operation
+    def iter_leads(self, filters=None, fields=None, batch_size=1000):
+        """Iterate over the leads matching the filters, newest first"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def update_lead(self, lead_id, update_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def delete_lead(self, lead_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    @bulk_operation
+    @returns_on_error(0)
+    def delete_leads_bulk(self, lead_ids):
+        """Delete several leads; returns how many were deleted"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def assign_lead_to_manager(self, lead_id, manager_username):
+        raise NotImplementedError
+
+    @abstractmethod
+    @bulk_operation
+    @returns_on_error([])
+    def get_manager_leads(self, manager_username):
+        """Leads assigned to a manager, newest first, shaped like get_all_leads"""
+        raise NotImplementedError
+
+    # Lead rollups
+    @abstractmethod
+    @returns_on_error(None)
+    def get_lead_rollups(self, date_from=None, date_to=None):
+        """{dimension: {value: count}}, or None on error"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @bulk_operation
+    @returns_on_error(None)
+    def rebuild_lead_rollups(self):
+        """Recount the rollups from the leads; returns the number of buckets, or None on error"""
+        raise NotImplementedError
+
+    # Sessions and revoked tokens
+    @abstractmethod
+    @returns_on_error(False)
+    def save_session(self, token, username, expires_at, role='manager'):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_session(self, token):
+        """{'username', 'role', 'expires_at'} for an unexpired session, or None (raises if it can't be read)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def extend_sessions(self, expiries):
+        """Set new expiry times for several sessions ({token: expires_at})"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def delete_session(self, token):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def revoke_token(self, jti, expires_at):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(None)
+    def get_revoked_tokens(self):
+        """{jti: expires_at} for revoked tokens that have not expired, or None on error"""
+        raise NotImplementedError
+
+    # Website configuration
+    @abstractmethod
+    @returns_on_error(None)
+    def get_website_config(self):
+        """The configuration with its 'version' ({'version': 0} if there is none), or None on error"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(None)
+    def get_website_config_version(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(None)
+    def save_website_config(self, config_data, expected_version):
+        """Replace the configuration if it is still at expected_version; returns the new version or None"""
+        raise NotImplementedError
+
+    # Managers
+    @abstractmethod
+    @returns_on_error(False)
+    def create_manager(self, username, password_hash, email=''):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(None)
+    def get_manager(self, username):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error([])
+    def get_all_managers(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def update_manager(self, username, update_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def delete_manager(self, username):
+        raise NotImplementedError
+
+    # Email outbox and lead queue (outbox.py, lead_queue.py)
+    @abstractmethod
+    def enqueue_email(self, kind, payload):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(None)
+    def claim_email_job(self, worker_id, lease_seconds=300):
+        """The next due job with '_id', 'kind', 'payload', 'attempts', 'created_at'; None if none is due"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def complete_email_job(self, job_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def retry_email_job(self, job_id, next_attempt_at, error):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def fail_email_job(self, job_id, error):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error({})
+    def get_email_outbox_stats(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def enqueue_lead_job(self, kind, payload, key=None):
+        """Queue a lead job; returns False if a job with this key already exists"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(None)
+    def claim_lead_job(self, worker_id, lease_seconds=120):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def complete_lead_job(self, job_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def retry_lead_job(self, job_id, next_attempt_at, error):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def fail_lead_job(self, job_id, error):
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error({})
+    def get_lead_queue_stats(self):
+        raise NotImplementedError
+
+    # Shared geolocation cache
+    @abstractmethod
+    @returns_on_error(None)
+    def get_cached_country(self, ip_address):
+        """(country_code, country_name, expires_at) for an unexpired entry, or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    @returns_on_error(False)
+    def cache_country(self, ip_address, country_code, country_name, ttl_seconds):
+        raise NotImplementedError
+
+    # Schema (migrations.py). A backend with manages_schema = False keeps its own migration
+    # records and lock; the defaults below serve one that creates its schema when it is opened
+    @abstractmethod
+    @returns_on_error(None)
+    def get_schema_version(self):
+        raise NotImplementedError
+
+    @returns_on_error(None)
+    def get_applied_migrations(self):
+        """{version: record} for every applied migration: by default every version up to get_schema_version"""
+        version = self.get_schema_version()
+        if version is None:
+            return None
+        return {applied: {'version': applied} for applied in range(1, version + 1)}
+
+    @returns_on_error(False)
+    def record_migration(self, version, name, duration_ms):
+        """Mark a migration as applied (by default nothing to record: get_schema_version tells)"""
+        return True
+
+    @returns_on_error(False)
+    def acquire_migration_lock(self, owner, lock_seconds):
+        """Take the migration lock; False if someone else holds it (by default held by this instance)"""
+        with _migration_lock_guard:
+            holder = getattr(self, '_migration_lock', None)
+            if holder is not None and holder[0] != owner and holder[1] > time.monotonic():
+                return False
+            self._migration_lock = (owner, time.monotonic() + lock_seconds)
+            return True
+
+    @returns_on_error(False)
+    def release_migration_lock(self, owner):
+        with _migration_lock_guard:
+            if getattr(self, '_migration_lock', (None,))[0] == owner:
+                self._migration_lock = None
+            return True
+
+def database_configured():
+    """True when DATABASE_URL or MONGODB_URI names a database to connect to"""
+    url = os.environ.get('DATABASE_URL', '')
+    return url.startswith((SQLITE_SCHEME, *MONGODB_SCHEMES)) or bool(os.environ.get('MONGODB_URI'))
+
+def open_database(url=None, verify_schema=True):
+    """Connect the backend chosen by url (default: DATABASE_URL, then MONGODB_URI)"""
+    url = url if url is not None else os.environ.get('DATABASE_URL', '')
+
+    if url.startswith(SQLITE_SCHEME):
+        from sqlite_store import SQLiteDatabase
+        return SQLiteDatabase(url)
+
+    if url and not url.startswith(MONGODB_SCHEMES):
+        # e.g. a DATABASE_URL the host sets for an attached PostgreSQL database
+        logger.warning(f"Ignoring DATABASE_URL with unsupported scheme '{url.split(':', 1)[0]}', using MONGODB_URI")
+        url = ''
+
+    from database import Database
+    return Database(verify_schema=verify_schema, mongo_uri=url or None)
+
+BENCH_SOURCE = 'Storage Benchmark'
+
+def _timed(fn, count):
+    """Per-call latencies in milliseconds"""
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def run_benchmark(database, count=1000):
+    """{operation: (mean_ms, p99_ms)} for lead, page and session operations"""
+    lead_ids, tokens = [], []
+    expires_at = datetime.now() + timedelta(hours=1)
+
+    def save_lead(i):
+        lead_ids.append(database.save_lead({'email': f"bench{i}@example.com", 'country': 'UAE', 'source': BENCH_SOURCE}))
+
+    def save_session(i):
+        tokens.append(secrets.token_urlsafe(16))
+        database.save_session(tokens[-1], 'bench', expires_at)
+
+    operations = [
+        ('save_lead', save_lead),
+        ('update_lead', lambda i: database.update_lead(lead_ids[i], {'status': 'contacted'})),
+        ('get_leads_page(50)', lambda i: database.get_leads_page({'source': BENCH_SOURCE}, limit=50)),
+        ('save_session', save_session),
+        ('get_session', lambda i: database.get_session(tokens[i])),
+    ]
+    try:
+        results = {}
+        for name, fn in operations:
+            latencies = sorted(_timed(fn, count))
+            results[name] = (sum(latencies) / count, latencies[min(int(count * 0.99), count - 1)])
+        return results
+    finally:
+        database.delete_leads_bulk([lead_id for lead_id in lead_ids if lead_id])
+        for token in tokens:
+            database.delete_session(token)
+
+def main():
+    parser = argparse.ArgumentParser(description='Storage backend tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench = commands.add_parser('bench', help='Time lead and session operations')
+    bench.add_argument('--url', help='Default: DATABASE_URL, then MONGODB_URI')
+    bench.add_argument('-n', '--count', type=int, default=1000, help='Calls per operation')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    database = open_database(args.url, verify_schema=False)
+    print(f"Benchmarking {database.backend} ({database.name}), {args.count} calls per operation")
+    for name, (mean, p99) in run_benchmark(database, args.count).items():
+        print(f"  {name:<20} mean {mean:8.3f} ms   p99 {p99:8.3f} ms")
+    print("✅ Benchmark finished")
+
+if __name__ == '__main__':
+    sys.exit(main())
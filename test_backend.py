@@ -7,9 +7,12 @@ This script tests the backend functionality without requiring the server to be r
 import json
 import sys
 import os
+import tempfile
 
 # Add current directory to path to import app
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Leads the test can't store are spooled in a temporary directory, never the app's spool/
+os.environ['LEAD_SPOOL_DIR'] = tempfile.mkdtemp()
 
 def test_email_validation():
     """Test email validation function"""
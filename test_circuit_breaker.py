@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Tests for the circuit breakers (circuit_breaker.py): opening after repeated
+failures or slow calls, half-open probes, and how the database wrapper
+(database.LazyDatabase) behaves while its breaker is open.
+Run with python test_circuit_breaker.py or python -m pytest test_circuit_breaker.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+# Add current directory to path to import circuit_breaker
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from database import LazyDatabase
+from sqlite_store import SQLiteDatabase
+
+def fail():
+    raise RuntimeError('connection refused')
+
+def test_opens_after_failures():
+    """Test that the breaker opens after failure_threshold failures in a row"""
+    print("Testing failures...")
+
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        try:
+            breaker.call(fail)
+        except RuntimeError:
+            pass
+    # A success resets the count
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED and breaker.status()['consecutive_failures'] == 0
+
+    for _ in range(3):
+        try:
+            breaker.call(fail)
+        except RuntimeError:
+            pass
+    assert breaker.state == OPEN
+    print("✅ Opens after 3 failures in a row, not after 2 and a success")
+
+    try:
+        breaker.call(lambda: 'not called')
+        assert False, 'call let through an open breaker'
+    except CircuitOpenError as e:
+        assert 'connection refused' in str(e)
+    status = breaker.status()
+    assert status['rejected'] == 1 and status['opened'] == 1 and 0 < status['retry_in'] <= 60
+    print("✅ Open breaker refuses calls with CircuitOpenError")
+
+def test_slow_calls_and_ignored_errors():
+    """Test that slow calls count as failures and ignored errors don't"""
+    print("\nTesting slow calls and ignored errors...")
+
+    breaker = CircuitBreaker('test', failure_threshold=2, slow_call_seconds=0.01, ignore=(ValueError,))
+    breaker.call(time.sleep, 0.02)
+    assert breaker.status()['slow_calls'] == 1 and breaker.state == CLOSED
+
+    for _ in range(3):
+        try:
+            breaker.call(int, 'not a number')
+        except ValueError:
+            pass
+    assert breaker.status()['consecutive_failures'] == 1
+    print("✅ Ignored errors neither fail nor reset the breaker")
+
+    breaker.call(time.sleep, 0.02)
+    assert breaker.state == OPEN
+    print("✅ Slow calls open the breaker")
+
+def test_half_open_probe():
+    """Test that one probe is let through after reset_timeout and decides the state"""
+    print("\nTesting half-open probes...")
+
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure('down')
+    assert breaker.state == OPEN and not breaker.available()
+
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure('still down')
+    assert breaker.state == OPEN
+    print("✅ One probe allowed; a failed probe opens the breaker again")
+
+    time.sleep(0.06)
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED and breaker.available()
+    print("✅ A successful probe closes the breaker")
+
+def broken_database():
+    database = SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'breaker.db'))
+
+    def unavailable():
+        raise RuntimeError('disk I/O error')
+
+    database._connection = unavailable
+    return database
+
+def test_database_wrapper():
+    """Test that errors a backend swallows open the breaker, and what an open breaker returns"""
+    print("\nTesting the database breaker...")
+
+    breaker = CircuitBreaker('test-database', failure_threshold=2, reset_timeout=60)
+    db = LazyDatabase(factory=broken_database, breaker=breaker)
+
+    assert db.get_website_config_version() is None
+    assert breaker.status()['consecutive_failures'] == 1
+    assert db.get_email_outbox_stats() == {}
+    assert breaker.state == OPEN
+    print("✅ Logged and swallowed database errors count as failures")
+
+    assert db.get_website_config_version() is None
+    assert db.get_all_leads() == [] and db.update_lead('1', {}) is False and db.delete_leads_bulk(['1']) == 0
+    try:
+        db.save_lead({'email': 'lead@example.com'})
+        assert False, 'save_lead called through an open breaker'
+    except CircuitOpenError:
+        pass
+    assert breaker.status()['rejected'] == 5
+    print("✅ Open breaker returns each method's failure value; methods that raise on errors raise")
+
+def test_bulk_calls_not_slow():
+    """Test that methods slow by design don't open the database breaker by taking long"""
+    print("\nTesting bulk calls...")
+
+    database = SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'breaker.db'))
+    breaker = CircuitBreaker('test-bulk', failure_threshold=1, slow_call_seconds=0.01)
+    db = LazyDatabase(factory=lambda: database, breaker=breaker)
+
+    def slow(result):
+        def call(*args, **kwargs):
+            time.sleep(0.02)
+            return result
+        return call
+
+    database.get_all_leads = slow([])
+    database.rebuild_lead_rollups = slow(0)
+    assert db.get_all_leads() == [] and db.rebuild_lead_rollups() == 0
+    assert breaker.state == CLOSED and breaker.status()['slow_calls'] == 0
+    print("✅ Slow get_all_leads and rebuild_lead_rollups don't count as slow")
+
+    database.get_website_config_version = slow(0)
+    db.get_website_config_version()
+    assert breaker.state == OPEN and breaker.status()['slow_calls'] == 1
+    print("✅ Other methods keep the slow-call threshold")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Circuit Breaker Tests")
+    print("=" * 50)
+
+    test_opens_after_failures()
+    test_slow_calls_and_ignored_errors()
+    test_half_open_probe()
+    test_database_wrapper()
+    test_bulk_calls_not_slow()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline GeoIP table (geoip.py): building a table from each CSV
+row format and looking addresses up in it.
+Run with python test_geoip.py or python -m pytest test_geoip.py
+"""
+
+import os
+import sys
+import tempfile
+
+# Add current directory to path to import geoip
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from geoip import GeoIPTable, build_table, load_table, parse_row, most_specific_ranges
+
+CSV_ROWS = """network,country_code,country_name
+# comment rows and unknown countries are skipped
+1.0.0.0/24,AU,Australia
+5.0.0.0,5.0.255.255,AE,United Arab Emirates
+"16777472","16778239","CN","China"
+2001:db8::/32,DE,Germany
+10.0.0.0/8,-,Unknown
+5.0.1.0/24,FR,France
+not-an-address,XX,Nowhere
+"""
+
+FAMILY_ROWS = """ip_from,ip_to,family,country_code,country_name
+"16777216","16777471","4","AU","Australia"
+"16777216","16777471","6","DE","Germany"
+"281470698652416","281470698652671","ipv6","JP","Japan"
+"1","2","ipx","XX","Nowhere"
+"""
+
+def build(csv_text, family=None):
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, 'ranges.csv')
+    table_path = os.path.join(directory, 'geoip.bin')
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write(csv_text)
+    counts = build_table(csv_path, table_path, family)
+    return table_path, counts
+
+def test_parse_row():
+    """Test each supported CSV row format"""
+    print("Testing CSV row parsing...")
+
+    first, last, code, name = parse_row(['1.0.0.0/24', 'au', 'Australia'])
+    assert (str(first), str(last), code, name) == ('1.0.0.0', '1.0.0.255', 'AU', 'Australia')
+
+    first, last, code, name = parse_row(['16777216', '16777471', 'AU', ''])
+    assert (str(first), str(last), name) == ('1.0.0.0', '1.0.0.255', 'AU')
+
+    assert parse_row(['# comment']) is None
+    assert parse_row(['1.0.0.9', '1.0.0.1', 'AU', 'Australia']) is None
+    assert parse_row(['1.0.0.0', '2001:db8::', 'AU', 'Australia']) is None
+    assert parse_row(['1.0.0.0/24', '-', '-']) is None
+    print("✅ CIDR, first/last and integer rows parsed; invalid rows skipped")
+
+    first, last, _, _ = parse_row(['16777216', '16777471', 'DE', 'Germany'], family=6)
+    assert (str(first), str(last)) == ('::100:0', '::100:ff')
+    first, last, _, _ = parse_row(['0', '281470681743359', 'DE', 'Germany'])
+    assert (first.version, last.version) == (6, 6)
+    first, last, code, _ = parse_row(['16777216', '16777471', 'ipv6', 'DE', 'Germany'], family_column=2)
+    assert (str(first), code) == ('::100:0', 'DE')
+    first, last, _, _ = parse_row(['::ffff:1.0.0.0', '::ffff:1.0.0.255', 'AU', 'Australia'])
+    assert (str(first), str(last)) == ('1.0.0.0', '1.0.0.255')
+    print("✅ Integer rows read as IPv6 by family, column or size; IPv4-mapped ranges stored as IPv4")
+
+def test_most_specific_ranges():
+    """Test that nested ranges split the range enclosing them"""
+    print("\nTesting overlapping ranges...")
+
+    assert most_specific_ranges([(0, 99, 'A'), (10, 19, 'B'), (15, 16, 'C'), (50, 59, 'A')]) == [
+        (0, 9, 'A'), (10, 14, 'B'), (15, 16, 'C'), (17, 19, 'B'), (20, 99, 'A')]
+    # Partial overlaps go to the smaller range, ties to the first listed
+    assert most_specific_ranges([(0, 9, 'A'), (5, 19, 'B'), (30, 39, 'C'), (30, 39, 'D')]) == [
+        (0, 9, 'A'), (10, 19, 'B'), (30, 39, 'C')]
+    assert most_specific_ranges([]) == []
+    print("✅ The smallest range containing an address wins")
+
+def test_build_and_lookup():
+    """Test building a table and looking up IPv4, IPv6 and IPv4-mapped addresses"""
+    print("\nTesting table build and lookup...")
+
+    table_path, (v4, v6, countries, skipped) = build(CSV_ROWS)
+    # The FR range nested in the AE range splits it in two
+    assert (v4, v6, countries) == (5, 1, 5)
+    # Header, comment, unknown country and bad address
+    assert skipped == 4
+
+    table = GeoIPTable(table_path)
+    try:
+        assert table.lookup('1.0.0.1') == ('AU', 'Australia')
+        assert table.lookup('1.0.0.255') == ('AU', 'Australia')
+        assert table.lookup('1.0.1.0') == ('CN', 'China')
+        assert table.lookup('5.0.1.7') == ('FR', 'France')
+        assert table.lookup('5.0.0.255') == ('AE', 'United Arab Emirates')
+        assert table.lookup('5.0.2.0') == ('AE', 'United Arab Emirates')
+        assert table.lookup(' 2001:db8::1 ') == ('DE', 'Germany')
+        assert table.lookup('::ffff:1.0.0.7') == ('AU', 'Australia')
+        assert table.lookup('0.255.255.255') is None
+        assert table.lookup('10.1.2.3') is None
+        assert table.lookup('2001:db9::1') is None
+        assert table.lookup('not an ip') is None
+    finally:
+        table.close()
+    print("✅ Addresses found in the right ranges, gaps and bad input return None")
+
+    table_path, (v4, v6, _, skipped) = build(FAMILY_ROWS)
+    assert (v4, v6, skipped) == (2, 1, 2)
+    table = GeoIPTable(table_path)
+    try:
+        assert table.lookup('1.0.0.1') == ('AU', 'Australia')
+        assert table.lookup('::100:1') == ('DE', 'Germany')
+        assert table.lookup('1.2.3.4') == ('JP', 'Japan')
+    finally:
+        table.close()
+
+    table_path, (v4, v6, _, _) = build('"16777216","16777471","DE","Germany"\n', family=6)
+    assert (v4, v6) == (0, 1)
+    print("✅ Integer rows placed by the family column or the --family option")
+
+def test_load_table():
+    """Test that a missing or corrupt table is reported as None"""
+    print("\nTesting table loading...")
+
+    assert load_table('') is None
+    assert load_table(os.path.join(tempfile.mkdtemp(), 'missing.bin')) is None
+
+    corrupt = os.path.join(tempfile.mkdtemp(), 'corrupt.bin')
+    with open(corrupt, 'wb') as f:
+        f.write(b'NOTGEOIP' + b'\0' * 32)
+    assert load_table(corrupt) is None
+
+    table_path, _ = build(CSV_ROWS)
+    table = load_table(table_path)
+    assert table is not None and table.lookup('1.0.0.1') == ('AU', 'Australia')
+    table.close()
+    print("✅ Missing and corrupt tables load as None")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("GeoIP Table Tests")
+    print("=" * 50)
+
+    test_parse_row()
+    test_most_specific_ranges()
+    test_build_and_lookup()
+    test_load_table()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
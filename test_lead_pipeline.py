@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Tests for the concurrent lead pipeline (lead_pipeline.py) and the contact form
+built on it (app.handle_contact_form): per-stage deadlines and timings, the
+country looked up before the save, and a late lookup filling the country in
+afterwards, in the database or in the spool.
+Leads are stored in a temporary SQLite database (sqlite_store.py).
+Run with python test_lead_pipeline.py or python -m pytest test_lead_pipeline.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Add current directory to path to import app
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Leads the test can't store are spooled in a temporary directory, never the app's spool/
+os.environ['LEAD_SPOOL_DIR'] = tempfile.mkdtemp()
+
+import app as app_module
+from lead_pipeline import LeadPipeline
+from lead_spool import LeadSpool
+from sqlite_store import SQLiteDatabase
+
+FORM = {
+    'firstName': 'Ann', 'lastName': 'Lee', 'email': 'ann@example.com', 'whatsapp': '+971501234567',
+    'country': 'UAE', 'contactMethod': 'WhatsApp', 'timeframe': 'Now'
+}
+
+def temporary_database():
+    return SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'pipeline.db'))
+
+def wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+@contextmanager
+def contact_form(database, lookup, write=None):
+    """The app with database, a country lookup, a spool and recorded emails; yields (client, emails, spool)"""
+    emails = []
+    spool = LeadSpool(database, write or app_module.write_lead, directory=tempfile.mkdtemp(),
+                      on_saved=lambda lead: emails.append(lead['email']))
+    attributes = {
+        'db': database,
+        'lead_spool': spool,
+        'get_country_from_ip': lookup,
+        'queue_lead_emails': lambda form_data, client=None: emails.append(form_data['email']) or True,
+        'lead_pipeline': LeadPipeline(timeouts={'geolocation': 0.05, 'save': 5, 'emails': 5}),
+        # No outbox, lead queue or spool replayer threads
+        '_background_pid': os.getpid(),
+    }
+    original = {name: getattr(app_module, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(app_module, name, value)
+    try:
+        with app_module.app.test_client() as client:
+            yield client, emails, spool
+    finally:
+        for name, value in original.items():
+            setattr(app_module, name, value)
+
+def test_stage_deadlines():
+    """Test that stages report their timings and a late or failing stage is degraded"""
+    print("Testing stage deadlines...")
+
+    pipeline = LeadPipeline(workers=4, timeouts={'slow': 0.05})
+    run = pipeline.start()
+    release = threading.Event()
+    fast = run.submit('fast', lambda: 'ok')
+    slow = run.submit('slow', release.wait, 5)
+    broken = run.submit('broken', lambda: 1 / 0)
+
+    assert run.result(fast) == 'ok'
+    assert run.result(slow, default='late') == 'late'
+    assert run.result(broken) is None
+    release.set()
+
+    timing = run.finish()
+    assert timing['stages']['fast'] is not None and timing['stages']['slow'] is None
+    assert timing['degraded'] == ['slow', 'broken']
+    assert pipeline.stats['timeouts'] == {'slow': 1} and pipeline.stats['errors'] == {'broken': 1}
+    assert pipeline.stats['degraded_runs'] == 1
+    print("✅ Timings per stage, late and failing stages degraded")
+
+def test_country_before_save():
+    """Test that a lookup within its deadline is saved with the lead, without a second write"""
+    print("\nTesting the country lookup...")
+
+    database = temporary_database()
+    updates = []
+    update_lead = database.update_lead
+    database.update_lead = lambda lead_id, fields: updates.append(fields) or update_lead(lead_id, fields)
+
+    with contact_form(database, lambda ip: ('IN', 'India')) as (client, emails, _):
+        response = client.post('/api/contact', json=FORM)
+    body = response.get_json()
+    assert response.status_code == 200 and body['emails_queued'] and emails == ['ann@example.com']
+    assert body['timing']['stages']['geolocation'] is not None and body['timing']['degraded'] == []
+
+    lead = database.get_all_leads()[0]
+    assert lead['detected_country'] == 'India' and updates == []
+    print("✅ Lead saved once with its country, geolocation timed in the response")
+
+def test_late_country():
+    """Test that a lookup that misses its deadline fills the country in afterwards"""
+    print("\nTesting a late lookup...")
+
+    database = temporary_database()
+    release = threading.Event()
+
+    def slow_lookup(ip):
+        release.wait(5)
+        return 'IN', 'India'
+
+    with contact_form(database, slow_lookup) as (client, emails, _):
+        body = client.post('/api/contact', json=FORM).get_json()
+        assert body['success'] and body['timing']['degraded'] == ['geolocation']
+        assert body['timing']['stages']['geolocation'] is None
+        assert database.get_all_leads()[0]['detected_country'] == 'Unknown'
+        assert emails == ['ann@example.com']
+
+        release.set()
+        assert wait_for(lambda: database.get_all_leads()[0]['detected_country'] == 'India')
+    print("✅ Lead saved as Unknown, country filled in when the lookup finished")
+
+def test_late_country_spooled():
+    """Test that a spooled lead gets its late country and its emails once it is replayed"""
+    print("\nTesting a late lookup for a spooled lead...")
+
+    database = temporary_database()
+    release = threading.Event()
+
+    def slow_lookup(ip):
+        release.wait(5)
+        return 'IN', 'India'
+
+    def unavailable(lead):
+        raise RuntimeError('database unavailable')
+
+    with contact_form(database, slow_lookup, write=unavailable) as (client, emails, spool):
+        body = client.post('/api/contact', json=FORM).get_json()
+        assert body['success'] and body['emails_queued'] is False and emails == []
+
+        # The late country is journalled in the spool
+        size = spool.pending_bytes()
+        release.set()
+        assert wait_for(lambda: spool.pending_bytes() > size)
+
+        assert spool.replay() == 1
+    lead = database.get_all_leads()[0]
+    assert lead['detected_country'] == 'India' and emails == ['ann@example.com']
+    print("✅ Country and emails follow the lead out of the spool")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Lead Pipeline Tests")
+    print("=" * 50)
+
+    test_stage_deadlines()
+    test_country_before_save()
+    test_late_country()
+    test_late_country_spooled()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests for the lead processing queue (lead_queue.py): processing jobs, keyed
+jobs only being queued once, retries with backoff, giving up after
+max_attempts, and reclaiming jobs whose lease expired.
+The jobs are stored in a temporary SQLite database (sqlite_store.py).
+Run with python test_lead_queue.py or python -m pytest test_lead_queue.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+# Add current directory to path to import the lead queue
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lead_queue import LeadQueue
+from sqlite_store import SQLiteDatabase
+
+def temporary_database():
+    return SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'lead_queue.db'))
+
+def test_process_and_dedupe():
+    """Test that queued jobs are processed once and keyed jobs are only queued once"""
+    print("Testing job processing...")
+
+    database = temporary_database()
+    processed = []
+    queue = LeadQueue(database, {'contact': processed.append}, workers=0)
+
+    assert queue.enqueue('contact', {'email': 'a@example.com'}) is True
+    assert queue.enqueue('contact', {'email': 'b@example.com'}, key='google_ads:1') is True
+    assert queue.enqueue('contact', {'email': 'b@example.com'}, key='google_ads:1') is False
+
+    assert queue.drain() == 2
+    assert sorted(job['email'] for job in processed) == ['a@example.com', 'b@example.com']
+    assert database.get_lead_queue_stats()['done'] == 2
+    assert queue.stats['processed'] == 2 and queue.stats['last_lag_seconds'] is not None
+    print("✅ Jobs processed once, duplicate key refused")
+
+    try:
+        queue.enqueue('unknown', {})
+        assert False, 'unknown kind was queued'
+    except ValueError:
+        print("✅ Unknown job kind refused")
+
+def test_retry_and_give_up():
+    """Test backoff retries and that a job fails permanently after max_attempts"""
+    print("\nTesting retries...")
+
+    database = temporary_database()
+    attempts = []
+
+    def flaky(payload):
+        attempts.append(payload['email'])
+        if len(attempts) < 3:
+            raise RuntimeError('database unavailable')
+
+    def broken(payload):
+        raise RuntimeError('always fails')
+
+    queue = LeadQueue(database, {'flaky': flaky, 'broken': broken}, workers=0, max_attempts=3, base_delay=0)
+    queue.enqueue('flaky', {'email': 'a@example.com'})
+    queue.enqueue('broken', {})
+
+    # base_delay=0: a failed job is due again straight away
+    while queue.process_next():
+        pass
+    assert attempts == ['a@example.com'] * 3
+    stats = database.get_lead_queue_stats()
+    assert (stats['done'], stats['failed']) == (1, 1)
+    assert (queue.stats['processed'], queue.stats['retried'], queue.stats['failed']) == (1, 4, 1)
+    print("✅ Failing job retried until it worked, broken job failed after max_attempts")
+
+    queue.base_delay, queue.max_delay = 10, 50
+    assert [queue.retry_delay(attempts) for attempts in (1, 2, 3, 4)] == [10, 20, 40, 50]
+
+    queue.enqueue('broken', {})
+    assert queue.process_next() is True
+    # Rescheduled 10 seconds out, so nothing is due now
+    assert queue.process_next() is False
+    print("✅ Backoff doubles up to max_delay and delays the next attempt")
+
+def test_expired_lease():
+    """Test that a job claimed by a worker that died is claimed again once its lease expires"""
+    print("\nTesting leases...")
+
+    database = temporary_database()
+    processed = []
+    queue = LeadQueue(database, {'contact': processed.append}, workers=0, lease_seconds=60)
+    queue.enqueue('contact', {'email': 'a@example.com'})
+
+    assert database.claim_lead_job('dead-worker', lease_seconds=0) is not None
+    time.sleep(0.01)
+    assert queue.process_next() is True
+    assert processed == [{'email': 'a@example.com'}]
+
+    queue.enqueue('contact', {'email': 'b@example.com'})
+    assert database.claim_lead_job('busy-worker', lease_seconds=60) is not None
+    assert queue.process_next() is False
+    print("✅ Expired lease reclaimed, live lease left alone")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Lead Queue Tests")
+    print("=" * 50)
+
+    test_process_and_dedupe()
+    test_retry_and_give_up()
+    test_expired_lease()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
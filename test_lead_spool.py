@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Tests for the lead spool (lead_spool.py): leads the database can't take in
+time are journalled and replayed exactly once, late writes and repeated
+replays are skipped as duplicates, and on_saved only reports leads that were
+stored as new.
+Leads are stored in a temporary SQLite database (sqlite_store.py).
+Run with python test_lead_spool.py or python -m pytest test_lead_spool.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+# Add current directory to path to import the lead spool
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lead_spool import LeadSpool, SpooledLeadId, REJECTED_FILE
+from sqlite_store import SQLiteDatabase
+
+def temporary_database():
+    return SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'spool.db'))
+
+def unavailable(lead):
+    raise RuntimeError('database unavailable')
+
+def make_spool(database, write, **options):
+    saved = []
+    spool = LeadSpool(database, write, directory=tempfile.mkdtemp(), on_saved=saved.append, **options)
+    return spool, saved
+
+def test_saved_directly():
+    """Test that a lead the database takes in time is not spooled"""
+    print("Testing direct writes...")
+
+    database = temporary_database()
+    spool, saved = make_spool(database, database.save_lead)
+
+    lead_id = spool.save({'email': 'a@example.com'})
+    assert lead_id and not isinstance(lead_id, SpooledLeadId)
+    assert spool.pending_bytes() == 0 and saved == []
+    assert database.get_all_leads()[0]['_id'] == lead_id
+    print("✅ Lead saved without touching the spool")
+
+def test_spool_and_replay():
+    """Test that a failed write is spooled and replayed exactly once"""
+    print("\nTesting spooling and replay...")
+
+    database = temporary_database()
+    spool, saved = make_spool(database, unavailable)
+
+    lead_id = spool.save({'email': 'a@example.com', 'firstName': 'Ann'})
+    assert isinstance(lead_id, SpooledLeadId)
+    assert spool.update(lead_id, {'detected_country': 'United Arab Emirates'})
+    assert spool.pending_bytes() > 0 and database.get_all_leads() == []
+    print("✅ Failed write spooled with its id")
+
+    assert spool.replay() == 1
+    leads = database.get_all_leads()
+    assert [lead['_id'] for lead in leads] == [lead_id]
+    assert leads[0]['firstName'] == 'Ann' and leads[0]['detected_country'] == 'United Arab Emirates'
+    assert [lead['email'] for lead in saved] == ['a@example.com']
+    assert spool.pending_bytes() == 0 and spool.replay() == 0
+    print("✅ Replay stores the lead once, applies the late update and reports it as saved")
+
+def test_replay_is_idempotent():
+    """Test that leads already stored come back as duplicates and are skipped"""
+    print("\nTesting duplicates...")
+
+    database = temporary_database()
+    spool, saved = make_spool(database, unavailable)
+
+    # A Google Ads lead that an earlier delivery already stored
+    database.save_lead_once({'email': 'g@example.com', 'source': 'Google Ads Lead Form', 'lead_id': 'L1'})
+    spool.save({'email': 'g@example.com', 'source': 'Google Ads Lead Form', 'lead_id': 'L1'})
+    # A lead replayed before a crash that left it in the spool
+    lead = {'email': 'b@example.com'}
+    spool.save(lead)
+    database.insert_leads([dict(lead)])
+
+    assert spool.replay() == 0
+    assert spool.stats['replay_duplicates'] == 2 and len(database.get_all_leads()) == 2
+    assert saved == []
+    print("✅ Both duplicates skipped, nothing reported as new")
+
+def test_late_write():
+    """Test that a write that finishes after its budget is not stored twice"""
+    print("\nTesting late writes...")
+
+    database = temporary_database()
+    release = threading.Event()
+
+    def slow(lead):
+        release.wait(5)
+        return database.save_lead(lead)
+
+    spool, saved = make_spool(database, slow, budget=0.05)
+    lead_id = spool.save({'email': 'slow@example.com'})
+    assert isinstance(lead_id, SpooledLeadId) and spool.stats['slow_writes'] == 1
+
+    release.set()
+    for _ in range(100):
+        if saved:
+            break
+        time.sleep(0.01)
+    assert [lead['_id'] for lead in saved] == [lead_id]
+
+    assert spool.replay() == 0
+    assert len(database.get_all_leads()) == 1 and len(saved) == 1
+    print("✅ Late write stores the lead, replay skips it")
+
+class RefusingDatabase(SQLiteDatabase):
+    """Refuses leads for refused@ (failing the whole batch, like a document too large to send)
+    and invalid@ (with an error code); down=True makes every call fail"""
+    down = False
+
+    def insert_leads(self, leads):
+        if self.down or any(lead['email'] == 'refused@example.com' for lead in leads):
+            return {index: (None, 'document too large') for index in range(len(leads))}
+        failures = {index: (121, 'Document failed validation')
+                    for index, lead in enumerate(leads) if lead['email'] == 'invalid@example.com'}
+        failures.update(super().insert_leads([lead for lead in leads if lead['email'] != 'invalid@example.com']))
+        return failures
+
+    def get_schema_version(self):
+        return None if self.down else super().get_schema_version()
+
+def test_refused_leads():
+    """Test that leads the database refuses are set aside instead of blocking the replay"""
+    print("\nTesting refused leads...")
+
+    database = RefusingDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'spool.db'))
+    spool, saved = make_spool(database, unavailable, max_attempts=2)
+    for email in ('refused@example.com', 'invalid@example.com', 'a@example.com'):
+        spool.save({'email': email})
+    spool.update(spool.save({'email': 'b@example.com'}), {'detected_country': 'India'})
+
+    database.down = True
+    assert spool.replay() == 0 and spool.stats['rejected'] == 0
+    print("✅ Database down: nothing rejected, every lead kept")
+
+    database.down = False
+    assert spool.replay() == 2
+    assert sorted(lead['email'] for lead in saved) == ['a@example.com', 'b@example.com']
+    assert spool.stats['rejected'] == 1 and spool.pending_bytes() > 0
+    assert database.get_all_leads()[0]['detected_country'] == 'India'
+    print("✅ Lead with an error code rejected at once, the leads behind it stored")
+
+    assert spool.replay() == 0
+    assert spool.stats['rejected'] == 2 and spool.pending_bytes() == 0
+    with open(os.path.join(spool.directory, REJECTED_FILE)) as f:
+        assert len(f.readlines()) == 2
+    print("✅ Lead refused without an error code rejected after max_attempts")
+
+def test_no_spool():
+    """Test that without a spool directory a failed write answers False"""
+    print("\nTesting without a spool...")
+
+    database = temporary_database()
+    spool = LeadSpool(database, unavailable, directory=None)
+    assert spool.save({'email': 'a@example.com'}) is False
+    assert spool.replay() == 0 and spool.pending_bytes() == 0
+    spool = LeadSpool(database, database.save_lead, directory=None)
+    assert spool.save({'email': 'a@example.com'}) and len(database.get_all_leads()) == 1
+    print("✅ Leads written directly, nothing spooled")
+
+def test_rejected_and_full():
+    """Test that torn lines are set aside and a full spool refuses leads"""
+    print("\nTesting torn lines and a full spool...")
+
+    database = temporary_database()
+    spool, _ = make_spool(database, unavailable)
+    spool.save({'email': 'a@example.com'})
+    with open(spool.path, 'ab') as f:
+        f.write(b'{"email": "torn\n')
+
+    assert spool.replay() == 1 and spool.stats['rejected'] == 1
+    assert os.path.exists(os.path.join(spool.directory, REJECTED_FILE))
+    print("✅ Torn line moved to the rejected file, the rest replayed")
+
+    spool, _ = make_spool(database, unavailable, max_bytes=10)
+    assert spool.save({'email': 'a@example.com'}) is False
+    assert spool.stats['spool_full'] == 1
+    print("✅ Full spool answers False so the caller can ask for a retry")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Lead Spool Tests")
+    print("=" * 50)
+
+    test_saved_directly()
+    test_spool_and_replay()
+    test_replay_is_idempotent()
+    test_late_write()
+    test_rejected_and_full()
+    test_refused_leads()
+    test_no_spool()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tests for the admin leads API (app.py /api/leads): every response is one
+page, the page size has a default and a cap, date filters and imported
+timestamps with a UTC offset are converted to the local time created_at is
+stored in, and the stats count the server's local days.
+Leads are stored in a temporary SQLite database (sqlite_store.py).
+Run with python test_leads_api.py or python -m pytest test_leads_api.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timezone, timedelta
+from contextlib import contextmanager
+
+# Add current directory to path to import app
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Leads the test can't store are spooled in a temporary directory, never the app's spool/
+os.environ['LEAD_SPOOL_DIR'] = tempfile.mkdtemp()
+
+import app as app_module
+from lead_ingest import build_lead
+from session_store import SessionStore
+from sqlite_store import SQLiteDatabase
+
+@contextmanager
+def admin_client(database):
+    """A test client for the app on database; yields (client, headers) with an admin token"""
+    sessions = SessionStore(database)
+    token, _ = sessions.create('admin', 'admin')
+    attributes = {'db': database, 'session_store': sessions, '_background_pid': os.getpid()}
+    original = {name: getattr(app_module, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(app_module, name, value)
+    try:
+        with app_module.app.test_client() as client:
+            yield client, {'Authorization': f"Bearer {token}"}
+    finally:
+        for name, value in original.items():
+            setattr(app_module, name, value)
+
+def test_date_filter_offsets():
+    """Test that a date filter with an offset is converted to local time, not just stripped"""
+    print("Testing date filter offsets...")
+
+    moment = datetime(2026, 1, 1, tzinfo=timezone(timedelta(hours=4)))
+    filters = app_module.parse_lead_filters({'date_from': '2026-01-01T00:00:00+04:00',
+                                             'date_to': '2025-12-31T20:00:00Z'})
+    expected = moment.astimezone().replace(tzinfo=None)
+    assert filters['date_from'] == expected and filters['date_to'] == expected
+    print("✅ +04:00 and Z give the same local time")
+
+    filters = app_module.parse_lead_filters({'date_from': '2026-01-01', 'date_to': '2026-01-01'})
+    assert filters['date_from'] == datetime(2026, 1, 1) and filters['date_to'] == datetime(2026, 1, 2)
+    print("✅ Plain dates are local days, date_to includes the whole day")
+
+def test_import_timestamps():
+    """Test that imported timestamps with an offset are converted to local time"""
+    print("\nTesting imported timestamps...")
+
+    expected = datetime(2026, 1, 1, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    for timestamp in ('2026-01-01T00:00:00Z', '2026-01-01T04:00:00+04:00', {'$date': '2026-01-01T00:00:00Z'}):
+        lead, error = build_lead({'email': 'ann@example.com', 'created_at': timestamp})
+        assert error is None and lead['created_at'] == expected
+
+    lead, _ = build_lead({'email': 'ann@example.com', 'Date': '2026-01-01', 'Time': '09:30:00'})
+    assert lead['created_at'] == datetime(2026, 1, 1, 9, 30)
+    print("✅ Z, +04:00 and $date give the same local time, naive timestamps are kept")
+
+def test_pages():
+    """Test that /api/leads always answers one page, with a default and a maximum size"""
+    print("\nTesting /api/leads pages...")
+
+    database = SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'leads.db'))
+    start = datetime(2026, 1, 1)
+    count = app_module.LEADS_PAGE_MAX + 10
+    assert database.insert_leads([
+        {'email': f"lead{index}@example.com", 'status': 'new', 'created_at': start + timedelta(minutes=index)}
+        for index in range(count)
+    ]) == {}
+
+    with admin_client(database) as (client, headers):
+        assert client.get('/api/leads').status_code == 401
+
+        page = client.get('/api/leads', headers=headers).get_json()
+        assert page['count'] == app_module.LEADS_PAGE_SIZE and page['next_cursor']
+        assert page['leads'][0]['email'] == f"lead{count - 1}@example.com"
+
+        page = client.get('/api/leads?limit=100000', headers=headers).get_json()
+        assert page['count'] == app_module.LEADS_PAGE_MAX
+
+        page = client.get(f"/api/leads?limit=100000&cursor={page['next_cursor']}", headers=headers).get_json()
+        assert page['count'] == 10 and page['next_cursor'] is None
+        print("✅ Default page size, capped limit and the last page")
+
+        assert client.get('/api/leads?cursor=not-a-cursor', headers=headers).status_code == 400
+        print("✅ Malformed cursor answered 400")
+
+        stats = client.get('/api/leads/stats', headers=headers).get_json()
+        assert stats['total'] == count and stats['day'] == {'2026-01-01': count}
+        today = date.today()
+        assert stats['today'] == today.isoformat() and stats['month_from'] == today.replace(day=1).isoformat()
+        print("✅ Stats days and the server's today are local dates")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Leads API Tests")
+    print("=" * 50)
+
+    test_date_filter_offsets()
+    test_import_timestamps()
+    test_pages()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
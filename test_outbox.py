@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Tests for the email outbox (outbox.py): sending batches, retries with backoff,
+giving up after max_attempts, reclaiming jobs whose lease expired, and leaving
+jobs queued while the SMTP circuit breaker is open.
+The jobs are stored in a temporary SQLite database (sqlite_store.py).
+Run with python test_outbox.py or python -m pytest test_outbox.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+# Add current directory to path to import the outbox
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from outbox import EmailOutbox
+from sqlite_store import SQLiteDatabase
+from circuit_breaker import CircuitBreaker
+
+def temporary_database():
+    return SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'outbox.db'))
+
+def build_message(to, subject='Hello'):
+    return ('noreply@example.com', [to], f"Subject: {subject}\n\nTest")
+
+class FakeSMTP:
+    """send_batch stand-in that refuses the addresses in refuse"""
+    def __init__(self, refuse=()):
+        self.refuse = set(refuse)
+        self.batches = []
+
+    def __call__(self, messages):
+        self.batches.append([to_addrs[0] for _, to_addrs, _ in messages])
+        return [(False, 'refused') if to_addrs[0] in self.refuse else (True, None) for _, to_addrs, _ in messages]
+
+def test_send_batch():
+    """Test that due jobs are claimed and sent together"""
+    print("Testing batch sending...")
+
+    database = temporary_database()
+    smtp = FakeSMTP()
+    outbox = EmailOutbox(database, {'notification': build_message}, smtp, workers=0, batch_size=2)
+
+    for i in range(3):
+        outbox.enqueue('notification', to=f"user{i}@example.com")
+
+    assert outbox.drain() == 3
+    assert smtp.batches == [['user0@example.com', 'user1@example.com'], ['user2@example.com']]
+    assert database.get_email_outbox_stats() == {'sent': 3}
+    assert outbox.drain() == 0
+    print("✅ Three jobs sent in batches of two")
+
+    try:
+        outbox.enqueue('unknown', to='user@example.com')
+        assert False, 'unknown kind was queued'
+    except ValueError:
+        print("✅ Unknown job kind refused")
+
+def test_retry_and_give_up():
+    """Test backoff retries and that a job fails permanently after max_attempts"""
+    print("\nTesting retries...")
+
+    database = temporary_database()
+    smtp = FakeSMTP(refuse={'bad@example.com'})
+    outbox = EmailOutbox(database, {'notification': build_message}, smtp, workers=0,
+                         max_attempts=3, base_delay=0)
+
+    outbox.enqueue('notification', to='bad@example.com')
+    outbox.enqueue('notification', to='good@example.com')
+    outbox.enqueue('notification', oops='no recipient')
+
+    # base_delay=0: a failed job is due again straight away
+    for _ in range(3):
+        outbox.process_batch()
+    assert database.get_email_outbox_stats() == {'sent': 1, 'failed': 2}
+    assert smtp.batches.count(['bad@example.com']) == 2
+    print("✅ Refused job retried until max_attempts, bad payload failed without sending")
+
+    outbox.base_delay, outbox.max_delay = 30, 100
+    assert [outbox.retry_delay(attempts) for attempts in (1, 2, 3, 4, 5)] == [30, 60, 100, 100, 100]
+
+    outbox.enqueue('notification', to='bad@example.com')
+    outbox.process_batch()
+    # Rescheduled 30 seconds out, so nothing is due now
+    assert outbox.process_batch() == 0
+    assert database.get_email_outbox_stats()['pending'] == 1
+    print("✅ Backoff doubles up to max_delay and delays the next attempt")
+
+def test_expired_lease():
+    """Test that a job claimed by a worker that died is claimed again once its lease expires"""
+    print("\nTesting leases...")
+
+    database = temporary_database()
+    outbox = EmailOutbox(database, {'notification': build_message}, FakeSMTP(), workers=0)
+    outbox.enqueue('notification', to='user@example.com')
+
+    job = database.claim_email_job('dead-worker', lease_seconds=60)
+    assert job['attempts'] == 1
+    assert database.claim_email_job('other-worker', lease_seconds=60) is None
+    print("✅ A leased job is not handed to another worker")
+
+    database = temporary_database()
+    outbox = EmailOutbox(database, {'notification': build_message}, FakeSMTP(), workers=0)
+    outbox.enqueue('notification', to='user@example.com')
+    database.claim_email_job('dead-worker', lease_seconds=0)
+    time.sleep(0.01)
+    job = database.claim_email_job('other-worker', lease_seconds=60)
+    assert job is not None and job['attempts'] == 2
+    outbox._finish(job, True, None)
+    assert database.get_email_outbox_stats() == {'sent': 1}
+    print("✅ A job whose lease expired is claimed again")
+
+def test_open_breaker_keeps_jobs():
+    """Test that workers leave jobs queued while the SMTP breaker is open"""
+    print("\nTesting the circuit breaker...")
+
+    database = temporary_database()
+    smtp = FakeSMTP()
+    breaker = CircuitBreaker('smtp-test', failure_threshold=1, reset_timeout=60)
+    outbox = EmailOutbox(database, {'notification': build_message}, smtp, workers=0, breaker=breaker)
+    outbox.enqueue('notification', to='user@example.com')
+
+    breaker.record_failure('connection refused')
+    assert outbox.process_batch() == 0
+    assert smtp.batches == []
+    job = database.claim_email_job('check', lease_seconds=0)
+    assert job['attempts'] == 1
+    print("✅ No job claimed and no attempt used while the breaker is open")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Email Outbox Tests")
+    print("=" * 50)
+
+    test_send_batch()
+    test_retry_and_give_up()
+    test_expired_lease()
+    test_open_breaker_keeps_jobs()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
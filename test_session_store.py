@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared session store (session_store.py): sessions are seen by
+every worker, expiry extensions are written back in batches by flush(), and
+failed writes or lookups are retried instead of being lost or cached.
+Sessions are stored in a temporary SQLite database (sqlite_store.py).
+Run with python test_session_store.py or python -m pytest test_session_store.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Add current directory to path to import the session store
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from session_store import SessionStore
+from sqlite_store import SQLiteDatabase
+
+def temporary_database():
+    return SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'sessions.db'))
+
+def test_shared_sessions():
+    """Test that a session created on one worker is valid on another until it is revoked"""
+    print("Testing shared sessions...")
+
+    database = temporary_database()
+    worker_a, worker_b = SessionStore(database), SessionStore(database)
+
+    token, expires_at = worker_a.create('manager1', 'manager')
+    session = worker_b.get(token)
+    assert session['username'] == 'manager1' and session['role'] == 'manager'
+    assert abs((session['expires_at'] - expires_at).total_seconds()) < 1
+    assert worker_b.get('unknown-token') is None and worker_b.get('') is None
+    print("✅ Session visible to another worker, unknown tokens rejected")
+
+    assert worker_a.revoke(token)
+    assert worker_a.get(token) is None
+    worker_b.cache.delete(token)
+    assert worker_b.get(token) is None
+    print("✅ Revoked session rejected")
+
+def test_write_behind():
+    """Test that refreshes are queued and written to the database by flush()"""
+    print("\nTesting write-behind refreshes...")
+
+    database = temporary_database()
+    store = SessionStore(database, session_hours=24, refresh_threshold=3600)
+    token, _ = store.create('admin', 'admin')
+
+    # Far from expiry: nothing to do
+    store.refresh(token)
+    assert store.stats()['pending_refreshes'] == 0
+
+    database.extend_sessions({token: datetime.now() + timedelta(minutes=30)})
+    store.cache.delete(token)
+    refreshed = store.refresh(token)
+    assert refreshed['expires_at'] > datetime.now() + timedelta(hours=23)
+    assert store.stats()['pending_refreshes'] == 1
+    assert database.get_session(token)['expires_at'] < datetime.now() + timedelta(hours=1)
+    print("✅ Refresh near expiry queued, database not written yet")
+
+    # A lookup that misses the cache still sees the queued refresh
+    store.cache.delete(token)
+    assert store.get(token)['expires_at'] == refreshed['expires_at']
+
+    assert store.flush() == 1 and store.flush() == 0
+    assert abs((database.get_session(token)['expires_at'] - refreshed['expires_at']).total_seconds()) < 1
+    print("✅ flush() writes the queued expiry in one batch")
+
+def test_failed_flush_is_retried():
+    """Test that refreshes that could not be written stay queued"""
+    print("\nTesting failed flushes...")
+
+    database = temporary_database()
+    store = SessionStore(database)
+    token, _ = store.create('admin', 'admin')
+    store.refresh(token, force=True)
+
+    extend_sessions = database.extend_sessions
+    database.extend_sessions = lambda expiries: False
+    assert store.flush() == 0 and store.stats()['pending_refreshes'] == 1
+
+    database.extend_sessions = extend_sessions
+    assert store.flush() == 1 and store.stats()['pending_refreshes'] == 0
+    print("✅ Refresh kept after a failed write and written on the next flush")
+
+def test_failed_lookup_not_cached():
+    """Test that a database error during a lookup is not remembered as an invalid token"""
+    print("\nTesting failed lookups...")
+
+    database = temporary_database()
+    store = SessionStore(database)
+    token, _ = SessionStore(database).create('admin', 'admin')
+
+    get_session = database.get_session
+
+    def unavailable(token):
+        raise RuntimeError('database unavailable')
+
+    database.get_session = unavailable
+    assert store.get(token) is None
+    database.get_session = get_session
+    assert store.get(token)['username'] == 'admin'
+    print("✅ Token valid again as soon as the database answers")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Session Store Tests")
+    print("=" * 50)
+
+    test_shared_sessions()
+    test_write_behind()
+    test_failed_flush_is_retried()
+    test_failed_lookup_not_cached()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Tests that the SQLite backend (sqlite_store.py) answers like the MongoDB
+backend (database.py): the same calls are made on both and their results
+compared. MongoDB is emulated with mongomock (pip install -r requirements-dev.txt);
+without it these tests are skipped.
+Run with python test_sqlite_store.py or python -m pytest test_sqlite_store.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+# Add current directory to path to import the backends
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+import database as mongo_backend
+import migrations
+from sqlite_store import SQLiteDatabase
+from lead_ingest import DUPLICATE_KEY
+from storage import new_id
+from migrations import LATEST_VERSION
+
+START = datetime(2024, 3, 1, 9, 0)
+
+LEADS = [
+    {'firstName': 'Alice', 'email': 'alice@example.com', 'status': 'new', 'source': 'Website Contact Form',
+     'country': 'UAE', 'propertyType': 'Villa'},
+    {'firstName': 'Bob', 'email': 'bob@example.com', 'status': 'contacted', 'source': 'Website Contact Form',
+     'country': 'UK', 'propertyType': 'Apartment'},
+    {'firstName': 'Carol', 'email': 'carol@example.com', 'status': 'new', 'source': 'Google Ads Lead Form',
+     'country': 'UAE', 'propertyType': 'Villa', 'lead_id': 'G1'},
+    {'firstName': 'Dan', 'email': 'dan@example.com', 'status': 'new', 'source': 'Website Contact Form',
+     'country': 'India', 'interest': 'Villa'},
+    {'firstName': 'Eve', 'email': 'eve@example.com', 'status': 'closed', 'source': 'Website Contact Form',
+     'country': 'UK', 'propertyType': 'Penthouse'},
+]
+
+def sqlite_database():
+    return SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'parity.db'))
+
+def both(scenario):
+    """Run scenario on a fresh MongoDB (mongomock) and SQLite backend; returns both results"""
+    # mongomock has no %L (milliseconds) in $dateToString
+    json_fields = {**mongo_backend.LEAD_JSON_FIELDS,
+                   'timestamp': {'$dateToString': {'date': '$created_at', 'format': '%Y-%m-%dT%H:%M:%S'}}}
+    original = mongo_backend.LEAD_JSON_FIELDS, mongo_backend.ROLLUP_REBUILD_SETTLE_SECONDS
+    mongo_backend.LEAD_JSON_FIELDS, mongo_backend.ROLLUP_REBUILD_SETTLE_SECONDS = json_fields, 0
+    try:
+        mongo_result = scenario(mongo_database())
+    finally:
+        mongo_backend.LEAD_JSON_FIELDS, mongo_backend.ROLLUP_REBUILD_SETTLE_SECONDS = original
+    return mongo_result, scenario(sqlite_database())
+
+def mongo_database():
+    """A fresh, migrated MongoDB backend on mongomock"""
+    original = mongo_backend.MongoClient
+    mongo_backend.MongoClient = mongomock.MongoClient
+    try:
+        database = mongo_backend.Database(verify_schema=False, mongo_uri='mongodb://localhost')
+    finally:
+        mongo_backend.MongoClient = original
+    migrations.migrate(database, log=lambda message: None)
+    return database
+
+def seed(database):
+    """Insert LEADS one minute apart with the same ids on every backend"""
+    ids = [f"65e1a0000000000000000{index:03d}" for index in range(len(LEADS))]
+    # insert_leads keeps created_at (save_lead stamps the current time)
+    assert database.insert_leads([
+        {**lead, '_id': lead_id, 'created_at': START + timedelta(minutes=index), 'updated_at': START}
+        for index, (lead_id, lead) in enumerate(zip(ids, LEADS))
+    ]) == {}
+    return ids
+
+def emails(leads):
+    return [lead.get('email') for lead in leads]
+
+def skipped():
+    if mongomock is None:
+        print("⚠️  mongomock is not installed, skipped")
+        return True
+    return False
+
+def test_lead_queries():
+    """Test that listing, paging and filtering leads match"""
+    if skipped():
+        return
+    print("Testing lead queries...")
+
+    def scenario(database):
+        seed(database)
+        pages, cursor = [], None
+        while True:
+            page, cursor = database.get_leads_page({'status': 'new'}, limit=2, cursor=cursor, fields=['email'])
+            pages.append(emails(page))
+            if not cursor:
+                break
+        return {
+            'all': [(lead['_id'], lead['email'], lead['timestamp'][:19]) for lead in database.get_all_leads()],
+            'pages': pages,
+            'search': emails(database.get_leads_page({'search': 'ALI'})[0]),
+            'interest': emails(database.get_leads_page({'interest': 'Villa'})[0]),
+            'country': emails(database.iter_leads({'country': 'UK'}, fields=['email'])),
+            'dates': emails(database.iter_leads({'date_from': START + timedelta(minutes=1),
+                                                 'date_to': START + timedelta(minutes=3)})),
+        }
+
+    mongo, sqlite = both(scenario)
+    assert mongo == sqlite, (mongo, sqlite)
+    assert mongo['pages'] == [['dan@example.com', 'carol@example.com'], ['alice@example.com']]
+    assert mongo['all'][0][2] == '2024-03-01T09:04:00'
+    # date_to is exclusive
+    assert mongo['dates'] == ['carol@example.com', 'bob@example.com']
+    print("✅ get_all_leads, paging, search, interest, country and date filters match")
+
+def test_lead_changes():
+    """Test that saving, deduplicating, updating and deleting leads match, rollups included"""
+    if skipped():
+        return
+    print("\nTesting lead changes...")
+
+    def scenario(database):
+        ids = seed(database)
+        duplicate = database.save_lead_once({**LEADS[2], '_id': new_id()})
+        failures = database.insert_leads([{'_id': ids[0], 'email': 'again@example.com'},
+                                          {'_id': new_id(), 'email': 'frank@example.com', 'status': 'new'}])
+        updated = database.update_lead(ids[1], {'status': 'new'})
+        missing = database.update_lead(new_id(), {'status': 'new'})
+        deleted = database.delete_leads_bulk([ids[3], ids[4], new_id()])
+        assigned = database.assign_lead_to_manager(ids[0], 'manager1')
+        return {
+            'duplicate': duplicate,
+            'failures': {index: code for index, (code, _) in failures.items()},
+            'updated': (updated, missing),
+            'deleted': (deleted, database.delete_lead(ids[2]), database.delete_lead(ids[2])),
+            'left': sorted(emails(database.get_all_leads())),
+            'manager': (assigned, emails(database.get_manager_leads('manager1'))),
+            'rollups': database.get_lead_rollups(),
+            'rebuilt': (database.rebuild_lead_rollups() is not None) and database.get_lead_rollups(),
+        }
+
+    mongo, sqlite = both(scenario)
+    assert mongo == sqlite, (mongo, sqlite)
+    assert mongo['duplicate'] is None and mongo['failures'] == {0: DUPLICATE_KEY}
+    assert mongo['deleted'] == (2, True, False)
+    assert mongo['rollups'] == mongo['rebuilt'] and mongo['rollups']['day']['2024-03-01'] == 2
+    print("✅ Duplicates, updates, deletes and rollup counts match")
+
+def test_rollup_rebuild_holds_writes():
+    """Test that a lead write waits for a MongoDB rollup rebuild instead of being lost to its $out"""
+    print("\nTesting writes during a rollup rebuild...")
+    if skipped():
+        return
+
+    original = mongo_backend.ROLLUP_REBUILD_SETTLE_SECONDS
+    mongo_backend.ROLLUP_REBUILD_SETTLE_SECONDS = 0.2
+    try:
+        database = mongo_database()
+        seed(database)
+        rebuilt = []
+        rebuild = threading.Thread(target=lambda: rebuilt.append(database.rebuild_lead_rollups()))
+        rebuild.start()
+        while rebuild.is_alive() and not database.lead_rollups_lock.find_one({'_id': 'rebuild'}):
+            time.sleep(0.01)
+
+        # Saved during the rebuild, so it has to wait for it to be counted
+        assert database.save_lead({'email': 'late@example.com', 'status': 'new'})
+        assert rebuilt and rebuilt[0] is not None
+        rebuild.join()
+    finally:
+        mongo_backend.ROLLUP_REBUILD_SETTLE_SECONDS = original
+
+    rollups = database.get_lead_rollups()
+    assert rollups['total']['all'] == len(LEADS) + 1 and rollups['status']['new'] == 4
+    assert database.lead_rollups_lock.count_documents({}) == 0
+
+    database.lead_rollups_lock.insert_one({'_id': 'rebuild', 'expires_at': datetime.now() + timedelta(minutes=1)})
+    assert database.rebuild_lead_rollups() is None
+    print("✅ The write waited for the rebuild and was counted, a second rebuild is refused")
+
+def test_sessions_and_config():
+    """Test that sessions, revoked tokens, website config and managers match"""
+    if skipped():
+        return
+    print("\nTesting sessions, config and managers...")
+
+    def scenario(database):
+        expires_at = (datetime.now() + timedelta(hours=1)).replace(microsecond=0)
+        database.save_session('token-1', 'admin', expires_at, role='admin')
+        database.save_session('token-2', 'manager1', datetime.now() - timedelta(seconds=1))
+        database.extend_sessions({'token-1': expires_at + timedelta(hours=1)})
+        session = database.get_session('token-1')
+        database.revoke_token('jti-1', expires_at)
+        database.revoke_token('jti-old', datetime.now() - timedelta(seconds=1))
+
+        versions = [database.get_website_config_version()]
+        versions.append(database.save_website_config({'content': {'title': 'A'}}, 0))
+        versions.append(database.save_website_config({'content': {'title': 'B'}}, 0))
+        config = database.get_website_config()
+
+        database.create_manager('manager1', 'hash', 'm1@example.com')
+        duplicate_manager = database.create_manager('manager1', 'hash')
+        database.update_manager('manager1', {'email': 'new@example.com'})
+        return {
+            'session': (session['username'], session['role'], session['expires_at'] - expires_at),
+            'expired': database.get_session('token-2'),
+            'deleted': (database.delete_session('token-1'), database.get_session('token-1')),
+            'revoked': sorted(database.get_revoked_tokens()),
+            'versions': versions,
+            'config': (config['version'], config['content']),
+            'managers': [(manager['username'], manager['email']) for manager in database.get_all_managers()],
+            'duplicate_manager': duplicate_manager,
+            'removed': (database.delete_manager('manager1'), database.get_manager('manager1')),
+        }
+
+    mongo, sqlite = both(scenario)
+    assert mongo == sqlite, (mongo, sqlite)
+    assert mongo['versions'] == [0, 1, None] and mongo['revoked'] == ['jti-1']
+    print("✅ Session expiry, revocations, config versions and managers match")
+
+def test_migration_defaults():
+    """Test the migration bookkeeping a backend that manages its own schema gets from Storage"""
+    print("\nTesting migration bookkeeping defaults...")
+
+    database = sqlite_database()
+    assert sorted(database.get_applied_migrations()) == list(range(1, LATEST_VERSION + 1))
+    assert database.record_migration(LATEST_VERSION, 'step', 0)
+    assert migrations.migrate(database, log=lambda message: None) == 0
+
+    assert database.acquire_migration_lock('runner-a', 60)
+    assert not database.acquire_migration_lock('runner-b', 60)
+    assert database.release_migration_lock('runner-b') and not database.acquire_migration_lock('runner-b', 60)
+    assert database.release_migration_lock('runner-a') and database.acquire_migration_lock('runner-b', 60)
+    print("✅ Every version up to the schema version applied, the lock keeps a second runner out")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("SQLite / MongoDB Backend Parity Tests")
+    print("=" * 50)
+
+    test_lead_queries()
+    test_lead_changes()
+    test_rollup_rebuild_holds_writes()
+    test_sessions_and_config()
+    test_migration_defaults()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
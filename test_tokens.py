@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for signed access tokens and the shared revocation list (tokens.py),
+and for logging out a signed token through the session store.
+The revocation list is stored in a temporary SQLite database (sqlite_store.py).
+Run with python test_tokens.py or python -m pytest test_tokens.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Add current directory to path to import tokens
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from tokens import TokenSigner, RevocationList, is_signed_token, TOKEN_PREFIX
+from session_store import SessionStore
+from sqlite_store import SQLiteDatabase
+
+def temporary_database():
+    return SQLiteDatabase('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'tokens.db'))
+
+def test_sign_and_verify():
+    """Test that a signed token carries its claims and only verifies with the right key"""
+    print("Testing signed tokens...")
+
+    signer = TokenSigner('test-secret')
+    expires_at = (datetime.now() + timedelta(hours=1)).replace(microsecond=0)
+    token = signer.sign('admin', 'admin', expires_at)
+
+    assert is_signed_token(token) and token.startswith(TOKEN_PREFIX)
+    assert not is_signed_token('random-session-token') and not is_signed_token(None)
+
+    claims = signer.verify(token)
+    assert claims['username'] == 'admin' and claims['role'] == 'admin'
+    assert claims['expires_at'] == expires_at and claims['jti']
+    assert signer.verify(signer.sign('admin', 'admin', expires_at))['jti'] != claims['jti']
+    print("✅ Token verifies with its username, role, expiry and a unique id")
+
+    assert TokenSigner('other-secret').verify(token) is None
+    payload, signature = token[len(TOKEN_PREFIX):].split('.')
+    forged = TokenSigner('other-secret').sign('admin', 'admin', expires_at)
+    assert signer.verify(f"{TOKEN_PREFIX}{forged.split('.')[1]}.{signature}") is None
+    assert signer.verify(token + 'x') is None
+    assert signer.verify(f"{TOKEN_PREFIX}{payload}") is None
+    assert signer.verify('v1.!!!.???') is None
+    print("✅ Wrong key, swapped payload and malformed tokens rejected")
+
+    assert signer.verify(signer.sign('admin', 'admin', datetime.now() - timedelta(seconds=1))) is None
+    print("✅ Expired token rejected")
+
+    try:
+        TokenSigner('')
+        assert False, 'signer created without a secret'
+    except ValueError:
+        print("✅ Signer refuses an empty secret")
+
+def test_revocation_list():
+    """Test that revocations are shared through the database and expire"""
+    print("\nTesting the revocation list...")
+
+    database = temporary_database()
+    worker_a, worker_b = RevocationList(database), RevocationList(database)
+    expires_at = datetime.now() + timedelta(hours=1)
+
+    assert worker_a.revoke('jti-1', expires_at)
+    assert 'jti-1' in worker_a and 'jti-1' not in worker_b
+    assert worker_b.sync() and 'jti-1' in worker_b
+    print("✅ A revocation reaches other workers on their next sync")
+
+    database.revoke_token('jti-old', datetime.now() - timedelta(seconds=1))
+    assert worker_b.sync() and 'jti-old' not in worker_b and len(worker_b) == 1
+    print("✅ Expired revocations are dropped")
+
+    class Unreachable:
+        def get_revoked_tokens(self):
+            return None
+
+        def revoke_token(self, jti, expires_at):
+            return False
+
+    offline = RevocationList(Unreachable())
+    offline.revoke('jti-2', expires_at)
+    assert offline.sync() is False and 'jti-2' in offline
+    print("✅ A failed sync keeps the local list")
+
+def test_session_store_logout():
+    """Test that logging out a signed token revokes it on every worker"""
+    print("\nTesting signed sessions...")
+
+    database = temporary_database()
+    signer = TokenSigner('test-secret')
+    worker_a = SessionStore(database, signer=signer)
+    worker_b = SessionStore(database, signer=signer)
+
+    token, _ = worker_a.create('manager1', 'manager')
+    assert worker_b.get(token)['username'] == 'manager1'
+
+    refreshed = worker_b.refresh(token, force=True)
+    assert refreshed['token'] != token and worker_a.get(refreshed['token']) is not None
+
+    assert worker_a.revoke(token)
+    assert worker_a.get(token) is None
+    worker_b.revocations.sync()
+    assert worker_b.get(token) is None
+    assert worker_b.get(refreshed['token']) is not None
+    print("✅ Logout revokes only that token, on every worker after a sync")
+
+    assert SessionStore(database).get(token) is None
+    print("✅ A store without a signer rejects signed tokens")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("Signed Token Tests")
+    print("=" * 50)
+
+    test_sign_and_verify()
+    test_revocation_list()
+    test_session_store_logout()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
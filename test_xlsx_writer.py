@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming XLSX writer (xlsx_writer.py): the workbook is a valid
+zip with the parts Excel needs, and cells get the right types and styles.
+Run with python test_xlsx_writer.py or python -m pytest test_xlsx_writer.py
+"""
+
+import io
+import os
+import sys
+import zipfile
+from datetime import datetime, date, time
+from xml.etree import ElementTree
+
+# Add current directory to path to import xlsx_writer
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from xlsx_writer import stream_xlsx, column_letter, excel_serial, STYLE_DATE, STYLE_DATETIME, STYLE_HEADER
+
+NS = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+COLUMNS = [('Name', 'text'), ('Phone', 'text'), ('Budget', 'number'), ('Created', 'datetime'), ('Day', 'date')]
+
+def read_sheet(data):
+    """{cell ref: (type, style, value)} of the first worksheet"""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        root = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+    cells = {}
+    for cell in root.iter(f"{{{NS['x']}}}c"):
+        value = cell.find('x:v', NS)
+        text = cell.find('x:is/x:t', NS)
+        cells[cell.get('r')] = (cell.get('t'), cell.get('s'),
+                                value.text if value is not None else text.text)
+    return cells
+
+def test_helpers():
+    """Test column letters and Excel serial numbers"""
+    print("Testing helpers...")
+
+    assert [column_letter(i) for i in (0, 25, 26, 51, 701, 702)] == ['A', 'Z', 'AA', 'AZ', 'ZZ', 'AAA']
+    assert excel_serial(date(1900, 3, 1)) == 61
+    assert excel_serial(datetime(2024, 1, 1, 12, 0)) == 45292.5
+    assert excel_serial(time(6, 0)) == 0.25
+    print("✅ Column letters and serial numbers match Excel")
+
+def test_workbook_parts():
+    """Test that the workbook contains every required part"""
+    print("\nTesting workbook structure...")
+
+    data = b''.join(stream_xlsx(COLUMNS, [], sheet_name='Leads <2024>'))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = set(archive.namelist())
+        assert names == {'[Content_Types].xml', '_rels/.rels', 'xl/workbook.xml',
+                         'xl/_rels/workbook.xml.rels', 'xl/styles.xml', 'xl/worksheets/sheet1.xml'}
+        for name in names:
+            ElementTree.fromstring(archive.read(name))
+        workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+        assert workbook.find('x:sheets/x:sheet', NS).get('name') == 'Leads <2024>'
+    print("✅ All parts present and well-formed XML")
+
+def test_cells():
+    """Test that values are written with the right type and style"""
+    print("\nTesting cells...")
+
+    rows = [
+        ['Jane & Co', '+971501234567', 1500000, datetime(2024, 1, 1, 12, 0), date(2024, 1, 1)],
+        ['Bad\x00chars', '0501234567', 'n/a', None, ''],
+    ]
+    cells = read_sheet(b''.join(stream_xlsx(COLUMNS, rows)))
+
+    assert cells['A1'] == ('inlineStr', str(STYLE_HEADER), 'Name')
+    assert cells['A2'] == ('inlineStr', None, 'Jane & Co')
+    assert cells['B2'] == ('inlineStr', None, '+971501234567')
+    assert cells['C2'] == (None, None, '1500000')
+    assert cells['D2'] == (None, str(STYLE_DATETIME), '45292.5')
+    assert cells['E2'] == (None, str(STYLE_DATE), '45292')
+    print("✅ Text, numbers, dates and datetimes typed and styled")
+
+    assert cells['A3'][2] == 'Badchars'
+    assert cells['B3'][2] == '0501234567'
+    assert cells['C3'] == ('inlineStr', None, 'n/a')
+    assert 'D3' not in cells and 'E3' not in cells
+    print("✅ Illegal XML characters dropped, leading zeros kept, empty cells omitted")
+
+def test_streaming():
+    """Test that a large sheet is yielded in several chunks"""
+    print("\nTesting streaming...")
+
+    rows = ([f"Lead {i}", f"+9715{i:08d}", i, datetime(2024, 1, 1), date(2024, 1, 1)] for i in range(20000))
+    chunks = list(stream_xlsx(COLUMNS, rows, chunk_size=16 * 1024))
+    assert len(chunks) > 3
+    cells = read_sheet(b''.join(chunks))
+    assert cells['A20001'][2] == 'Lead 19999'
+    print(f"✅ 20000 rows streamed in {len(chunks)} chunks")
+
+def main():
+    """Run all tests"""
+    print("=" * 50)
+    print("XLSX Writer Tests")
+    print("=" * 50)
+
+    test_helpers()
+    test_workbook_parts()
+    test_cells()
+    test_streaming()
+
+    print("\n" + "=" * 50)
+    print("Tests completed!")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
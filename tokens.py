@@ -0,0 +1,112 @@
+"""
+Signed Access Tokens for Dubai Smart Investment
+Self-describing tokens (username, role, expiry) signed with HMAC-SHA256, so any
+worker on any node can verify them without a database lookup. Logged-out tokens
+are kept in a small revocation list until they would have expired anyway.
+
+Token format:
+    v1.<base64url JSON claims>.<base64url signature>
+"""
+import hmac
+import json
+import base64
+import hashlib
+import secrets
+import threading
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = 'v1.'
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def is_signed_token(token):
+    """Signed tokens are told apart from random session tokens by their prefix"""
+    return bool(token) and token.startswith(TOKEN_PREFIX)
+
+class TokenSigner:
+    def __init__(self, secret):
+        if not secret:
+            raise ValueError('A secret key is required to sign tokens')
+        self._key = secret.encode('utf-8') if isinstance(secret, str) else secret
+
+    def sign(self, username, role, expires_at):
+        """Return a signed token for the user"""
+        claims = {
+            'u': username,
+            'r': role,
+            'exp': int(expires_at.timestamp()),
+            'jti': secrets.token_urlsafe(12)
+        }
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        return f"{TOKEN_PREFIX}{payload}.{self._signature(payload)}"
+
+    def verify(self, token):
+        """
+        Return {'username', 'role', 'expires_at', 'jti'} if the signature is valid
+        and the token has not expired, otherwise None
+        """
+        if not is_signed_token(token):
+            return None
+        try:
+            payload, signature = token[len(TOKEN_PREFIX):].split('.')
+            if not hmac.compare_digest(signature, self._signature(payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+            expires_at = datetime.fromtimestamp(claims['exp'])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        if expires_at <= datetime.now():
+            return None
+        return {
+            'username': claims['u'],
+            'role': claims['r'],
+            'expires_at': expires_at,
+            'jti': claims['jti']
+        }
+
+    def _signature(self, payload):
+        digest = hmac.new(self._key, payload.encode('ascii'), hashlib.sha256).digest()
+        return _b64encode(digest)
+
+class RevocationList:
+    """In-memory copy of the revoked token ids, reloaded from MongoDB by sync()"""
+    def __init__(self, database):
+        self.database = database
+        self._revoked = {}  # jti -> expires_at
+        self._lock = threading.Lock()
+
+    def __contains__(self, jti):
+        with self._lock:
+            return jti in self._revoked
+
+    def __len__(self):
+        with self._lock:
+            return len(self._revoked)
+
+    def revoke(self, jti, expires_at):
+        """Revoke a token id on this worker and record it for the others"""
+        with self._lock:
+            self._revoked[jti] = expires_at
+        return self.database.revoke_token(jti, expires_at)
+
+    def sync(self):
+        """Replace the local list with the database copy, keeping local entries that are still live"""
+        revoked = self.database.get_revoked_tokens()
+        if revoked is None:
+            return False
+
+        now = datetime.now()
+        with self._lock:
+            for jti, expires_at in self._revoked.items():
+                if expires_at > now:
+                    revoked.setdefault(jti, expires_at)
+            self._revoked = revoked
+        return True
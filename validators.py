@@ -0,0 +1,22 @@
+"""
+Input Validation for Dubai Smart Investment
+Shared by the API endpoints and the bulk lead import
+"""
+import re
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+PHONE_PATTERN = re.compile(r'^\+?[0-9]{8,15}$')
+PHONE_SEPARATORS = re.compile(r'[\s\-\(\)]+')
+
+def validate_email(email):
+    """Validate email format"""
+    return isinstance(email, str) and EMAIL_PATTERN.match(email) is not None
+
+def validate_phone(phone):
+    """Validate phone number format"""
+    if not isinstance(phone, str):
+        return False
+    # Remove spaces, dashes, and parentheses
+    cleaned_phone = PHONE_SEPARATORS.sub('', phone)
+    # Check if it contains only digits and + (for country code)
+    return PHONE_PATTERN.match(cleaned_phone) is not None
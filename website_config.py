@@ -0,0 +1,101 @@
+"""
+Website Configuration for Dubai Smart Investment
+The editor's content, design and image settings live in one MongoDB document
+with a version number that goes up on every save. Each worker keeps the parsed
+config and its JSON response body in memory and only re-reads the document when
+a cheap version check (at most every check_interval seconds) shows it changed.
+Saves are compare-and-swap on the version, so concurrent edits never overwrite
+each other.
+"""
+import os
+import json
+import time
+import threading
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ('content', 'design', 'images')
+
+class WebsiteConfig:
+    def __init__(self, database, check_interval=2.0, legacy_path='website_config.json', max_retries=5):
+        self.database = database
+        self.check_interval = check_interval
+        self.legacy_path = legacy_path
+        self.max_retries = max_retries
+
+        self.version = None
+        self.config = {}
+        self.body = b'{}'
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return (version, config, json_body), re-reading MongoDB only when the version changed"""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.check_interval:
+                    self._refresh()
+        return self.version, self.config, self.body
+
+    def update(self, changes):
+        """Merge {'content': {...}, 'design': {...}, 'images': {...}} into the config. Returns the new version."""
+        for _ in range(self.max_retries):
+            stored = self.database.get_website_config()
+            if stored is None:
+                raise RuntimeError('Could not read website configuration')
+
+            version = stored.pop('version')
+            stored.pop('updated_at', None)
+            for section in SECTIONS:
+                if isinstance(changes.get(section), dict):
+                    stored[section] = {**stored.get(section, {}), **changes[section]}
+            stored['lastUpdated'] = datetime.now().isoformat()
+
+            new_version = self.database.save_website_config(stored, version)
+            if new_version is not None:
+                with self._lock:
+                    self._set(new_version, stored)
+                return new_version
+
+            logger.info("Website configuration changed during save, retrying")
+
+        raise RuntimeError('Website configuration is being edited concurrently, please retry')
+
+    def _refresh(self):
+        self._checked_at = time.monotonic()
+        version = self.database.get_website_config_version()
+        if version is None or version == self.version:
+            # Unchanged, or MongoDB is unreachable: keep serving the copy we have
+            return
+
+        if version == 0 and self._import_legacy_file():
+            version = self.database.get_website_config_version()
+
+        stored = self.database.get_website_config()
+        if stored is None:
+            return
+        version = stored.pop('version')
+        stored.pop('updated_at', None)
+        self._set(version, stored)
+
+    def _set(self, version, config):
+        self.config = config
+        self.body = json.dumps({**config, 'version': version}).encode('utf-8')
+        self.version = version
+
+    def _import_legacy_file(self):
+        # Configs saved before MongoDB was used live in website_config.json; copy them over once
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return False
+        try:
+            with open(self.legacy_path, 'r') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read {self.legacy_path}: {str(e)}")
+            return False
+
+        if self.database.save_website_config(legacy, 0) is not None:
+            logger.info(f"Imported website configuration from {self.legacy_path}")
+        return True
@@ -0,0 +1,200 @@
+"""
+Streaming XLSX (Office Open XML) writer for Dubai Smart Investment
+Worksheet rows are written straight into a deflated zip entry and the archive is
+yielded in chunks, so exports never hold the whole workbook in memory.
+Strings are written inline (no shared strings table) to keep memory bounded.
+"""
+import io
+import re
+import zipfile
+from datetime import datetime, date, time
+from xml.sax.saxutils import escape
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Characters that are not allowed in XML 1.0 documents
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# Cell style ids from STYLES_XML
+STYLE_DATE = 1
+STYLE_TIME = 2
+STYLE_HEADER = 3
+STYLE_DATETIME = 4
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="3">'
+    '<numFmt numFmtId="164" formatCode="yyyy-mm-dd"/>'
+    '<numFmt numFmtId="165" formatCode="hh:mm:ss"/>'
+    '<numFmt numFmtId="166" formatCode="yyyy-mm-dd hh:mm:ss"/>'
+    '</numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="166" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+SHEET_START_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews>'
+    '<sheetData>'
+)
+
+SHEET_END_XML = '</sheetData></worksheet>'
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable file that collects zip output until it is drained"""
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+        self.pending = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        self.pending += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.pending = 0
+        return data
+
+def column_letter(index):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def excel_serial(value):
+    """Convert a date, time or datetime to an Excel serial number"""
+    if isinstance(value, datetime):
+        return (value.replace(tzinfo=None) - EXCEL_EPOCH).total_seconds() / 86400
+    if isinstance(value, date):
+        return (value - EXCEL_EPOCH.date()).days
+    return (value.hour * 3600 + value.minute * 60 + value.second) / 86400
+
+def _text_cell(ref, value, style=0):
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    style_attr = f' s="{style}"' if style else ''
+    return f'<c r="{ref}" t="inlineStr"{style_attr}><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _cell(ref, value, kind):
+    if value is None or value == '':
+        return ''
+    if kind == 'number' and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if kind == 'datetime' and isinstance(value, datetime):
+        return f'<c r="{ref}" s="{STYLE_DATETIME}"><v>{excel_serial(value)}</v></c>'
+    if kind == 'date' and isinstance(value, date):
+        return f'<c r="{ref}" s="{STYLE_DATE}"><v>{excel_serial(value)}</v></c>'
+    if kind == 'time' and isinstance(value, time):
+        return f'<c r="{ref}" s="{STYLE_TIME}"><v>{excel_serial(value)}</v></c>'
+    # Everything else (including phone numbers) is text so Excel keeps leading zeros and '+'
+    return _text_cell(ref, value)
+
+def stream_xlsx(columns, rows, sheet_name='Sheet1', chunk_size=64 * 1024):
+    """
+    Yield an .xlsx file as byte chunks.
+    columns is a list of (title, kind) where kind is text, number, date, time or datetime;
+    rows is an iterable of value lists in the same order.
+    """
+    letters = [column_letter(i) for i in range(len(columns))]
+    sink = _ChunkSink()
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        archive.writestr('_rels/.rels', ROOT_RELS_XML)
+        archive.writestr('xl/workbook.xml', WORKBOOK_XML.format(sheet_name=escape(sheet_name[:31])))
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML)
+        archive.writestr('xl/styles.xml', STYLES_XML)
+        yield sink.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            header = ''.join(_text_cell(f'{letter}1', title, STYLE_HEADER)
+                             for letter, (title, _) in zip(letters, columns))
+            sheet.write((SHEET_START_XML + f'<row r="1">{header}</row>').encode('utf-8'))
+
+            batch = []
+            for row_number, row in enumerate(rows, start=2):
+                cells = ''.join(_cell(f'{letter}{row_number}', value, kind)
+                                for letter, (_, kind), value in zip(letters, columns, row))
+                batch.append(f'<row r="{row_number}">{cells}</row>')
+
+                if len(batch) >= 500:
+                    sheet.write(''.join(batch).encode('utf-8'))
+                    batch = []
+                    if sink.pending >= chunk_size:
+                        yield sink.drain()
+
+            sheet.write((''.join(batch) + SHEET_END_XML).encode('utf-8'))
+
+    yield sink.drain()